@@ -1,6 +1,14 @@
-from flask import Flask
-from pymongo import MongoClient
+from flask import Flask, g
+from pymongo import MongoClient, ReturnDocument
 import datetime
+import os
+import sys
+import threading
+
+# The storage backends in util import each other as top level modules
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'util'))
+from db import connect
+from .repository import Repository
 
 # print("contractor.__init__")
 app = Flask(__name__)
@@ -9,10 +17,76 @@ app.config.from_object("settings")
 client = MongoClient(app.config['DB_HOST'], app.config['DB_PORT'])
 db = client[app.config['DATABASE']]
 
-def next_sequence(coll):
-    seq = int(db.control.find_one({'_id': coll})['seq'])
-    db.control.update_one({'_id': coll}, {'$set': {'seq': seq + 1}})
-    return seq
+# Invoices are read and written through store, in the store DB_TYPE names
+store = connect(app.config, client)
+
+def repo():
+    """The Repository of documents read and changed by this request"""
+    if 'repo' not in g:
+        g.repo = Repository(store, db)
+    return g.repo
+
+@app.after_request
+def flush_repo(response):
+    """Writes the changes the request made, unless it failed"""
+    if 'repo' in g:
+        g.repo.flush()
+    return response
+
+# Ids leased from a control counter at a time by next_sequence, by
+# counter; 1, no leasing, for any counter not named
+SEQUENCE_BLOCKS = app.config.get('SEQUENCE_BLOCKS', {})
+
+# coll -> [process id, next id, end of the block]
+_leases = {}
+# coll -> lock held while that counter's lease is used or refilled
+_lease_locks = {}
+_lease_locks_lock = threading.Lock()
+
+def _advance(coll, block):
+    """Advances the counter of coll by block and returns its old value"""
+    control = db.control.find_one_and_update(
+        {'_id': coll}, {'$inc': {'seq': block}},
+        return_document=ReturnDocument.BEFORE)
+    return int(control['seq'])
+
+def next_sequence(coll, block=None):
+    """
+    Returns the next id from the counter of coll in control. The counter
+    is advanced with a single atomic $inc, so no two callers, in this
+    process or any other, are given the same id.
+
+    With block (default SEQUENCE_BLOCKS[coll]) above 1 the counter is
+    advanced a block at a time, and the ids of the block are handed out
+    from memory by this process. Ids left when the process ends are
+    never used, so leasing suits counters where gaps do not matter, and
+    a counter changed on the control page takes effect once the blocks
+    already leased run out. Only callers of the same counter wait on a
+    refill.
+    """
+    block = block or SEQUENCE_BLOCKS.get(coll, 1)
+    if block <= 1:
+        return _advance(coll, 1)
+    with _lease_locks_lock:
+        lock = _lease_locks.setdefault(coll, threading.Lock())
+    pid = os.getpid()
+    with lock:
+        lease = _leases.get(coll)
+        # A forked worker must not hand out its parent's ids
+        if lease is None or lease[0] != pid or lease[1] >= lease[2]:
+            seq = _advance(coll, block)
+            lease = _leases[coll] = [pid, seq, seq + block]
+        seq = lease[1]
+        lease[1] += 1
+        return seq
+
+def stamp(doc):
+    """
+    Sets the modified time of an invoice document about to be written.
+    The incremental export picks up invoices modified since its last run.
+    """
+    doc['modified'] = datetime.datetime.utcnow()
+    return doc
 
 @app.template_filter()
 def oconv_date(value, format='%m/%d/%Y'):
@@ -1,4 +1,4 @@
-from .. import app, client, db, next_sequence
+from .. import app, client, db, next_sequence, repo, stamp, store
 from flask import flash, redirect, render_template, url_for, session, request, make_response
 import pdb
 from timesheet.model import TimeSheet
@@ -7,20 +7,28 @@ from bson import ObjectId
 from datetime import datetime
 import pdfkit
 
+def by_date(timesheet):
+    """Sort key of a timesheet; those with no date come first"""
+    return timesheet.get('date') or datetime.min
+
 def recalc(invoice):
     invoice['hours'] = 0
     invoice['amount'] = 0
     for ts in invoice['detail']:
-        invoice['hours'] += float(ts['hours'])
+        invoice['hours'] += float(ts.get('hours') or 0)
     
     if 'rate' not in invoice.keys():
-        rate = db.rates.find_one({'_id': invoice['client']})['rate']
+        rate = repo().get('rates', invoice['client'])['rate']
         invoice['rate'] = rate
     
     invoice['amount'] = float(invoice['hours'] * invoice['rate'])
     return invoice
      
 
+# Keys shown on the invoice list; the detail arrays are not fetched
+LIST_FIELDS = ['date', 'client', 'hours', 'amount', 'status', 'sent',
+               'close_date', 'check_number', 'paid_date']
+
 @app.route('/')
 @app.route('/invoice_list', methods=('GET', 'POST'))
 def invoice_list():
@@ -32,7 +40,7 @@ def invoice_list():
         client_id = request.args.get('client_id')
         filter = {'client': int(client_id)}
 
-    invoice_count = db.invoice.count(filter)
+    invoice_count = store.count('invoice', filter)
     clients = db.clients.find()
     
     clist = {}
@@ -42,8 +50,9 @@ def invoice_list():
     page_size = 20
     page_count = int(invoice_count / page_size)
     
-    items = db.invoice.find(filter).skip(
-        (page_number - 1) * page_size).limit(page_size).sort('date', DESCENDING)
+    items = store.query('invoice', filter, fields=LIST_FIELDS,
+                        sort=[('date', DESCENDING)],
+                        skip=(page_number - 1) * page_size, limit=page_size)
     return render_template('/invoice/list.html', items=items, clients=clist,
                            item_count=invoice_count, page_number=page_number, 
                            page_size=page_size, page_count=page_count)
@@ -55,13 +64,13 @@ def invoice_post(invoice_id):
     if 'cancel' in request.form:
         return redirect(url_for('invoice_list'))
 
-    invoice = db.invoice.find_one({'_id': invoice_id})
+    invoice = repo().get('invoice', invoice_id)
 
     if request.method == 'GET':
         return render_template('invoice/post.html', invoice=invoice)
 
     if 'sent' in request.form:
-        db.invoice.update_one({'_id': invoice_id}, {'$set': {'sent': 'Y'}})
+        repo().set('invoice', invoice_id, stamp({'sent': 'Y'}))
         return redirect(url_for('invoice_list'))
 
     if request.form['check_number'] == '' or request.form['date'] == '':
@@ -76,11 +85,11 @@ def invoice_post(invoice_id):
             invoice['check_number'] = request.form['check_number']
         return render_template('invoice/post.html', invoice_id=invoice_id, invoice=invoice)
 
-    invoice = db.invoice.find_one({'_id': invoice_id})
+    invoice = repo().get('invoice', invoice_id)
     invoice['check_number'] = request.form['check_number']
     invoice['status'] = 'paid'
     invoice['paid_date'] = datetime.strptime(request.form['date'], '%m/%d/%Y')
-    db.invoice.update({'_id': invoice_id}, invoice)
+    repo().save('invoice', stamp(invoice))
     return redirect(url_for('invoice_list'))
 
 
@@ -91,15 +100,15 @@ def invoice_close(invoice_id):
         return redirect(url_for('invoice_list'))
 
     if request.method == 'GET':
-        invoice = db.invoice.find_one({'_id': invoice_id})
-        if invoice['close_date'] == '':
+        invoice = repo().get('invoice', invoice_id)
+        if not invoice.get('close_date'):
             invoice['close_date'] = datetime.now()
         return render_template('invoice/close.html', invoice=invoice)
 
-    invoice = db.invoice.find_one({'_id': invoice_id})
+    invoice = repo().get('invoice', invoice_id)
     invoice['status'] = 'closed'
     invoice['close_date'] = datetime.strptime(request.form['date'], '%m/%d/%Y')
-    db.invoice.update({'_id': invoice_id}, invoice)
+    repo().save('invoice', stamp(invoice))
     return redirect(url_for('invoice_list'))
 
 
@@ -108,10 +117,10 @@ def invoice_open(invoice_id):
     if 'cancel' in request.form:
         return redirect(url_for('invoice_list'))
 
-    invoice = db.invoice.find_one({'_id': invoice_id})
+    invoice = repo().get('invoice', invoice_id)
     invoice['status'] = 'open'
     invoice['close_date'] = ''
-    db.invoice.update({'_id': invoice_id}, invoice)
+    repo().save('invoice', stamp(invoice))
     return redirect(url_for('invoice_edit', invoice_id=invoice_id))
 
 
@@ -125,8 +134,8 @@ def invoice_edit(invoice_id):
     """
     Reads back the invoice and sorts the detail by date
     """
-    invoice = db.invoice.find_one({'_id': invoice_id})
-    invoice['detail'] = sorted(invoice['detail'], key = lambda k: k['date'])
+    invoice = repo().get('invoice', invoice_id)
+    invoice['detail'] = sorted(invoice['detail'], key=by_date)
     return render_template('/invoice/edit.html', invoice=invoice)
 
 
@@ -141,8 +150,8 @@ def invoice_create():
 
     invoice = {}
     client_id = int(request.form['client_id'])
-    client_rec = db.clients.find_one({'_id': client_id})
-    rate = db.rates.find_one(int(client_rec['rate']))
+    client_rec = repo().get('clients', client_id)
+    rate = repo().get('rates', int(client_rec['rate']))
 
     invoice['_id'] = next_sequence('invoice')
     invoice['date'] = datetime.strptime(request.form['date'], '%m/%d/%Y')
@@ -158,7 +167,7 @@ def invoice_create():
     invoice['sent'] = ''
     invoice['rate'] = rate['rate']
     
-    db.invoice.insert_one(invoice)
+    repo().add('invoice', stamp(invoice))
     return redirect(url_for('invoice_list'))
 
 
@@ -167,10 +176,10 @@ def invoice_view(invoice_id):
     import pdb
     
     today = datetime.now().strftime('%m/%d/%Y')
-    invoice = db.invoice.find_one({'_id': invoice_id})
-    client_rec = db.clients.find_one({'_id': invoice['client']})
-    company = db.company.find_one({'_id': 1})
-    rate = db.rates.find_one({'_id': int(client_rec['rate'])})
+    invoice = repo().get('invoice', invoice_id)
+    client_rec = repo().get('clients', invoice['client'])
+    company = repo().get('company', 1)
+    rate = repo().get('rates', int(client_rec['rate']))
     invoice['rate'] = rate['rate']
 
     action = request.args['action']
@@ -183,7 +192,7 @@ def invoice_view(invoice_id):
     args['company'] = company
 
     if action == 'print':
-        if invoice['status'] == 'open':
+        if invoice.get('status') == 'open':
             flash('Invoice must first be closed')
             return render_template('invoice/view.html', 
                                    invoice=invoice, date=today, company=company, 
@@ -199,12 +208,11 @@ def invoice_view(invoice_id):
         inv_date = invoice['date'].strftime('%Y%m%d')
         invoice['rate'] = rate['rate']
 
-        if 'close_date' in invoice:
-            if invoice['close_date']:
-                inv_date = invoice['close_date'].strftime('%Y%m%d')
-                
+        if invoice.get('close_date'):
+            inv_date = invoice['close_date'].strftime('%Y%m%d')
+
         if len(invoice['detail']) > 0:
-            invoice['detail'] = sorted(invoice['detail'], key = lambda k: k['date'])
+            invoice['detail'] = sorted(invoice['detail'], key=by_date)
 
         file_name = '{}-{}-{}.pdf'.format(client_rec['prefix'], inv_date, str(invoice['_id']))
         _invoice = render_template('invoice/view.html', invoice=invoice,
@@ -1,4 +1,4 @@
-from contractor import app, client, db
+from contractor import app, client, db, store
 from datetime import datetime
 from flask import flash, redirect, render_template, url_for, request
 import pdb
@@ -13,30 +13,13 @@ def get_report():
     start_date = datetime.strptime(request.form['start_date'], '%m/%d/%Y')
     end_date = datetime.strptime(request.form['end_date'], '%m/%d/%Y')
 
-    ''' I have to do this in two steps until I learn the right way'''
-    invoice_query = [{'$match': {'paid_date': {'$gte': start_date, '$lte': end_date}}},
-                    {'$sort': {'paid_date': 1}}
-                    ]
-
-    pipeline2 = [{ 
-            '$match': {
-                'paid_date': {
-                    '$gte': start_date,
-                    '$lt': end_date
-                }    
-            }
-            }, {
-            '$group': {
-                '_id': 'null',
-                'Amount': {
-                    '$sum': '$amount'
-                },
-                'Hours': {
-                    '$sum': '$hours'
-                }
-            }
-        }]
-
-    invoices = db.invoice.aggregate(invoice_query)
-    totals = db.invoice.aggregate(pipeline2).next()
-    return render_template('/reports/results.html', items=invoices, totals=totals)
+    # The list takes in invoices paid on end_date, the totals stop the
+    # day before
+    invoices = store.query('invoice', {'paid_date': {'$gte': start_date,
+                                                     '$lte': end_date}},
+                           sort='paid_date')
+    totals = store.totals('invoice', ['amount', 'hours'],
+                          {'paid_date': {'$gte': start_date, '$lt': end_date}})
+    return render_template('/reports/results.html', items=invoices,
+                           totals={'Amount': totals['amount'],
+                                   'Hours': totals['hours']})
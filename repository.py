@@ -0,0 +1,95 @@
+"""
+Request scoped access to documents by _id.
+
+A Repository keeps every document it reads, by collection and _id, for
+the life of one request, so a route that needs the same document twice,
+or calls another route that does, reads it once. Changes are held
+until the request ends and then written with one write per changed
+document, whatever number of changes were made to it.
+
+Invoices are read and written through the storage backend (see
+util/db.py); the other collections go straight to Mongo, where the
+writes to each collection are sent as one bulk_write.
+
+Use:
+    invoice = repo().get('invoice', invoice_id)
+    invoice['status'] = 'closed'
+    repo().save('invoice', invoice)
+"""
+from pymongo import InsertOne, ReplaceOne, UpdateOne
+
+CREATE = 'create'
+REPLACE = 'replace'
+
+
+class Repository(object):
+
+    def __init__(self, store, db, stored=('invoice',)):
+        """
+        store is the storage backend of the collections in stored, db
+        the Mongo database of the others
+        """
+        self.store = store
+        self.db = db
+        self.stored = stored
+        # (collection, _id) -> document, None if there is none
+        self.docs = {}
+        # (collection, _id) -> CREATE, REPLACE or a dict of keys to set
+        self.pending = {}
+
+    def get(self, collection, id):
+        """Returns the document with _id id, reading it on first use"""
+        key = (collection, id)
+        if key not in self.docs:
+            if collection in self.stored:
+                self.docs[key] = self.store.read(collection, id)
+            else:
+                self.docs[key] = self.db[collection].find_one({'_id': id})
+        return self.docs[key]
+
+    def add(self, collection, doc):
+        """Creates doc when the request ends"""
+        key = (collection, doc['_id'])
+        self.docs[key] = doc
+        self.pending[key] = CREATE
+
+    def save(self, collection, doc):
+        """Replaces the document with doc when the request ends"""
+        key = (collection, doc['_id'])
+        self.docs[key] = doc
+        if self.pending.get(key) != CREATE:
+            self.pending[key] = REPLACE
+
+    def set(self, collection, id, fields):
+        """Sets the keys in fields on the document when the request ends"""
+        key = (collection, id)
+        if self.docs.get(key) is not None:
+            self.docs[key].update(fields)
+        change = self.pending.get(key)
+        if change in (CREATE, REPLACE):
+            return
+        self.pending[key] = dict(change or {}, **fields)
+
+    def flush(self):
+        """Writes the changes held so far"""
+        pending, self.pending = self.pending, {}
+        requests = {}
+        for (collection, id), change in pending.items():
+            doc = self.docs.get((collection, id))
+            if collection in self.stored:
+                if change == CREATE:
+                    self.store.create(collection, doc)
+                elif change == REPLACE:
+                    self.store.update(collection, id, doc, replace=True)
+                else:
+                    self.store.update(collection, id, change)
+                continue
+            if change == CREATE:
+                request = InsertOne(doc)
+            elif change == REPLACE:
+                request = ReplaceOne({'_id': id}, doc)
+            else:
+                request = UpdateOne({'_id': id}, {'$set': change})
+            requests.setdefault(collection, []).append(request)
+        for collection, batch in requests.items():
+            self.db[collection].bulk_write(batch)
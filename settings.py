@@ -3,4 +3,19 @@ DEBUG = True
 DATABASE = 'dev_contractor'
 DB_HOST = 'localhost'
 DB_PORT = 27017
+# Store the invoices are kept in: 'mongodb', or 'qm' for the QM files
 DB_TYPE = 'mongodb'
+# QM server the 'qm' store connects to. Requests check sessions out of a
+# pool of QM_POOL_SIZE; leave QM_HOST empty for one local connection,
+# which is only safe with a single threaded server
+QM_ACCOUNT = 'QMUSERS'
+QM_HOST = 'localhost'
+QM_PORT = -1
+QM_USER = ''
+QM_PASSWORD = ''
+QM_POOL = 'contractor'
+QM_POOL_SIZE = 4
+# Ids next_sequence leases from a control counter at a time, by counter,
+# e.g. {'timesheet': 20}; counters not named take one id at a time, so
+# period, company and client numbers are left without gaps
+SEQUENCE_BLOCKS = {}
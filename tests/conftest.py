@@ -0,0 +1,41 @@
+import importlib.util
+import os
+import sys
+
+import pytest
+
+# The util modules import each other as top level modules and run
+# against the in-process qmfake server, never a live QM
+os.environ['QMFAKE'] = '1'
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'util'))
+
+
+@pytest.fixture
+def qmfake():
+    """An empty fake server with one session connected to QMUSERS"""
+    import qmclient as qm
+    import qmfake
+    qm.DisconnectAll()
+    qmfake.accounts.clear()
+    qmfake.indices.clear()
+    qm.CacheRecords(False)
+    assert qm.ConnectLocal('QMUSERS') == 1
+    yield qmfake
+    qm.DisconnectAll()
+
+
+@pytest.fixture(scope='session')
+def contractor():
+    """The app package, with its invoices kept in QM"""
+    sys.path.insert(0, ROOT)
+    import settings
+    settings.DB_TYPE = 'qm'
+    settings.QM_HOST = ''
+    spec = importlib.util.spec_from_file_location(
+        'contractor', os.path.join(ROOT, '__init__.py'),
+        submodule_search_locations=[ROOT])
+    module = sys.modules['contractor'] = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    module.app.config['TESTING'] = True
+    return module
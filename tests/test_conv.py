@@ -0,0 +1,81 @@
+import datetime
+
+import pytest
+
+import conv
+
+VM = '\xfd'
+
+
+# Values as the server's IConv/OConv return them
+@pytest.mark.parametrize('value, code, internal', [
+    ('12/31/1967', 'D2/', '0'),
+    ('01/01/1968', 'D2/', '1'),
+    ('12/30/1967', 'D2/', '-1'),
+    ('01/15/2020', 'D2MDY', '19008'),
+    ('1/15/20', 'D2/', '19008'),
+    ('15 JAN 2020', 'D', '19008'),
+    ('15-01-2020', 'D-DMY', '19008'),
+    ('2020/01/15', 'D/YMD', '19008'),
+    ('01/15/29', 'D2/', '22296'),
+    ('01/15/30', 'D2/', '-13864'),
+    ('02/30/2020', 'D2/', ''),
+    ('tomorrow', 'D2/', ''),
+    ('50', 'MR2', '5000'),
+    ('50.00', 'MR2', '5000'),
+    ('1,234.56', 'MR2', '123456'),
+    ('$1,234.56', 'MD2$', '123456'),
+    ('1.005', 'MR2', '101'),
+    ('-1.005', 'MR2', '-101'),
+    ('1.50-', 'MR2', '-150'),
+    ('<1.50>', 'MR2', '-150'),
+    ('1.50CR', 'MR2', '-150'),
+    ('1.50DB', 'MR2', '150'),
+    ('12.5', 'MD20', '13'),
+    ('7', 'MD0', '7'),
+    ('', 'MR2', ''),
+    ('abc', 'MR2', ''),
+])
+def test_iconv(value, code, internal):
+    assert conv.iconv(value, code) == internal
+
+
+@pytest.mark.parametrize('internal, code, value', [
+    ('0', 'D2/', '12/31/67'),
+    ('19008', 'D2/', '01/15/20'),
+    ('19008', 'D4/', '01/15/2020'),
+    ('19008', 'D2MDY', 'JAN 15 20'),
+    ('19008', 'D', '15 JAN 2020'),
+    ('19008', 'D2', '15 JAN 20'),
+    ('19008', 'D-YMD', '2020-01-15'),
+    ('-1', 'D4/', '12/30/1967'),
+    ('x', 'D4/', 'x'),
+    ('5000', 'MR2', '50.00'),
+    ('123456', 'MR2,', '1,234.56'),
+    ('123456', 'MD2$,', '$1,234.56'),
+    ('-150', 'MR2', '-1.50'),
+    ('-150', 'MR2-', '1.50-'),
+    ('-150', 'MR2<', '<1.50>'),
+    ('-150', 'MR2C', '1.50CR'),
+    ('-150', 'MR2D', '1.50DB'),
+    ('0', 'MR2', '0.00'),
+    ('0', 'MR2Z', ''),
+    ('13', 'MD20', '13.00'),
+    ('12345', 'MD23', '12.35'),
+    ('', 'MR2', ''),
+    ('abc', 'MR2', 'abc'),
+])
+def test_oconv(internal, code, value):
+    assert conv.oconv(internal, code) == value
+
+
+def test_iconv_takes_dates_and_numbers():
+    assert conv.iconv(datetime.datetime(2020, 1, 15, 9, 30), 'D2/') == '19008'
+    assert conv.iconv(datetime.date(2020, 1, 15), 'D2/') == '19008'
+    assert conv.iconv(62.5, 'MR2') == '6250'
+    assert conv.iconv(1.005, 'MR2') == '101'
+
+
+def test_convs_keep_marks():
+    assert conv.iconvs('1.5' + VM + VM + '2', 'MR2') == '150' + VM + VM + '200'
+    assert conv.oconvs(['19008', '0'], 'D4/') == ['01/15/2020', '12/31/1967']
@@ -0,0 +1,100 @@
+import datetime
+
+import pytest
+
+pytest.importorskip('pymongo')
+mongomock = pytest.importorskip('mongomock')
+
+import export
+import qmsupport as qms
+
+START = datetime.datetime(2020, 1, 1)
+
+
+@pytest.fixture
+def mongo(qmfake, tmp_path, monkeypatch):
+    monkeypatch.setattr(export, 'STATE_DIR', str(tmp_path))
+    monkeypatch.setattr(export, 'CHECKPOINT',
+                        str(tmp_path / 'checkpoint.json'))
+    db = mongomock.MongoClient()['contractor']
+    monkeypatch.setattr(export, 'db', db)
+    db.invoice.insert_many([
+        {'_id': n, 'client': 1, 'date': START, 'hours': 1.0,
+         'amount': 10.0, 'modified': START,
+         'detail': [{'_id': n * 10, 'date': START, 'description': 'work',
+                     'hours': 1.0}]}
+        for n in range(1, 21)])
+    return db
+
+
+@pytest.fixture
+def adds(monkeypatch):
+    """
+    Records the ids BulkWriter.add is given. Set fail to make the call
+    after that many raise, as if the connection was lost.
+    """
+    add = qms.BulkWriter.add
+    log = {'ids': [], 'fail': None}
+
+    def logged_add(self, id, rec):
+        if log['fail'] is not None and len(log['ids']) == log['fail']:
+            log['fail'] = None
+            raise Exception("Lost connection")
+        log['ids'].append(id)
+        return add(self, id, rec)
+
+    monkeypatch.setattr(qms.BulkWriter, 'add', logged_add)
+    return log
+
+
+def test_serial_export_resumes_after_last_batch(mongo, qmfake, adds):
+    # Each invoice adds an INVOICE then a TIMESHEET record; the 18th add
+    # is invoice 9's timesheet, after the batches up to invoice 8 commit
+    adds['fail'] = 17
+    with pytest.raises(Exception):
+        export.export(['INVOICE', 'TIMESHEET'], batch_size=4)
+    checkpoint = export.load_checkpoint()
+    assert checkpoint['last_id'] == {'INVOICE': 8, 'TIMESHEET': 8}
+    assert export.load_watermark('INVOICE') is None
+
+    adds['ids'] = []
+    export.export(['INVOICE', 'TIMESHEET'], batch_size=4, resume=True)
+    assert adds['ids'][:2] == ['9', '90']
+    assert len(qmfake.accounts['QMUSERS']['INVOICE']) == 20
+    assert len(qmfake.accounts['QMUSERS']['TIMESHEET']) == 20
+    assert export.load_checkpoint() is None
+    assert export.load_watermark('INVOICE') == START
+
+
+def test_partition_resumes_from_its_checkpoint(mongo, qmfake, adds):
+    args = (['INVOICE'], None, (1, 21), {'INVOICE': {}}, 3, 100)
+    adds['fail'] = 7
+    with pytest.raises(Exception):
+        export._export_partition(args)
+    path = export.partition_checkpoint((1, 21))
+    assert export.load_checkpoint(path)['last_id'] == {'INVOICE': 6}
+
+    adds['ids'] = []
+    id_range, stats, changed, mark = export._export_partition(args)
+    assert adds['ids'][0] == '7' and stats['INVOICE']['records'] == 14
+    assert len(changed['INVOICE']) == 14 and mark == START
+    export.clear_checkpoint()
+    assert export.load_checkpoint(path) is None
+
+
+def test_resume_keeps_the_parallel_mode(mongo, monkeypatch):
+    checkpoint = export.new_checkpoint(['INVOICE'], None, True)
+    checkpoint.update(workers=4, ranges=[(1, 11), (11, 21)], done=[(1, 11)])
+    export.save_checkpoint(checkpoint)
+    calls = []
+    monkeypatch.setattr(export, 'export_parallel',
+                        lambda *args: calls.append(args))
+    export.export(['INVOICE'], resume=True)
+    (file_names, batch_size, full, cursor_batch_size, workers,
+     resumed), = calls
+    assert workers == 4 and resumed['done'] == [(1, 11)]
+
+
+def test_resume_without_checkpoint_starts_a_new_export(mongo, qmfake):
+    export.export(['INVOICE'], resume=True)
+    assert len(qmfake.accounts['QMUSERS']['INVOICE']) == 20
@@ -0,0 +1,59 @@
+import datetime
+
+import pytest
+
+pytest.importorskip('pymongo')
+mongomock = pytest.importorskip('mongomock')
+
+import export
+import importer
+import qmclient as qm
+import schema
+
+START = datetime.datetime(2020, 1, 1)
+
+
+@pytest.fixture
+def mongo(qmfake, monkeypatch):
+    qmfake.create_index('TIMESHEET', 'INVOICE', 4)
+    db = mongomock.MongoClient()['contractor']
+    monkeypatch.setattr(export, 'db', db)
+    invoices, timesheets = qm.Open('INVOICE'), qm.Open('TIMESHEET')
+    for n in range(1, 6):
+        qm.Write(invoices, str(n), schema.INVOICE.encode({
+            'client': 2, 'date': START, 'hours': 2.0, 'amount': 100.0,
+            'rate': 50.0, 'detail': [{'_id': n * 10}]}))
+        qm.Write(timesheets, str(n * 10), schema.TIMESHEET.encode({
+            'date': START, 'description': 'work', 'hours': 2.0,
+            'invoice': n}))
+    return db
+
+
+def test_import_upserts_invoices(mongo):
+    importer.import_invoices(batch_size=2)
+    assert mongo.invoice.count_documents({}) == 5
+    invoice = mongo.invoice.find_one({'_id': 3})
+    assert invoice['client'] == 2 and invoice['rate'] == 50.0
+    assert invoice['detail'] == [{'_id': 30, 'date': START,
+                                  'description': 'work', 'hours': 2.0}]
+
+
+def test_import_clears_fields_cleared_in_qm(mongo):
+    mongo.invoice.insert_one({
+        '_id': 1, 'client': 2, 'close_date': START, 'check_number': '55',
+        'modified': START,
+        'detail': [{'_id': 10, 'date': START, 'billed': True},
+                   {'_id': 11, 'date': '', 'description': 'draft'}]})
+    importer.import_invoices()
+    invoice = mongo.invoice.find_one({'_id': 1})
+    assert 'close_date' not in invoice and 'check_number' not in invoice
+    assert invoice['modified'] == START
+    assert [ts['_id'] for ts in invoice['detail']] == [10, 11]
+    assert invoice['detail'][0]['billed'] is True
+
+
+def test_import_refuses_without_the_timesheet_index(mongo, qmfake):
+    qmfake.indices.clear()
+    with pytest.raises(Exception):
+        importer.import_invoices()
+    assert mongo.invoice.count_documents({}) == 0
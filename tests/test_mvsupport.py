@@ -0,0 +1,113 @@
+import pytest
+
+import mvsupport as mvs
+from mvsupport import DynArray
+
+AM, VM, SM = '\xfe', '\xfd', '\xfc'
+
+REC = 'A' + AM + 'B1' + VM + 'B2' + SM + 'B2b' + AM + AM + 'D'
+
+
+@pytest.mark.parametrize('rec, f, v, sv, expected', [
+    (REC, 1, 0, 0, 'A'),
+    (REC, 2, 0, 0, 'B1' + VM + 'B2' + SM + 'B2b'),
+    (REC, 2, 2, 0, 'B2' + SM + 'B2b'),
+    (REC, 2, 2, 2, 'B2b'),
+    (REC, 3, 0, 0, ''),
+    (REC, 4, 0, 0, 'D'),
+    (REC, 5, 0, 0, ''),
+    (REC, 2, 3, 0, ''),
+    (REC, 2, 2, 3, ''),
+    (REC, 0, 0, 0, 'A'),
+    (REC, 2, -1, 0, 'B1' + VM + 'B2' + SM + 'B2b'),
+    ('', 1, 0, 0, ''),
+])
+def test_extract(rec, f, v, sv, expected):
+    assert DynArray(rec).extract(f, v, sv) == expected
+
+
+@pytest.mark.parametrize('rec, f, v, sv, new, expected', [
+    ('A' + AM + 'B', 2, 0, 0, 'X', 'A' + AM + 'X'),
+    ('A', 3, 0, 0, 'X', 'A' + AM + AM + 'X'),
+    ('A', 1, 3, 0, 'X', 'A' + VM + VM + 'X'),
+    ('A', 2, 2, 2, 'X', 'A' + AM + VM + SM + 'X'),
+    ('A' + AM + 'B', -1, 0, 0, 'X', 'A' + AM + 'B' + AM + 'X'),
+    ('A' + AM + 'B', 2, -1, 0, 'X', 'A' + AM + 'B' + VM + 'X'),
+    ('A' + AM + 'B', 2, 1, -1, 'X', 'A' + AM + 'B' + SM + 'X'),
+    ('A' + AM + 'B', 2, 0, 0, '', 'A' + AM),
+    ('', 1, 0, 0, 'X', 'X'),
+    ('', -1, 0, 0, 'X', 'X'),
+])
+def test_replace(rec, f, v, sv, new, expected):
+    assert str(DynArray(rec).replace(f, v, sv, new)) == expected
+
+
+@pytest.mark.parametrize('rec, f, v, sv, new, expected', [
+    ('A' + AM + 'B', 2, 0, 0, 'X', 'A' + AM + 'X' + AM + 'B'),
+    ('A' + AM + 'B', 1, 0, 0, 'X', 'X' + AM + 'A' + AM + 'B'),
+    ('A', 3, 0, 0, 'X', 'A' + AM + AM + 'X'),
+    ('A' + AM + 'B', -1, 0, 0, 'X', 'A' + AM + 'B' + AM + 'X'),
+    ('A' + AM + 'B', 2, 1, 0, 'X', 'A' + AM + 'X' + VM + 'B'),
+    ('A' + AM + 'B', 2, -1, 0, 'X', 'A' + AM + 'B' + VM + 'X'),
+    ('A', 1, 1, 2, 'X', 'A' + SM + 'X'),
+    ('', 1, 0, 0, 'X', 'X'),
+    ('', -1, 0, 0, 'X', 'X'),
+    ('A', 1, 0, 0, '', AM + 'A'),
+])
+def test_ins(rec, f, v, sv, new, expected):
+    assert str(DynArray(rec).ins(f, v, sv, new)) == expected
+
+
+@pytest.mark.parametrize('rec, f, v, sv, expected', [
+    ('A' + AM + 'B' + AM + 'C', 2, 0, 0, 'A' + AM + 'C'),
+    ('A' + AM + 'B' + AM + 'C', 3, 0, 0, 'A' + AM + 'B'),
+    ('A' + AM + 'B' + AM + 'C', 4, 0, 0, 'A' + AM + 'B' + AM + 'C'),
+    ('A' + VM + 'B', 1, 2, 0, 'A'),
+    ('A' + VM + 'B', 1, 3, 0, 'A' + VM + 'B'),
+    ('A' + VM + 'B' + SM + 'C', 1, 2, 1, 'A' + VM + 'C'),
+    ('A' + AM + AM + 'C', 2, 0, 0, 'A' + AM + 'C'),
+    ('A', 1, 0, 0, ''),
+    ('', 1, 0, 0, ''),
+])
+def test_delete(rec, f, v, sv, expected):
+    assert str(DynArray(rec).delete(f, v, sv)) == expected
+
+
+@pytest.mark.parametrize('rec, f, v, expected', [
+    ('', 0, 0, 0),
+    ('A', 0, 0, 1),
+    (REC, 0, 0, 4),
+    (REC, 2, 0, 2),
+    (REC, 2, 2, 2),
+    (REC, 3, 0, 0),
+    (REC, 9, 0, 0),
+])
+def test_dcount(rec, f, v, expected):
+    assert DynArray(rec).dcount(f, v) == expected
+
+
+@pytest.mark.parametrize('rec, item, order, expected', [
+    ('A' + AM + 'B' + AM + 'C', 'B', '', (1, 2)),
+    ('A' + AM + 'B' + AM + 'C', 'Z', '', (0, 4)),
+    ('A' + AM + 'C', 'B', 'AL', (0, 2)),
+    ('C' + AM + 'A', 'B', 'DL', (0, 2)),
+    ('2' + AM + '10', '5', 'AR', (0, 2)),
+    ('', 'A', '', (0, 1)),
+])
+def test_locate(rec, item, order, expected):
+    assert DynArray(rec).locate(item, 1, 0, 0, order) == expected
+
+
+def test_edits_chain():
+    rec = DynArray('1' + AM + '2')
+    rec.replace(4, 0, 0, 'D').ins(1, 0, 0, '0').delete(3)
+    assert str(rec) == '0' + AM + '1' + AM + AM + 'D'
+    assert rec.extract(4) == 'D'
+
+
+def test_raise_and_lower_all():
+    recs = ['A' + VM + 'B' + SM + 'C', 'A' + AM + 'B']
+    assert mvs.mv_raise_all(recs) == ['A' + AM + 'B' + VM + 'C',
+                                      'A' + AM + 'B']
+    assert mvs.mv_lower_all(recs) == ['A' + SM + 'B' + '\xfb' + 'C',
+                                      'A' + VM + 'B']
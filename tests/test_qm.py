@@ -0,0 +1,125 @@
+import datetime
+
+import pytest
+
+import qm as qmdb
+
+DAY = datetime.timedelta(days=1)
+START = datetime.datetime(2020, 1, 1)
+
+INDICES = [('INVOICE', 'CLIENT', 1), ('INVOICE', 'DATE', 2),
+           ('INVOICE', 'CLOSE.DATE', 5), ('INVOICE', 'PAID.DATE', 13),
+           ('INVOICE', 'CLIENT.DATE', [1, 2]), ('TIMESHEET', 'DATE', 1),
+           ('TIMESHEET', 'INVOICE', 4)]
+
+
+def make_store(qmfake, indices=INDICES):
+    for file_name, index, attr in indices:
+        qmfake.create_index(file_name, index, attr)
+    store = qmdb.QM()
+    for n in range(1, 13):
+        store.create('invoice', {
+            '_id': n, 'client': n % 3, 'date': START + n * DAY,
+            'hours': 2.0, 'amount': 100.0, 'rate': 50.0, 'sent': 'N',
+            'close_date': START + (n + 5) * DAY if n % 2 else '',
+            'detail': [{'_id': n * 10, 'date': START + n * DAY,
+                        'description': 'work', 'hours': 2.0}]})
+    return store
+
+
+@pytest.fixture
+def store(qmfake):
+    return make_store(qmfake)
+
+
+def ids(docs):
+    return [doc['_id'] for doc in docs]
+
+
+@pytest.mark.parametrize('indices', [INDICES, []])
+def test_query_with_and_without_indices(qmfake, indices):
+    store = make_store(qmfake, indices)
+    assert ids(store.query('invoice', {'client': 1},
+                           sort=[('date', -1)])) == [10, 7, 4, 1]
+    assert ids(store.query('invoice', {'date': {'$gt': START + 3 * DAY,
+                                                '$lte': START + 6 * DAY}},
+                           sort='date')) == [4, 5, 6]
+    assert ids(store.query('invoice', {'client': 2, 'date': {
+        '$gte': START + 5 * DAY}}, sort='date')) == [5, 8, 11]
+    assert ids(store.query('invoice', sort=[('close_date', 1)],
+                           limit=3)) == [2, 4, 6]
+    assert store.count('invoice', {'client': 0}) == 4
+    assert store.count('invoice', {'close_date': {'$gt': START}}) == 6
+
+
+def test_read_update_delete(store):
+    invoice = store.read('invoice', 3)
+    assert invoice['client'] == 0 and invoice['close_date'] == START + 8 * DAY
+    assert invoice['detail'] == [{'_id': 30, 'date': START + 3 * DAY,
+                                  'description': 'work', 'hours': 2.0}]
+    assert store.read('invoice', 3, fields=['client']) == {'_id': 3,
+                                                           'client': 0}
+    assert store.read('invoice', 99) is None
+
+    store.update('invoice', 3, {'sent': 'Y', 'detail': [
+        {'_id': 31, 'date': START, 'description': 'more', 'hours': 1.0}]})
+    invoice = store.read('invoice', 3)
+    assert invoice['sent'] == 'Y' and invoice['hours'] == 2.0
+    assert ids(invoice['detail']) == [31]
+    assert store.read('timesheet', 30) is None
+    assert store.read('timesheet', 31)['invoice'] == 3
+
+    store.delete('invoice', 3)
+    assert store.read('invoice', 3) is None
+    assert store.read('timesheet', 31) is None
+    assert store.count('invoice') == 11
+
+
+def test_query_fields_and_join(store):
+    docs = list(store.query('invoice', {'_id': {'$in': [2, 3]}},
+                            fields=['client', 'detail._id']))
+    assert docs == [{'_id': 2, 'client': 2, 'detail': [{'_id': 20}]},
+                    {'_id': 3, 'client': 0, 'detail': [{'_id': 30}]}]
+    docs = list(store.query('invoice', {'client': 1}, fields=['detail']))
+    assert [doc['detail'][0]['description'] for doc in docs] == ['work'] * 4
+
+
+def test_count(store):
+    assert store.count('invoice') == 12
+    assert store.count('invoice', {'client': 1}) == 4
+    assert store.count('invoice', {'date': {'$gte': START + 10 * DAY}}) == 3
+    assert store.count('invoice', {'client': 1, 'sent': 'N'}) == 4
+    with pytest.raises(Exception):
+        store.count('invoice', {'colour': 'red'})
+
+
+def test_invoice_list(store):
+    assert ids(store.invoice_list(start_date=START + 9 * DAY,
+                                  end_date=START + 12 * DAY)) == [12, 11,
+                                                                  10, 9]
+    assert ids(store.invoice_list(client=1, start_date=START)) == [10, 7, 4, 1]
+
+
+def test_complete_is_counted_once(store, monkeypatch):
+    passes = []
+    for name in ('select_iter', 'index_range'):
+        func = getattr(qmdb.qms, name)
+        monkeypatch.setattr(qmdb.qms, name, lambda *args, func=func, **kw: (
+            passes.append(func.__name__), func(*args, **kw))[1])
+
+    def page():
+        del passes[:]
+        assert store.count('invoice') == 12
+        assert ids(store.query('invoice', sort=[('date', -1)],
+                               limit=2)) == [12, 11]
+        return sorted(passes)
+
+    assert page() == ['index_range', 'index_range', 'select_iter',
+                      'select_iter']
+    assert page() == ['index_range', 'select_iter']
+    store.update('invoice', 5, {'sent': 'Y'})
+    assert page() == ['index_range', 'index_range', 'select_iter',
+                      'select_iter']
+    later = qmdb.time.monotonic() + qmdb.COMPLETE_TTL + 1
+    monkeypatch.setattr(qmdb.time, 'monotonic', lambda: later)
+    assert len(page()) == 4
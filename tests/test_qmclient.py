@@ -0,0 +1,49 @@
+import qmclient as qm
+
+
+def test_cache_answers_repeated_reads(qmfake):
+    qm.CacheRecords(True)
+    fno = qm.Open('INVOICE')
+    qm.Write(fno, '1', 'A')
+    assert qm.Read(fno, '1') == ('A', 0)
+    assert qm.Read(fno, '1') == ('A', 0)
+    assert qm.CacheStats()['hits'] == 1
+    qm.Write(fno, '1', 'B')
+    assert qm.Read(fno, '1') == ('B', 0)
+
+
+def test_cache_skips_a_read_that_raced_a_write(qmfake, monkeypatch):
+    qm.CacheRecords(True)
+    fno = qm.Open('INVOICE')
+    qm.Write(fno, '1', 'old')
+    read = qmfake._read
+
+    def racing_read(fno, id, err):
+        # The server answers with the old record, then another thread's
+        # write lands and drops the key before the reader caches it
+        addr = read(fno, id, err)
+        monkeypatch.setattr(qmfake, '_read', read)
+        qm.Write(fno, id, 'new')
+        return addr
+
+    monkeypatch.setattr(qmfake, '_read', racing_read)
+    assert qm.Read(fno, '1') == ('old', 0)
+    assert qm.Read(fno, '1') == ('new', 0)
+    assert qm.CacheStats()['records'] == 1
+
+
+def test_cache_skips_a_read_that_raced_a_clear(qmfake, monkeypatch):
+    qm.CacheRecords(True)
+    fno = qm.Open('INVOICE')
+    qm.Write(fno, '1', 'old')
+    read = qmfake._read
+
+    def racing_read(fno, id, err):
+        addr = read(fno, id, err)
+        monkeypatch.setattr(qmfake, '_read', read)
+        qm.ClearFile(fno)
+        return addr
+
+    monkeypatch.setattr(qmfake, '_read', racing_read)
+    assert qm.Readu(fno, '1', 0) == ('old', 0)
+    assert qm.Read(fno, '1')[1] != 0
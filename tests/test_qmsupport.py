@@ -0,0 +1,44 @@
+import qmclient as qm
+import qmsupport as qms
+
+
+def test_bulk_writer_commits_batches(qmfake):
+    fno = qm.Open('INVOICE')
+    writer = qms.BulkWriter(fno, batch_size=2, retry_delay=0)
+    for n in range(5):
+        writer.add(str(n), 'rec{}'.format(n))
+    stats = writer.close()
+    assert stats['records'] == 5 and stats['batches'] == 3
+    assert qmfake.accounts['QMUSERS']['INVOICE']['4'] == 'rec4'
+
+
+def test_bulk_writer_retries_failed_write(qmfake, monkeypatch):
+    fno = qm.Open('INVOICE')
+    write = qm.Write
+    failures = ['1']
+
+    def flaky_write(fno, id, data):
+        write(fno, id, data)
+        if id in failures:
+            failures.remove(id)
+            qmfake._current.set_error(1, 'Write failed')
+
+    monkeypatch.setattr(qm, 'Write', flaky_write)
+    writer = qms.BulkWriter(fno, batch_size=10, retry_delay=0)
+    for n in range(3):
+        writer.add(str(n), 'rec{}'.format(n))
+    stats = writer.close()
+    assert stats['retries'] == 1 and stats['records'] == 3
+    assert sorted(qmfake.accounts['QMUSERS']['INVOICE']) == ['0', '1', '2']
+
+
+def test_select_iter(qmfake):
+    qmfake.create_index('INVOICE', 'CLIENT', 1)
+    fno = qm.Open('INVOICE')
+    for n in range(1, 8):
+        qm.Write(fno, str(n), str(n % 2))
+    assert sorted(qms.select_iter(fno), key=int) == [str(n) for n in range(1, 8)]
+    assert sorted(qms.select_iter(fno, 'CLIENT', '0')) == ['2', '4', '6']
+    assert list(qms.select_iter(fno, 'CLIENT', '9')) == []
+    assert (sorted(qms.select_iter(fno, 'CLIENT', '1', records=True)) ==
+            [('1', '1'), ('3', '1'), ('5', '1'), ('7', '1')])
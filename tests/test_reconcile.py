@@ -0,0 +1,62 @@
+import datetime
+
+import pytest
+
+pytest.importorskip('pymongo')
+mongomock = pytest.importorskip('mongomock')
+
+import export
+import qmclient as qm
+import reconcile
+
+START = datetime.datetime(2020, 1, 1)
+
+
+@pytest.fixture
+def mongo(qmfake, tmp_path, monkeypatch):
+    monkeypatch.setattr(export, 'STATE_DIR', str(tmp_path))
+    monkeypatch.setattr(export, 'CHECKPOINT',
+                        str(tmp_path / 'checkpoint.json'))
+    db = mongomock.MongoClient()['contractor']
+    monkeypatch.setattr(export, 'db', db)
+    db.invoice.insert_many([
+        {'_id': n, 'client': 1, 'date': START, 'hours': 1.0,
+         'amount': 10.0, 'modified': START,
+         'detail': [{'_id': n * 10, 'date': START, 'description': 'work',
+                     'hours': 1.0}]}
+        for n in range(1, 41)])
+    export.export(['INVOICE', 'TIMESHEET'], full=True)
+    return db
+
+
+def test_files_in_step(mongo):
+    for file_name in ('INVOICE', 'TIMESHEET'):
+        result = reconcile.reconcile(file_name, bucket_size=10)
+        assert result['differ'] == 0
+        assert result['missing'] == result['extra'] == []
+        assert result['divergent'] == []
+
+
+def test_differences_are_found_in_their_buckets(mongo, monkeypatch):
+    fno = qm.Open('INVOICE')
+    qm.Delete(fno, '5')
+    qm.Write(fno, '23', qm.Read(fno, '24')[0].replace('1', '2', 1))
+    qm.Write(fno, '99', 'extra')
+    qm.Write(fno, 'X1', 'extra')
+    checksum, checksums = qm.Checksum, []
+    monkeypatch.setattr(reconcile.qm, 'Checksum',
+                        lambda rec: checksums.append(rec) or checksum(rec))
+    result = reconcile.reconcile('INVOICE', bucket_size=10)
+    assert result['buckets'] == 7 and result['differ'] == 4
+    assert result['missing'] == ['5'] and result['divergent'] == ['23']
+    assert result['extra'] == ['99', 'X1']
+    # Both sides are read once in full, then only the records of the
+    # buckets of 1-9, 20-29, 90-99 and the ids that are not numbers
+    assert len(checksums) == (40 + 41) + (9 + 10) + (8 + 10 + 1 + 1)
+
+
+def test_string_invoice_ids(mongo):
+    mongo.invoice.insert_one({'_id': 'A7', 'client': 1, 'date': START,
+                              'hours': 1.0, 'amount': 10.0, 'detail': []})
+    result = reconcile.reconcile('INVOICE', bucket_size=10)
+    assert result['missing'] == ['A7']
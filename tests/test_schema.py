@@ -0,0 +1,60 @@
+import datetime
+
+from schema import INVOICE, TIMESHEET
+
+AM, VM = '\xfe', '\xfd'
+
+# 01/15/2020 and 02/01/2020 as internal dates
+DATE, CLOSE_DATE = '19008', '19025'
+
+
+def invoice(**keys):
+    doc = {'_id': 1042, 'client': 12, 'date': datetime.datetime(2020, 1, 15),
+           'hours': 7.5, 'amount': 375.0, 'close_date': '', 'sent': 'N',
+           'detail': [{'_id': 7}, {'_id': 8}]}
+    doc.update(keys)
+    return doc
+
+
+def test_invoice_encodes_as_the_original_export():
+    # The record export_invoice wrote: posted Y and rate 5000 when the
+    # keys are missing, posted as str() otherwise
+    assert INVOICE.encode(invoice()) == AM.join(
+        ['12', DATE, '7.5', '37500', '', 'N', 'Y', '', '5000', '7' + VM + '8'])
+    assert INVOICE.encode(invoice(
+        close_date=datetime.datetime(2020, 2, 1), posted=False,
+        check_id=1001, rate=62.5)) == AM.join(
+        ['12', DATE, '7.5', '37500', CLOSE_DATE, 'N', 'False', '1001',
+         '6250', '7' + VM + '8'])
+
+
+def test_invoice_round_trip():
+    doc = invoice(close_date=datetime.datetime(2020, 2, 1), posted=True,
+                  check_id='1001', rate=62.5, status='paid',
+                  check_number='5521',
+                  paid_date=datetime.datetime(2020, 2, 1), period=3)
+    assert INVOICE.decode(INVOICE.encode(doc), '1042') == dict(
+        doc, close_date=datetime.datetime(2020, 2, 1))
+
+
+def test_invoice_decode_leaves_out_empty_fields():
+    doc = INVOICE.decode(INVOICE.encode(invoice(detail=[])), '1042')
+    assert doc['posted'] is True and doc['rate'] == 50.0
+    assert doc['detail'] == []
+    assert 'close_date' not in doc and 'check_id' not in doc
+    assert 'status' not in doc
+
+
+def test_posted_reads_every_exported_form():
+    for stored, posted in (('True', True), ('Y', True), ('1', True),
+                           ('False', False), ('N', False), ('0', False)):
+        rec = AM.join(['12', DATE, '', '', '', '', stored])
+        assert INVOICE.decode(rec, '1')['posted'] is posted
+
+
+def test_timesheet_round_trip():
+    doc = {'_id': 7, 'date': datetime.datetime(2020, 1, 15),
+           'description': 'Reports', 'hours': 2.25, 'invoice': 1042}
+    rec = TIMESHEET.encode(doc)
+    assert rec == AM.join([DATE, 'Reports', '2.25', '1042'])
+    assert TIMESHEET.decode(rec, '7') == doc
@@ -0,0 +1,66 @@
+import threading
+
+import pytest
+
+pytest.importorskip('flask')
+pytest.importorskip('pymongo')
+pytest.importorskip('pdfkit')
+pytest.importorskip('wtforms')
+mongomock = pytest.importorskip('mongomock')
+
+
+@pytest.fixture
+def control(contractor, monkeypatch):
+    """The control collection, with invoice at 10 and timesheet at 100"""
+    db = mongomock.MongoClient()['contractor']
+    db.control.insert_many([{'_id': 'invoice', 'seq': 10},
+                            {'_id': 'timesheet', 'seq': 100}])
+    monkeypatch.setattr(contractor, 'db', db)
+    monkeypatch.setattr(contractor, '_leases', {})
+    monkeypatch.setattr(contractor, 'SEQUENCE_BLOCKS', {'timesheet': 5})
+    return db.control
+
+
+def seq(control, coll):
+    return control.find_one({'_id': coll})['seq']
+
+
+def test_unleased(contractor, control):
+    assert [contractor.next_sequence('invoice') for n in range(3)] == [
+        10, 11, 12]
+    assert seq(control, 'invoice') == 13
+
+
+def test_block(contractor, control):
+    assert [contractor.next_sequence('timesheet') for n in range(7)] == [
+        100, 101, 102, 103, 104, 105, 106]
+    assert seq(control, 'timesheet') == 110
+    # The control page moves the counter; the lease runs out first
+    control.update_one({'_id': 'timesheet'}, {'$set': {'seq': 200}})
+    assert [contractor.next_sequence('timesheet') for n in range(4)] == [
+        107, 108, 109, 200]
+    assert contractor.next_sequence('invoice', block=2) == 10
+    assert seq(control, 'invoice') == 12
+
+
+def test_forked_process(contractor, control, monkeypatch):
+    assert contractor.next_sequence('timesheet') == 100
+    monkeypatch.setattr(contractor.os, 'getpid', lambda: -1)
+    assert contractor.next_sequence('timesheet') == 105
+    assert seq(control, 'timesheet') == 110
+
+
+def test_threads(contractor, control):
+    found = []
+
+    def take():
+        for n in range(50):
+            found.append(contractor.next_sequence('timesheet'))
+
+    threads = [threading.Thread(target=take) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(found) == list(range(100, 500))
+    assert seq(control, 'timesheet') == 500
@@ -0,0 +1,87 @@
+import datetime
+import sys
+
+import pytest
+
+pytest.importorskip('flask')
+pytest.importorskip('pymongo')
+pytest.importorskip('pdfkit')
+pytest.importorskip('wtforms')
+mongomock = pytest.importorskip('mongomock')
+
+START = datetime.datetime(2020, 1, 15)
+
+
+@pytest.fixture
+def client(contractor, qmfake, monkeypatch):
+    for index, attr in (('CLIENT', 1), ('DATE', 2), ('CLIENT.DATE', [1, 2])):
+        qmfake.create_index('INVOICE', index, attr)
+    qmfake.create_index('TIMESHEET', 'INVOICE', 4)
+    monkeypatch.setattr(contractor.store, 'indices', {})
+    monkeypatch.setattr(contractor.store, 'completeness', {})
+    db = mongomock.MongoClient()['contractor']
+    db.clients.insert_one({'_id': 1, 'name': 'Acme', 'rate': 1,
+                           'prefix': 'ACM'})
+    db.rates.insert_one({'_id': 1, 'rate': 50.0})
+    db.company.insert_one({'_id': 1, 'name': 'Consulting'})
+    db.control.insert_many([{'_id': 'invoice', 'seq': 10},
+                            {'_id': 'period', 'seq': 1},
+                            {'_id': 'timesheet', 'seq': 100}])
+    monkeypatch.setattr(contractor, 'db', db)
+    for module in ('invoice.views', 'timesheet.views'):
+        monkeypatch.setattr(sys.modules['contractor.' + module], 'db', db)
+    # An invoice as the export writes it: the empty close date, sent,
+    # status and check number are left out when it is read back
+    contractor.store.create('invoice', {
+        '_id': 1, 'client': 1, 'date': START, 'hours': 2.0, 'amount': 100.0,
+        'rate': 50.0, 'close_date': '', 'sent': '', 'status': '',
+        'detail': [{'_id': 7, 'date': START, 'description': 'work',
+                    'hours': 2.0}]})
+    return contractor.app.test_client()
+
+
+def test_invoice_pages(client, contractor):
+    assert type(contractor.store).__name__ == 'QM'
+    assert client.get('/invoice_list').status_code == 200
+    assert client.get('/invoice_list?client_id=1').status_code == 200
+    assert client.get('/invoice_edit/1').status_code == 200
+    assert client.get('/invoice_close/1').status_code == 200
+    assert client.get('/invoice_view/1?action=view').status_code == 200
+    assert client.get('/invoice_post/1').status_code == 200
+
+
+def test_invoice_changes(client, contractor):
+    response = client.post('/invoice_close/1', data={'date': '01/31/2020'})
+    assert response.status_code == 302
+    invoice = contractor.store.read('invoice', 1)
+    assert invoice['status'] == 'closed'
+    assert invoice['close_date'] == datetime.datetime(2020, 1, 31)
+
+    client.post('/invoice_post/1', data={'sent': 'Y'})
+    assert contractor.store.read('invoice', 1)['sent'] == 'Y'
+
+    client.get('/invoice_open/1')
+    invoice = contractor.store.read('invoice', 1)
+    assert invoice['status'] == 'open' and 'close_date' not in invoice
+
+
+def test_timesheet_changes(client, contractor):
+    client.post('/timesheet_create/1', data={
+        'submit_button': 'Save', 'date': '01/16/2020',
+        'description': 'more work', 'hours': '3'})
+    invoice = contractor.store.read('invoice', 1)
+    assert [ts['_id'] for ts in invoice['detail']] == [7, 100]
+    assert invoice['hours'] == 5.0 and invoice['amount'] == 250.0
+
+    client.get('/delete/1/7')
+    invoice = contractor.store.read('invoice', 1)
+    assert [ts['_id'] for ts in invoice['detail']] == [100]
+
+
+def test_report(client, contractor):
+    contractor.store.update('invoice', 1, {
+        'status': 'paid', 'paid_date': datetime.datetime(2020, 2, 3)})
+    response = client.post('/report', data={'start_date': '02/01/2020',
+                                            'end_date': '02/28/2020'})
+    assert response.status_code == 200
+    assert b'100.00' in response.data
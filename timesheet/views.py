@@ -4,9 +4,9 @@ from bson import ObjectId
 from datetime import datetime
 from flask import redirect, render_template, request, session, url_for
 from pymongo import ASCENDING, DESCENDING
-from .. import app, client, db, next_sequence
+from .. import app, client, db, next_sequence, repo, stamp
 from timesheet.model import TimeSheet
-from ..invoice.views import recalc
+from ..invoice.views import by_date, recalc
 
 @app.route('/timesheet')
 def timesheet_list():
@@ -16,7 +16,7 @@ def timesheet_list():
 
 @app.route('/delete/<int:invoice_id>/<int:tsid>', methods=['GET'])
 def timesheet_delete(invoice_id, tsid):
-    invoice = db.invoice.find_one({'_id': invoice_id})
+    invoice = repo().get('invoice', invoice_id)
     import pdb
     
     if invoice:
@@ -25,11 +25,11 @@ def timesheet_delete(invoice_id, tsid):
         for ts in invoice['detail']:
             if ts['_id'] != tsid:
                 det.append(ts)
-                invoice['hours'] += float(ts['hours'])
+                invoice['hours'] += float(ts.get('hours') or 0)
         invoice['detail'].clear()
         #pdb.set_trace()
         invoice['detail'] = det.copy()
-        db.invoice.replace_one({'_id': invoice_id}, invoice)
+        repo().save('invoice', stamp(invoice))
 
     return redirect( url_for('invoice_edit',invoice_id=invoice_id))
 
@@ -46,7 +46,7 @@ def timesheet_edit(inv_id, tsid):
     if 'delete_button' in request.form:
         timesheet_delete(invoice_id=inv_id, tsid=tsid)
 
-    invoice = db.invoice.find_one({'_id': inv_id})
+    invoice = repo().get('invoice', inv_id)
     ts = None
     ts_index = -1
     for ts in invoice['detail']:
@@ -67,7 +67,7 @@ def timesheet_edit(inv_id, tsid):
     
     invoice = recalc(invoice)    
     
-    db.invoice.replace_one({'_id': inv_id}, invoice, True)
+    repo().save('invoice', stamp(invoice))
 
     return redirect(url_for('invoice_edit',invoice_id=inv_id))
 
@@ -88,11 +88,11 @@ def timesheet_create(invoice_id):
         entry['description'] = request.form['description']
         entry['hours'] = float(request.form['hours'])
 
-        invoice = db.invoice.find_one({'_id': invoice_id})
+        invoice = repo().get('invoice', invoice_id)
 
         invoice['detail'].append(entry)
         invoice = recalc(invoice)
-        invoice['detail'] = sorted(invoice['detail'], key = lambda k: k['date'])
-        db.invoice.replace_one({'_id': invoice_id}, invoice, True)
+        invoice['detail'] = sorted(invoice['detail'], key=by_date)
+        repo().save('invoice', stamp(invoice))
 
     return redirect(url_for('invoice_edit',invoice_id=invoice_id))
@@ -0,0 +1,191 @@
+"""
+asyncio interface to the qmclient module.
+
+QMClient calls block, so the functions here run them on a bounded pool
+of workers and return awaitables. Every worker opens its own QM session
+when it starts, and keeps its own open files (see qmsupport.open_file),
+so files are addressed by name rather than by file number.
+
+Worker processes (the default) each load their own copy of the
+library and really do overlap their round trips to the server. Worker
+threads keep the event loop free while QM I/O is in progress, but
+qmclilib only runs one call at a time in a process (see
+qm.ThreadSessions), so threads give no concurrency between QM calls;
+use them only where the arguments or results cannot be pickled.
+
+Use:
+    aqm.start(('ConnectLocal', 'QMUSERS'), workers=8)
+    rec, err = await aqm.Read('INVOICE', '1042')
+    aqm.shutdown()
+
+Record locks and select lists belong to the worker's session. Use run()
+to keep a read-modify-write sequence on a single worker.
+"""
+import asyncio
+import contextlib
+import itertools
+import multiprocessing
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import qmclient as qm
+import qmsupport as qms
+
+executor = None
+# Makes the queues and events shared with worker processes
+manager = None
+
+# Ids per message sent back by Select
+SELECT_CHUNK = 500
+
+
+def _init_worker(connect, threads):
+    if threads:
+        qm.ThreadSessions()
+    name, *args = connect
+    if getattr(qm, name)(*args) != 1:
+        raise Exception("Cannot connect to server {}".format(qm.Error()))
+
+
+def open_file(file_name):
+    """
+    Returns the worker's file number for file_name, opening the file
+    on first use. Only meaningful inside a function passed to run().
+    """
+    return qms.open_file(file_name)
+
+
+def _read(file_name, id):
+    return qm.Read(open_file(file_name), id)
+
+
+def _readu(file_name, id, wait):
+    return qm.Readu(open_file(file_name), id, wait)
+
+
+def _write(file_name, id, data):
+    qm.Write(open_file(file_name), id, data)
+
+
+def _select(file_name, index, value, chunks, stop):
+    """Sends the selected ids to chunks, a list at a time, then None"""
+    try:
+        ids = qms.select_iter(open_file(file_name), index, value)
+        with contextlib.closing(ids):
+            while not stop.is_set():
+                chunk = list(itertools.islice(ids, SELECT_CHUNK))
+                if not chunk:
+                    break
+                chunks.put(chunk)
+    finally:
+        chunks.put(None)
+
+
+def _call(subr, args):
+    qm.Call(subr, len(args), *args)
+    return [qm.GetArg(n) for n in range(1, len(args) + 1)]
+
+
+def start(connect, workers=8, processes=True):
+    """
+    Starts the worker pool. connect names the qmclient connect function
+    and its arguments, e.g. ('ConnectLocal', 'QMUSERS') or
+    ('ConnectPool', host, port, username, password, account, pool).
+    Each of the workers connects with it. With processes false the
+    workers are threads of this process; see above.
+    """
+    global executor, manager
+    shutdown()
+    if processes:
+        manager = multiprocessing.Manager()
+    cls = ProcessPoolExecutor if processes else ThreadPoolExecutor
+    executor = cls(max_workers=workers, initializer=_init_worker,
+                   initargs=(connect, not processes))
+
+
+def shutdown(wait=True):
+    """Stops the worker pool"""
+    global executor, manager
+    if executor is not None:
+        executor.shutdown(wait)
+        executor = None
+    if manager is not None:
+        manager.shutdown()
+        manager = None
+
+
+async def run(func, *args):
+    """
+    Runs func(*args) on a worker and returns its result. With worker
+    processes func and its arguments must be picklable.
+    """
+    if executor is None:
+        raise Exception("aqm.start() has not been called")
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, func, *args)
+
+
+async def Read(file_name, id):
+    """Awaitable qm.Read. Returns data, err."""
+    return await run(_read, file_name, id)
+
+
+async def Readu(file_name, id, wait):
+    """
+    Awaitable qm.Readu. Returns data, err. The update lock is held by
+    the worker's session; release it with a Write or Release from the
+    same worker, i.e. from a function passed to run().
+    """
+    return await run(_readu, file_name, id, wait)
+
+
+async def Write(file_name, id, data):
+    """Awaitable qm.Write"""
+    return await run(_write, file_name, id, data)
+
+
+async def Select(file_name, index=None, value=None):
+    """
+    Selects a whole file, or the records holding value in an alternate
+    key index, and yields the ids as the worker reads them, so the
+    whole list is never built on either side. The select list is held
+    by one worker until the ids are consumed or the loop is left.
+
+    Example:
+        async for id in aqm.Select('INVOICE', 'CLIENT', '12'):
+            ...
+    """
+    if manager is None:
+        chunks, stop = queue.Queue(4), threading.Event()
+    else:
+        chunks, stop = manager.Queue(4), manager.Event()
+    loop = asyncio.get_running_loop()
+    done = run(_select, file_name, index, value, chunks, stop)
+    done = asyncio.ensure_future(done)
+    chunk = []
+    try:
+        while True:
+            chunk = await loop.run_in_executor(None, chunks.get)
+            if chunk is None:
+                break
+            for id in chunk:
+                yield id
+    finally:
+        stop.set()
+        while chunk is not None:
+            chunk = await loop.run_in_executor(None, chunks.get)
+        await done
+
+
+async def Execute(command):
+    """Awaitable qm.Execute. Returns data, err."""
+    return await run(qm.Execute, command)
+
+
+async def Call(subr, *args):
+    """
+    Calls a catalogued subroutine and returns the list of its arguments
+    as the subroutine left them.
+    """
+    return await run(_call, subr, args)
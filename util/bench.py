@@ -0,0 +1,503 @@
+"""
+Micro-benchmarks for the QMClient wrapper.
+
+The benchmarks run against a stub qmclilib.so built from qmstub.c, so
+they need neither a QM licence nor a server. The stub is compiled with
+the system C compiler into a temporary QMSYS directory the first time
+it is needed, and QMSYS is pointed at it before qmclient is loaded.
+
+The 'fake' benchmark runs in a child process against the in-process
+fake server in qmfake instead.
+
+Use:
+    python bench.py             run every benchmark
+    python bench.py calls       run the named benchmarks only
+"""
+import asyncio
+import ctypes as ct
+import datetime
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import timeit
+
+import mvsupport as mvs
+
+stub_lib = None
+
+# A record shaped like an exported INVOICE item
+SAMPLE_REC = mvs.AM.join(['12', '18950', '37.5', '468750', '18964', 'Y',
+                          'Y', '1042', '12500',
+                          mvs.VM.join(str(n) for n in range(500, 520))])
+
+
+def build_stub():
+    """
+    Compiles qmstub.c into $QMSYS/bin/qmclilib.so in a temporary
+    directory and returns the path of the shared library.
+    """
+    global stub_lib
+    if stub_lib is None:
+        qmsys = tempfile.mkdtemp(prefix='qmstub')
+        os.mkdir(os.path.join(qmsys, 'bin'))
+        stub_lib = os.path.join(qmsys, 'bin', 'qmclilib.so')
+        src = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           'qmstub.c')
+        subprocess.run(['cc', '-shared', '-fPIC', '-O2', '-o', stub_lib, src],
+                       check=True)
+        os.environ['QMSYS'] = qmsys
+    return stub_lib
+
+
+def report(name, calls, seconds):
+    print('{:<40} {:>10.3f} us/call'.format(name, seconds / calls * 1e6))
+
+
+def bench_calls(number=200000):
+    """
+    Per-call cost of qm.Extract, qm.Replace and qm.Write, comparing the
+    old wrapper body (look up the symbol, assign argtypes/restype and
+    check the library on every call) with the prebound function table.
+    """
+    build_stub()
+    import qmclient as qm
+
+    lib = None
+
+    def load():
+        nonlocal lib
+        if lib is None:
+            lib = ct.cdll.LoadLibrary(stub_lib)
+
+    def free(s):
+        load()
+        lib.QMFree(ct.c_void_p(s))
+
+    def old_extract(in_str, f, v, sv):
+        load()
+        func = lib.QMExtractW
+        func.argtypes = [ct.c_wchar_p, ct.c_int, ct.c_int, ct.c_int]
+        func.restype = ct.c_void_p
+        s = func(in_str, f, v, sv)
+        out_str = ct.wstring_at(s)
+        free(s)
+        return out_str
+
+    def old_replace(in_str, f, v, sv, new_data):
+        load()
+        func = lib.QMReplaceW
+        func.argtypes = [ct.c_wchar_p, ct.c_int, ct.c_int, ct.c_int,
+                         ct.c_wchar_p]
+        func.restype = ct.c_void_p
+        s = func(in_str, f, v, sv, new_data)
+        out_str = ct.wstring_at(s)
+        free(s)
+        return out_str
+
+    def old_write(fno, id, data):
+        func = lib.QMWriteW
+        func.argtypes = [ct.c_int, ct.c_wchar_p, ct.c_wchar_p]
+        func(fno, id, data)
+
+    rec = SAMPLE_REC
+    load()
+    qm.Extract(rec, 1, 0, 0)
+    cases = [
+        ('Extract (per-call setup)', lambda: old_extract(rec, 4, 0, 0)),
+        ('Extract (prebound)', lambda: qm.Extract(rec, 4, 0, 0)),
+        ('Replace (per-call setup)', lambda: old_replace(rec, 4, 0, 0, 'x')),
+        ('Replace (prebound)', lambda: qm.Replace(rec, 4, 0, 0, 'x')),
+        ('Write (per-call setup)', lambda: old_write(1, '1042', rec)),
+        ('Write (prebound)', lambda: qm.Write(1, '1042', rec)),
+    ]
+    for name, stmt in cases:
+        report(name, number, min(timeit.repeat(stmt, number=number,
+                                                repeat=3)))
+
+
+def bench_stats(number=200000):
+    """
+    Per-call cost of qm.Extract and qm.Write with call statistics off,
+    on, and off again after being on.
+    """
+    build_stub()
+    import qmclient as qm
+
+    qm.ConnectLocal('QMUSERS')
+    fno = qm.Open('INVOICE')
+    cases = [('Extract', lambda: qm.Extract(SAMPLE_REC, 10, 5, 0)),
+             ('Write', lambda: qm.Write(fno, '1042', SAMPLE_REC))]
+    for state in ('off', 'on', 'off again'):
+        qm.Instrument(state == 'on')
+        for name, stmt in cases:
+            report('{} (statistics {})'.format(name, state), number,
+                   min(timeit.repeat(stmt, number=number, repeat=3)))
+    qm.Disconnect()
+
+
+def bench_dynarray(number=50000):
+    """
+    Building and editing an INVOICE record through qm.Replace/qm.Extract
+    against the pure Python DynArray and a single join.
+    """
+    build_stub()
+    import qmclient as qm
+
+    fields = SAMPLE_REC.split(mvs.AM)
+
+    def ffi_build():
+        rec = ''
+        for n, field in enumerate(fields[:9], 1):
+            rec = qm.Replace(rec, n, 0, 0, field)
+        for n, ts in enumerate(fields[9].split(mvs.VM), 1):
+            rec = qm.Replace(rec, 10, n, 0, ts)
+        return rec
+
+    def dynarray_build():
+        rec = mvs.DynArray()
+        for n, field in enumerate(fields[:9], 1):
+            rec.replace(n, 0, 0, field)
+        for n, ts in enumerate(fields[9].split(mvs.VM), 1):
+            rec.replace(10, n, 0, ts)
+        return str(rec)
+
+    def ffi_edit():
+        rec = qm.Replace(SAMPLE_REC, 8, 0, 0, '1043')
+        return qm.Extract(rec, 10, 3, 0)
+
+    def dynarray_edit():
+        rec = mvs.DynArray(SAMPLE_REC)
+        rec.replace(8, 0, 0, '1043')
+        return rec.extract(10, 3)
+
+    cases = [
+        ('build via qm.Replace', ffi_build),
+        ('build via DynArray', dynarray_build),
+        ('build via join', lambda: mvs.AM.join(fields)),
+        ('edit via qm.Replace/Extract', ffi_edit),
+        ('edit via DynArray', dynarray_edit),
+    ]
+    for name, stmt in cases:
+        report(name, number, min(timeit.repeat(stmt, number=number,
+                                                repeat=3)))
+
+
+def bench_codec(number=20):
+    """
+    Decoding an INVOICE record with a large TIMESHEETS multi-value:
+    the old Dcount/Extract DynArrayToList against the single pass split,
+    the streaming decoder and the matching encoders.
+    """
+    build_stub()
+    import qmclient as qm
+
+    def old_dynarray_to_list(dyn):
+        a_list = []
+        nbr_attributes = qm.Dcount(dyn, mvs.AM)
+        for attr_count in range(1, nbr_attributes + 1):
+            attribute = qm.Extract(dyn, attr_count, 0, 0)
+            nbr_multi_values = qm.Dcount(attribute, mvs.VM)
+            if nbr_multi_values == 1:
+                a_list.append(attribute)
+            else:
+                b_list = []
+                for mv_count in range(1, nbr_multi_values + 1):
+                    multi_value = qm.Extract(dyn, attr_count, mv_count, 0)
+                    nbr_sub_values = qm.Dcount(multi_value, mvs.SVM)
+                    if nbr_sub_values == 1:
+                        b_list.append(multi_value)
+                    else:
+                        b_list.append([
+                            qm.Extract(dyn, attr_count, mv_count, sv_count)
+                            for sv_count in range(1, nbr_sub_values + 1)])
+                a_list.append(b_list)
+        return a_list
+
+    for size in (100, 1000, 5000):
+        rec = mvs.AM.join(SAMPLE_REC.split(mvs.AM)[:9] + [
+            mvs.VM.join(str(n) + mvs.SVM + '7.5' for n in range(size))])
+        a_list = qm.DynArrayToList(rec)
+        assert old_dynarray_to_list(rec) == a_list
+        assert list(mvs.mv_iter_nested(rec)) == a_list
+        assert qm.ListToDynArray(a_list) == rec
+        cases = [
+            ('DynArrayToList (Dcount/Extract)',
+             lambda: old_dynarray_to_list(rec)),
+            ('DynArrayToList (single pass)',
+             lambda: qm.DynArrayToList(rec)),
+            ('mv_iter_nested', lambda: list(mvs.mv_iter_nested(rec))),
+            ('ListToDynArray', lambda: qm.ListToDynArray(a_list)),
+            ('mv_iter_joined', lambda: ''.join(mvs.mv_iter_joined(a_list))),
+        ]
+        print('-- {} values --'.format(size))
+        for name, stmt in cases:
+            n = 1 if 'Extract' in name else number
+            report(name, n, min(timeit.repeat(stmt, number=n, repeat=3)))
+
+
+def bench_conv(number=2000, latency=100):
+    """
+    Converting the dates and amounts of an INVOICE: a server IConv per
+    value, after formatting each datetime to text, with latency
+    microseconds of simulated round trip, against the local conversions
+    in conv, one value at a time and as a batch. The local paths are
+    checked to agree with each other, amounts that are halves in
+    decimal but not in binary included; conv.check() compares them
+    with a real server.
+    """
+    os.environ['QMSTUB_LATENCY'] = str(latency)
+    build_stub()
+    import datetime
+    import conv
+    import qmclient as qm
+
+    dates = [conv.EPOCH + datetime.timedelta(days=n)
+             for n in range(18000, 18000 + number)]
+    amounts = [n * 1.25 + n % 3 * 0.005 for n in range(number)]
+    amounts[:4] = [1.005, 2.675, -1.005, 0.125]
+    expected = [conv.iconv(date, 'D2MDY') for date in dates]
+    assert conv.iconvs(dates, 'D2MDY') == expected
+    expected = [conv.iconv(amount, 'MR2') for amount in amounts]
+    assert conv.iconvs(amounts, 'MR2') == expected
+    assert expected[:4] == ['101', '268', '-101', '13']
+
+    def server():
+        for date in dates:
+            qm.IConv(date.strftime('%m/%d/%Y'), 'D2MDY')
+        for amount in amounts:
+            qm.IConv(str(amount), 'MR2')
+
+    def local():
+        for date in dates:
+            conv.iconv(date, 'D2MDY')
+        for amount in amounts:
+            conv.iconv(amount, 'MR2')
+
+    def batch():
+        conv.iconvs(dates, 'D2MDY')
+        conv.iconvs(amounts, 'MR2')
+
+    cases = [('qm.IConv', server), ('conv.iconv', local),
+             ('conv.iconvs', batch)]
+    if conv.np is not None:
+        np = conv.np
+        date_array = np.array(dates, dtype='datetime64[D]')
+        amount_array = np.array(amounts)
+        assert [str(n) for n in conv.iconvs(amount_array, 'MR2')] == expected
+        cases.append(('conv.iconvs (NumPy)', lambda: (
+            conv.iconvs(date_array, 'D2MDY'),
+            conv.iconvs(amount_array, 'MR2'))))
+    for name, func in cases:
+        report(name, 2 * number, min(timeit.repeat(func, number=1, repeat=5)))
+    del os.environ['QMSTUB_LATENCY']
+
+
+def bench_mvcodec(records=2000, number=5):
+    """
+    The mvsupport codec suite on a batch of INVOICE records, checked
+    against qmclient (Dcount, Extract, DynArrayToList, ListToDynArray)
+    and against the regex based mv_raise/mv_lower it replaces.
+    """
+    build_stub()
+    import re
+    import qmclient as qm
+
+    def old_raise(dynarray):
+        if mvs.AM in dynarray:
+            return dynarray
+        dynarray = re.sub(mvs.VM, mvs.AM, dynarray)
+        dynarray = re.sub(mvs.SVM, mvs.VM, dynarray)
+        return re.sub(mvs.TM, mvs.SVM, dynarray)
+
+    def old_lower(dynarray):
+        if mvs.TM in dynarray:
+            return dynarray
+        dynarray = re.sub(mvs.SVM, mvs.TM, dynarray)
+        dynarray = re.sub(mvs.VM, mvs.SVM, dynarray)
+        return re.sub(mvs.AM, mvs.VM, dynarray)
+
+    recs = [SAMPLE_REC.replace('1042', str(n)) + mvs.SVM + 'x'
+            for n in range(records)]
+    values = [qm.Extract(rec, 10, 0, 0) for rec in recs]
+    lists = [qm.DynArrayToList(rec) for rec in recs]
+    assert mvs.mv_split_all(recs) == lists
+    assert mvs.mv_join_all(lists) == [qm.ListToDynArray(a) for a in lists]
+    assert [mvs.mv_dcount(v, mvs.VM) for v in values] == \
+        [qm.Dcount(v, mvs.VM) for v in values]
+    assert mvs.mv_raise_all(values) == [old_raise(v) for v in values]
+    assert mvs.mv_lower_all(recs) == [old_lower(rec) for rec in recs]
+
+    cases = [
+        ('mv_raise (re.sub)', lambda: [old_raise(v) for v in values]),
+        ('mv_raise', lambda: [mvs.mv_raise(v) for v in values]),
+        ('mv_raise_all', lambda: mvs.mv_raise_all(values)),
+        ('mv_lower (re.sub)', lambda: [old_lower(rec) for rec in recs]),
+        ('mv_lower', lambda: [mvs.mv_lower(rec) for rec in recs]),
+        ('mv_lower_all', lambda: mvs.mv_lower_all(recs)),
+        ('qm.Dcount', lambda: [qm.Dcount(v, mvs.VM) for v in values]),
+        ('mv_dcount', lambda: [mvs.mv_dcount(v, mvs.VM) for v in values]),
+        ('qm.DynArrayToList', lambda: [qm.DynArrayToList(r) for r in recs]),
+        ('mv_split_all', lambda: mvs.mv_split_all(recs)),
+        ('qm.ListToDynArray', lambda: [qm.ListToDynArray(a) for a in lists]),
+        ('mv_join_all', lambda: mvs.mv_join_all(lists)),
+    ]
+    for name, stmt in cases:
+        report(name, records * number,
+               min(timeit.repeat(stmt, number=number, repeat=3)))
+
+
+def bench_cache(reads=2000, ids=100, latency=200):
+    """
+    Reads spread over ids records with latency microseconds of simulated
+    round trip per server read, with the record cache off and on.
+    """
+    os.environ['QMSTUB_LATENCY'] = str(latency)
+    build_stub()
+    import qmclient as qm
+
+    qm.ConnectLocal('QMUSERS')
+    keys = [str(n % ids) for n in range(reads)]
+    for enabled in (False, True):
+        qm.CacheRecords(enabled)
+        fno = qm.Open('INVOICE')
+
+        def read():
+            for id in keys:
+                qm.Read(fno, id)
+
+        report('qm.Read, cache {}'.format('on' if enabled else 'off'),
+               reads, timeit.timeit(read, number=1))
+    print('cache statistics: {}'.format(qm.CacheStats()))
+    qm.CacheRecords(False)
+    qm.Disconnect()
+    del os.environ['QMSTUB_LATENCY']
+
+
+def bench_aqm(reads=400, latency=2000):
+    """
+    Concurrent reads through aqm with latency microseconds of simulated
+    round trip per read, against the same reads made one after another.
+    """
+    os.environ['QMSTUB_LATENCY'] = str(latency)
+    build_stub()
+    import aqm
+    import qmclient as qm
+
+    qm.ConnectLocal('QMUSERS')
+    fno = qm.Open('INVOICE')
+    ids = [str(n) for n in range(reads)]
+
+    def sequential():
+        for id in ids:
+            qm.Read(fno, id)
+
+    async def concurrent():
+        await asyncio.gather(*(aqm.Read('INVOICE', id) for id in ids))
+
+    report('sequential qm.Read', reads, timeit.timeit(sequential, number=1))
+    for processes in (False, True):
+        for workers in (4, 16):
+            aqm.start(('ConnectLocal', 'QMUSERS'), workers, processes)
+            asyncio.run(concurrent())
+            name = 'aqm.Read, {} worker {}'.format(
+                workers, 'processes' if processes else 'threads')
+            seconds = timeit.timeit(lambda: asyncio.run(concurrent()),
+                                    number=1)
+            report(name, reads, seconds)
+            aqm.shutdown()
+    del os.environ['QMSTUB_LATENCY']
+
+
+def _fake_pipeline(records, latency):
+    os.environ['QMFAKE'] = '1'
+    os.environ['QMFAKE_LATENCY'] = str(latency)
+    import qmclient as qm
+    import qmsupport as qms
+    import schema
+
+    docs = [{'_id': n, 'client': n % 40,
+             'date': datetime.datetime(2019, 1, 1) + datetime.timedelta(n),
+             'hours': 37.5, 'amount': 1875.0, 'rate': 50.0,
+             'detail': [{'_id': n * 10 + t} for t in range(5)]}
+            for n in range(records)]
+    qm.ConnectLocal('QMUSERS')
+    fno = qms.open_file('INVOICE')
+    stats = qms.bulk_write(fno, ((str(doc['_id']), schema.INVOICE.encode(doc))
+                                 for doc in docs))
+    report('export (bulk_write)', records, stats['seconds'])
+    started = timeit.default_timer()
+    decoded = [schema.INVOICE.decode(rec, id)
+               for id, rec in qms.select_iter(fno, records=True)]
+    report('import (select_iter)', records,
+           timeit.default_timer() - started)
+    assert len(decoded) == records
+    qm.Disconnect()
+
+
+def _fake_delta(records, changed, latency):
+    os.environ['QMFAKE'] = '1'
+    os.environ['QMFAKE_LATENCY'] = str(latency)
+    import qmclient as qm
+    import qmsupport as qms
+
+    qm.ConnectLocal('QMUSERS')
+    fno = qms.open_file('INVOICE')
+    rows = [(str(n), SAMPLE_REC.replace('1042', str(n)))
+            for n in range(records)]
+    edited = [(id, rec + mvs.AM + 'X' if int(id) < changed else rec)
+              for id, rec in rows]
+    for name, kwargs in (('write all', {}),
+                         ('checksums', {'checksums': {}}),
+                         ('compare', {'compare': True})):
+        qms.bulk_write(fno, rows, checksums=kwargs.get('checksums'))
+        stats = qms.bulk_write(fno, edited, **kwargs)
+        report('re-export, {} ({} skipped)'.format(name, stats['skipped']),
+               records, stats['seconds'])
+    qm.Disconnect()
+
+
+def bench_delta(records=5000, changed=250, latency=100):
+    """
+    Exporting records a second time with changed of them edited: every
+    record written again, unchanged records skipped by checksum, and by
+    comparing with the record on file.
+    """
+    ctx = multiprocessing.get_context('spawn')
+    child = ctx.Process(target=_fake_delta, args=(records, changed, latency))
+    child.start()
+    child.join()
+
+
+def bench_fake(records=5000, latency=100):
+    """
+    The Mongo to QM record pipeline without Mongo: encoding and bulk
+    writing INVOICE documents, then selecting, reading and decoding them
+    back, against the fake server with latency microseconds per call.
+    """
+    ctx = multiprocessing.get_context('spawn')
+    child = ctx.Process(target=_fake_pipeline, args=(records, latency))
+    child.start()
+    child.join()
+
+
+benchmarks = {
+    'calls': bench_calls,
+    'stats': bench_stats,
+    'dynarray': bench_dynarray,
+    'codec': bench_codec,
+    'conv': bench_conv,
+    'mvcodec': bench_mvcodec,
+    'cache': bench_cache,
+    'aqm': bench_aqm,
+    'fake': bench_fake,
+    'delta': bench_delta,
+}
+
+
+if __name__ == '__main__':
+    names = sys.argv[1:] or list(benchmarks)
+    for name in names:
+        print('== {} =='.format(name))
+        benchmarks[name]()
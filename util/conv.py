@@ -0,0 +1,311 @@
+"""
+Client side ICONV/OCONV for the common conversion codes.
+
+qmclient.IConv and OConv are evaluated on the server, one value per
+round trip. Date codes (D) and masked decimal codes (MD, ML, MR) are
+evaluated here instead, with the same results as the server; any other
+code, or an option these functions do not know, is passed through to
+qmclient.
+
+D{y}{c}{fmt}
+    y    digits of the year shown on output, 0-4 (default 4)
+    c    separator; without one the month is shown as JAN, FEB...
+    fmt  order of day, month and year, e.g. MDY, DMY, YMD (default
+         MDY with a separator, DMY without)
+
+MD{n}{f}{options}, ML..., MR...
+    n        decimal places shown on output
+    f        scale factor, the power of ten the internal value is
+             multiplied by (default n)
+    options  , thousands separator  $ currency sign  Z null for zero
+             - trailing minus  < negative in angle brackets
+             C CR suffix  D DB suffix
+
+iconv() also accepts datetime/date values for date codes and numbers
+for decimal codes, so no string round trip is needed. iconvs() and
+oconvs() convert whole sequences, dynamic arrays or NumPy arrays with
+the code parsed once.
+"""
+import datetime
+import functools
+import re
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+import qmclient as qm
+
+# Day zero of QM internal dates
+EPOCH = datetime.datetime(1967, 12, 31)
+
+# Two digit years before this one are taken to be in the next century
+CENTURY_PIVOT = 1930
+
+MONTHS = ['JAN', 'FEB', 'MAR', 'APR', 'MAY', 'JUN',
+          'JUL', 'AUG', 'SEP', 'OCT', 'NOV', 'DEC']
+
+_date_code = re.compile(r'^D([0-4])?([^A-Za-z0-9])?([DMY]{3})?$')
+_decimal_code = re.compile(r'^M[DLR]([0-9])?([0-9])?([,$Z<CD-]*)$')
+_tokens = re.compile(r'[0-9]+|[A-Za-z]+')
+_marks = re.compile('([\xfe\xfd\xfc\xfb])')
+
+# Distance from a half within which a scaled float is rounded through
+# Decimal by the NumPy path of iconvs()
+HALF_TOLERANCE = 1e-6
+
+
+# ======================================================================
+# Dates
+# ======================================================================
+def _date_iconv(order):
+    order = order or 'MDY'
+
+    def iconv(value):
+        if isinstance(value, datetime.datetime):
+            return str((value - EPOCH).days)
+        if isinstance(value, datetime.date):
+            return str((value - EPOCH.date()).days)
+        parts = _tokens.findall(str(value))
+        month = None
+        numbers = []
+        for part in parts:
+            if part.isdigit():
+                numbers.append(part)
+            elif month is None and part[:3].upper() in MONTHS:
+                month = MONTHS.index(part[:3].upper()) + 1
+            else:
+                return ''
+        fields = [c for c in order if c != 'M'] if month else list(order)
+        if len(numbers) == len(fields) - 1 and 'Y' in fields:
+            fields.remove('Y')
+            numbers.append(str(datetime.date.today().year))
+            fields.append('Y')
+        if len(numbers) != len(fields):
+            return ''
+        date = dict(zip(fields, numbers))
+        year = int(date['Y'])
+        if len(date['Y']) <= 2:
+            year += (CENTURY_PIVOT // 100) * 100
+            if year < CENTURY_PIVOT:
+                year += 100
+        try:
+            day = datetime.date(year, month or int(date['M']), int(date['D']))
+        except ValueError:
+            return ''
+        return str((day - EPOCH.date()).days)
+    return iconv
+
+
+def _date_oconv(digits, sep, order):
+    digits = 4 if digits is None else int(digits)
+    alpha = sep is None
+    if alpha:
+        order = order or 'DMY'
+        sep = ' '
+    else:
+        order = order or 'MDY'
+
+    def oconv(value):
+        try:
+            date = EPOCH + datetime.timedelta(days=int(value))
+        except (TypeError, ValueError):
+            return value
+        parts = []
+        for c in order:
+            if c == 'D':
+                parts.append('{:02d}'.format(date.day))
+            elif c == 'M':
+                parts.append(MONTHS[date.month - 1] if alpha
+                             else '{:02d}'.format(date.month))
+            elif digits:
+                parts.append('{:04d}'.format(date.year)[-digits:])
+        return sep.join(parts)
+    return oconv
+
+
+# ======================================================================
+# Masked decimals
+# ======================================================================
+def _decimal_iconv(scale):
+    one = Decimal(1)
+
+    def iconv(value):
+        if isinstance(value, (int, float, Decimal)):
+            number = Decimal(str(value))
+        else:
+            text = str(value).strip().replace(',', '').replace('$', '')
+            if text == '':
+                return ''
+            negative = False
+            if text[:1] == '<' and text[-1:] == '>':
+                text, negative = text[1:-1], True
+            elif text[-2:].upper() in ('CR', 'DB'):
+                text, negative = text[:-2].strip(), text[-2:].upper() == 'CR'
+            elif text[-1:] == '-':
+                text, negative = text[:-1], True
+            try:
+                number = Decimal(text)
+            except InvalidOperation:
+                return ''
+            if negative:
+                number = -number
+        return str(int(number.scaleb(scale).quantize(one, ROUND_HALF_UP)))
+    return iconv
+
+
+def _decimal_oconv(places, scale, options):
+    quantum = Decimal(1).scaleb(-places)
+    layout = '{:,.%df}' % places if ',' in options else '{:.%df}' % places
+    currency = '$' if '$' in options else ''
+
+    def oconv(value):
+        if value == '':
+            return ''
+        try:
+            number = Decimal(value).scaleb(-scale)
+        except (InvalidOperation, TypeError):
+            return value
+        number = number.quantize(quantum, ROUND_HALF_UP)
+        if number == 0 and 'Z' in options:
+            return ''
+        text = currency + layout.format(abs(number))
+        if number >= 0:
+            return text
+        if '-' in options:
+            return text + '-'
+        if '<' in options:
+            return '<' + text + '>'
+        if 'C' in options:
+            return text + 'CR'
+        if 'D' in options:
+            return text + 'DB'
+        return '-' + text
+    return oconv
+
+
+# ======================================================================
+# Code dispatch
+# ======================================================================
+@functools.lru_cache(maxsize=None)
+def converters(code):
+    """
+    Returns (iconv, oconv) functions of one value for a conversion
+    code, or None if the code has to be evaluated by the server.
+    """
+    match = _date_code.match(code)
+    if match:
+        digits, sep, order = match.groups()
+        return _date_iconv(order), _date_oconv(digits, sep, order)
+    match = _decimal_code.match(code)
+    if match:
+        places, scale, options = match.groups()
+        places = int(places or 0)
+        scale = places if scale is None else int(scale)
+        return _decimal_iconv(scale), _decimal_oconv(places, scale, options)
+    return None
+
+
+def iconv(value, code):
+    """
+    Applies an input conversion code to a value, as qmclient.IConv does.
+    Invalid data gives a null string.
+    """
+    conv = converters(code)
+    if conv is None:
+        return qm.IConv(str(value), code)
+    return conv[0](value)
+
+
+def oconv(value, code):
+    """
+    Applies an output conversion code to an internal value, as
+    qmclient.OConv does. Non-numeric data is returned unchanged.
+    """
+    conv = converters(code)
+    if conv is None:
+        return qm.OConv(value, code)
+    return conv[1](value)
+
+
+def _convs(values, code, which, server):
+    conv = converters(code)
+    if conv is None:
+        func = lambda value: server(str(value), code)
+    else:
+        func = conv[which]
+    if isinstance(values, str):
+        return ''.join(part if _marks.match(part) or part == '' else func(part)
+                       for part in _marks.split(values))
+    return [func(value) for value in values]
+
+
+def iconvs(values, code):
+    """
+    Applies an input conversion code to every element of a dynamic
+    array, like qmclient.IConvs, or of a sequence, returning a list.
+
+    A NumPy array of datetime64 values (date codes) or of numbers
+    (decimal codes) is converted in one step to an int64 array of
+    internal values.
+    """
+    if np is not None and isinstance(values, np.ndarray):
+        match = _decimal_code.match(code)
+        if _date_code.match(code):
+            epoch = np.datetime64(EPOCH.date(), 'D')
+            days = values.astype('datetime64[D]') - epoch
+            return days.astype(np.int64)
+        if match:
+            places, scale, _ = match.groups()
+            scale = int(places or 0) if scale is None else int(scale)
+            scaled = values.astype(np.float64) * 10 ** scale
+            internal = (np.sign(scaled) * np.floor(np.abs(scaled) + 0.5)
+                        ).astype(np.int64)
+            # A binary float within rounding error of a half, such as
+            # 1.005, is rounded as iconv() rounds its decimal text
+            half = np.abs(np.abs(scaled) % 1 - 0.5) < HALF_TOLERANCE
+            if half.any():
+                single = converters(code)[0]
+                for n in np.flatnonzero(half):
+                    internal.flat[n] = int(single(values.flat[n].item()))
+            return internal
+    return _convs(values, code, 0, qm.IConv)
+
+
+def oconvs(values, code):
+    """
+    Applies an output conversion code to every element of a dynamic
+    array, like qmclient.OConvs, or of a sequence, returning a list.
+
+    A NumPy array of internal values is converted in one step to a
+    datetime64[D] array (date codes) or a float64 array of unscaled
+    amounts (decimal codes), rather than to formatted text.
+    """
+    if np is not None and isinstance(values, np.ndarray):
+        match = _decimal_code.match(code)
+        if _date_code.match(code):
+            epoch = np.datetime64(EPOCH.date(), 'D')
+            return epoch + values.astype(np.int64).astype('timedelta64[D]')
+        if match:
+            places, scale, _ = match.groups()
+            scale = int(places or 0) if scale is None else int(scale)
+            return values.astype(np.float64) / 10 ** scale
+    return _convs(values, code, 1, qm.OConv)
+
+
+def check(values, code):
+    """
+    Compares iconv() with qmclient.IConv for each of values, which
+    needs a connection to a real server; each value is sent to the
+    server as str(value), so give dates as text. Returns the (value,
+    local, server) triples that differ.
+    """
+    differ = []
+    for value in values:
+        local = iconv(value, code)
+        server = qm.IConv(str(value), code)
+        if local != server:
+            differ.append((value, local, server))
+    return differ
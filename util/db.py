@@ -1,22 +1,188 @@
+"""
+The storage interface the views use, with a backend per store.
+
+DB is the interface. mongodb.MongoDB keeps the documents in MongoDB and
+qm.QM in the QM files laid out by the schema module; connect() returns
+the one named by the DB_TYPE setting. Files are named as the Mongo
+collections are, e.g. 'invoice'.
+
+Filters and projections are written as for pymongo. A filter maps
+document keys to a value or to a condition of the operators $eq, $ne,
+$gt, $gte, $lt, $lte, $in and $nin; sort is a key or a list of
+(key, direction) pairs, direction 1 ascending and -1 descending. Each
+backend hands as much of the query as it can to its store, and query()
+returns a lazy iterator.
+
+Example:
+    store = connect(app.config)
+    for invoice in store.query('invoice', {'client': 12},
+                               sort=[('date', -1)], limit=20):
+        ...
+"""
+import datetime
+
+ASCENDING = 1
+DESCENDING = -1
+
+
 class DB():
     def __init__(self, *args, **kwargs):
         pass
-    
-    def query(self, *args, **kwargs):
-        pass
-    
-    def create(self, *args, **kwargs):
-        pass
-    
-    def read(self, *args, **kwargs):
-        pass
-    
-    def update(self, *args, **kwargs):
-        pass
-    
-    def delete(self, *args, **kwargs):
-        pass
-    
-    def sort(self, *args, **kwargs):
-        pass
-    
\ No newline at end of file
+
+    def query(self, file, filter=None, fields=None, sort=None, skip=0,
+              limit=0):
+        """
+        Returns an iterator over the documents of file matching filter,
+        in sort order, skipping the first skip and stopping after limit
+        (0 for no limit). fields lists the keys wanted, None for all;
+        _id is always included.
+        """
+        raise NotImplementedError
+
+    def count(self, file, filter=None):
+        """Returns the number of documents of file matching filter"""
+        raise NotImplementedError
+
+    def totals(self, file, keys, filter=None):
+        """
+        Returns a dict of the sum of each of keys over the documents of
+        file matching filter; a missing or null value counts as 0
+        """
+        raise NotImplementedError
+
+    def create(self, file, doc):
+        """Adds a document to file and returns its _id"""
+        raise NotImplementedError
+
+    def read(self, file, id, fields=None):
+        """Returns the document of file with _id id, None if there is none"""
+        raise NotImplementedError
+
+    def update(self, file, id, doc, replace=False):
+        """
+        Sets the keys in doc on the document with _id id, or with
+        replace true replaces the whole document with doc
+        """
+        raise NotImplementedError
+
+    def delete(self, file, id):
+        """Removes the document with _id id"""
+        raise NotImplementedError
+
+    def sort(self, file, key, descending=False, **kwargs):
+        """query() in the order of one key"""
+        return self.query(file, sort=[(key, DESCENDING if descending
+                                       else ASCENDING)], **kwargs)
+
+
+def connect(config, client=None):
+    """
+    Returns the backend named by config['DB_TYPE'], 'mongodb' (the
+    default) or 'qm'. A MongoDB backend uses client if given, or else
+    connects to DB_HOST and DB_PORT; DATABASE names the database. A QM
+    backend logs in to QM_ACCOUNT, by default QMUSERS.
+
+    With QM_HOST set the QM backend checks each request's session out
+    of a qmsupport.SessionPool of up to QM_POOL_SIZE sessions, connected
+    to QM_HOST and QM_PORT as QM_USER with QM_PASSWORD, so a threaded
+    server can use it. Without QM_HOST it shares one local connection
+    and must only be used from one thread.
+    """
+    db_type = config.get('DB_TYPE', 'mongodb')
+    if db_type == 'mongodb':
+        from mongodb import MongoDB
+        return MongoDB(client=client, host=config.get('DB_HOST', 'localhost'),
+                       port=config.get('DB_PORT', 27017),
+                       database=config['DATABASE'])
+    if db_type == 'qm':
+        from qm import QM
+        account = config.get('QM_ACCOUNT', 'QMUSERS')
+        pool = None
+        if config.get('QM_HOST'):
+            from qmsupport import SessionPool
+            pool = SessionPool(config['QM_HOST'], config.get('QM_PORT', -1),
+                               config.get('QM_USER', ''),
+                               config.get('QM_PASSWORD', ''), account,
+                               config.get('QM_POOL', ''),
+                               max_size=config.get('QM_POOL_SIZE', 4))
+        return QM(account=account, pool=pool)
+    raise Exception("Unknown DB_TYPE {}".format(db_type))
+
+
+# ======================================================================
+# Filters, projections and sorts evaluated in Python, for backends that
+# cannot hand all of a query to their store
+# ======================================================================
+def _compare(value, op, operand):
+    try:
+        if op == '$eq':
+            return value == operand
+        if op == '$ne':
+            return value != operand
+        if op == '$in':
+            return value in operand
+        if op == '$nin':
+            return value not in operand
+        if value in ('', None):
+            return False
+        if op == '$gt':
+            return value > operand
+        if op == '$gte':
+            return value >= operand
+        if op == '$lt':
+            return value < operand
+        if op == '$lte':
+            return value <= operand
+    except TypeError:
+        return False
+    raise Exception("Unsupported filter operator {}".format(op))
+
+
+def conditions(filter):
+    """Yields the (key, operator, operand) conditions of a filter"""
+    for key, test in (filter or {}).items():
+        if isinstance(test, dict):
+            for op, operand in test.items():
+                yield key, op, operand
+        else:
+            yield key, '$eq', test
+
+
+def matches(doc, filter):
+    """True if doc satisfies every condition of filter"""
+    return all(_compare(doc.get(key), op, operand)
+               for key, op, operand in conditions(filter))
+
+
+def project(doc, fields):
+    """Returns doc with only _id and the top level keys of fields"""
+    if fields is None:
+        return doc
+    keys = {field.split('.')[0] for field in fields}
+    return {key: value for key, value in doc.items()
+            if key == '_id' or key in keys}
+
+
+def sort_order(sort):
+    """Returns sort as a list of (key, direction) pairs"""
+    if sort is None:
+        return []
+    if isinstance(sort, str):
+        return [(sort, ASCENDING)]
+    return list(sort)
+
+
+def sort_docs(docs, sort):
+    """
+    Returns a list of docs sorted as the store would; null values come
+    before any other
+    """
+    docs = list(docs)
+    for key, direction in reversed(sort_order(sort)):
+        def order(doc, key=key):
+            value = doc.get(key)
+            if value in ('', None):
+                return (0, datetime.datetime.min)
+            return (1, value)
+        docs.sort(key=order, reverse=direction == DESCENDING)
+    return docs
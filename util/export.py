@@ -1,11 +1,45 @@
+import argparse
+import datetime
+import functools
+import glob
+import json
+import math
+import multiprocessing
+import os
+import time
+from contextlib import contextmanager
 import mvsupport as mvs
 import qmclient as qm
+import qmsupport as qms
+import schema
 from pymongo import MongoClient, DESCENDING, ASCENDING
 import pdb
 
 qm_connection = None
 db = None
 
+# Checksums of the records written by the last export, per file
+STATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.export')
+
+# Progress of the export in progress, removed when it finishes
+CHECKPOINT = os.path.join(STATE_DIR, 'checkpoint.json')
+
+# Invoices fetched from Mongo per round trip
+CURSOR_BATCH_SIZE = 1000
+
+# _id ranges per worker process in a parallel export, so that workers
+# finishing early pick up more of the work
+PARTITIONS_PER_WORKER = 4
+
+# Collection holding the watermark of each file, by file name
+WATERMARKS = 'export_watermark'
+
+# Longest time between an invoice's modified time being stamped and the
+# write being committed. A watermark is never later than the start of
+# the run less this, so an invoice stamped before the run but committed
+# after the scan passed it is picked up by the next run.
+WATERMARK_LAG = datetime.timedelta(minutes=5)
+
 def mongo_connect():
     global db
     if db is None:
@@ -21,7 +55,457 @@ def qm_connect():
             print("Cannot connect to server {}".format(qm.Error()))
             raise Exception
 
-def export_invoice():
+def checksum_store(file_name, full=False):
+    store = qms.ChecksumStore(os.path.join(STATE_DIR, file_name + '.json'))
+    if full:
+        store.clear()
+    return store
+
+def load_watermark(file_name):
+    """
+    Returns the modified time of the newest invoice exported to
+    file_name by the last successful run, None if there is none
+    """
+    mark = db[WATERMARKS].find_one({'_id': file_name})
+    if mark is None:
+        # Left in control by older versions
+        mark = db.control.find_one({'_id': 'export.' + file_name})
+    return mark['watermark'] if mark else None
+
+def save_watermark(file_name, watermark):
+    if watermark is not None:
+        db[WATERMARKS].update_one({'_id': file_name},
+                                  {'$set': {'watermark': watermark}},
+                                  upsert=True)
+        db.control.delete_one({'_id': 'export.' + file_name})
+
+def settled_watermark(checkpoint, newest):
+    """
+    The watermark to save for a run that saw modified times up to
+    newest: no later than the start of the run less WATERMARK_LAG, and
+    no earlier than the run's since
+    """
+    started = checkpoint.get('started')
+    if newest is not None and started is not None:
+        newest = min(newest, started - WATERMARK_LAG)
+    return newer(checkpoint['since'], newest)
+
+def partition_checkpoint(id_range):
+    """The checkpoint file of one partition of a parallel export"""
+    return os.path.join(STATE_DIR, 'checkpoint.{}-{}.json'.format(*id_range))
+
+def load_checkpoint(path=None):
+    """
+    Returns the checkpoint left by an export that did not finish, None
+    if there is none. path is the run's checkpoint by default.
+    """
+    path = path or CHECKPOINT
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        checkpoint = json.load(f)
+    for key in ('since', 'watermark', 'started'):
+        if checkpoint.get(key) is not None:
+            checkpoint[key] = datetime.datetime.fromisoformat(checkpoint[key])
+    checkpoint['ranges'] = [tuple(r) for r in checkpoint.get('ranges', [])]
+    checkpoint['done'] = [tuple(r) for r in checkpoint.get('done', [])]
+    return checkpoint
+
+def save_checkpoint(checkpoint, path=None):
+    """Writes the checkpoint, replacing the previous file in one step"""
+    path = path or CHECKPOINT
+    state = dict(checkpoint)
+    for key in ('since', 'watermark', 'started'):
+        if state.get(key) is not None:
+            state[key] = state[key].isoformat()
+    os.makedirs(STATE_DIR, exist_ok=True)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(state, f)
+    os.replace(path + '.tmp', path)
+
+def clear_checkpoint(path=None):
+    """Removes a checkpoint; the run's by default, with its partitions'"""
+    paths = [path]
+    if path is None:
+        paths = [CHECKPOINT] + glob.glob(partition_checkpoint(('*', '*')))
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+
+def new_checkpoint(file_names, since, full):
+    """
+    Returns the checkpoint of a run starting now. last_id holds, per
+    file, the _id of the last invoice whose records are all committed
+    and batches the number of batches committed; workers the number of
+    worker processes, and ranges and done the partitions of a parallel
+    run and those finished, each of which keeps its own last_id and
+    batches in its partition_checkpoint() while it runs.
+    """
+    return {'files': list(file_names), 'since': since, 'full': full,
+            'started': datetime.datetime.utcnow(), 'watermark': None,
+            'last_id': {}, 'batches': {}, 'workers': 1,
+            'ranges': [], 'done': []}
+
+def resume_checkpoint(file_names):
+    """
+    Returns the checkpoint to resume an export to file_names from, None
+    if the last run finished
+    """
+    checkpoint = load_checkpoint()
+    if checkpoint is None:
+        print("No checkpoint, starting a new export")
+        return None
+    if checkpoint['files'] != list(file_names):
+        print("Checkpoint is for an export to {}".format(
+            ', '.join(checkpoint['files'])))
+        raise Exception("Cannot resume export")
+    return checkpoint
+
+def newer(a, b):
+    """The later of two modified times, either of which may be None"""
+    if a is None or (b is not None and b > a):
+        return b
+    return a
+
+def invoice_query(since, id_range=None, after=None):
+    """
+    Returns the query for the invoices modified after since, or every
+    invoice if since is None, with _id in [low, high) if id_range is
+    given and above after if that is. Invoices never written since
+    modified times were stamped only go out in a full run.
+    """
+    query = {}
+    if since is not None:
+        query['modified'] = {'$gt': since}
+    if id_range is not None:
+        query['_id'] = {'$gte': id_range[0], '$lt': id_range[1]}
+    if after is not None:
+        query.setdefault('_id', {})['$gt'] = after
+    return query
+
+def changed_invoices(query, mark, fields, cursor_batch_size):
+    """
+    Yields the invoices matching query in _id order, keeping the newest
+    modified time seen in mark['watermark']. Only the keys in the
+    projection fields are fetched.
+    """
+    mark['watermark'] = None
+    fields = dict(fields, modified=1)
+    invoices = db.invoice.find(query, fields).sort('_id', ASCENDING)
+    for invoice in invoices.batch_size(cursor_batch_size):
+        mark['watermark'] = newer(mark['watermark'], invoice.get('modified'))
+        yield invoice
+
+def write_invoices(file_names, query, checksums, batch_size,
+                   cursor_batch_size, checkpoint=None, save=save_checkpoint):
+    """
+    Writes the records of the invoices matching query to each of
+    file_names in a single pass over the invoice collection. checksums
+    holds the checksum dict of each file. Returns the statistics of each
+    file and the newest modified time seen.
+
+    With a checkpoint, invoices at or below the file's last_id are not
+    written again, and the checkpoint is saved with save each time a
+    batch commits, so a run that dies repeats at most one batch per
+    file.
+    """
+    writers = {}
+    fields = {}
+    for file_name in file_names:
+        writers[file_name] = qms.BulkWriter(qms.open_file(file_name),
+                                            batch_size,
+                                            checksums=checksums[file_name])
+        fields.update(TARGETS[file_name][0])
+    last_id = checkpoint['last_id'] if checkpoint else {}
+    mark = {}
+    previous = None
+    for invoice in changed_invoices(query, mark, fields, cursor_batch_size):
+        id = invoice['_id']
+        committed = False
+        for file_name, writer in writers.items():
+            if last_id.get(file_name) is not None and id <= last_id[file_name]:
+                continue
+            batches = writer.stats['batches']
+            for rec_id, rec in TARGETS[file_name][1](invoice):
+                writer.add(rec_id, rec)
+            if checkpoint is not None and writer.stats['batches'] != batches:
+                # A batch filled while this invoice was added; earlier
+                # invoices are committed, this one only if nothing of
+                # it is still queued
+                done = previous if writer.batch else id
+                if done is not None:
+                    last_id[file_name] = done
+                checkpoint['batches'][file_name] = (
+                    checkpoint['batches'].get(file_name, 0) +
+                    writer.stats['batches'] - batches)
+                committed = True
+        previous = id
+        if committed:
+            checkpoint['watermark'] = newer(checkpoint['watermark'],
+                                            mark['watermark'])
+            save(checkpoint)
+    stats = {file_name: writer.close()
+             for file_name, writer in writers.items()}
+    return stats, mark['watermark']
+
+def since_watermark(file_names, full):
+    """The oldest watermark of file_names, None for a full export"""
+    if full:
+        return None
+    marks = [load_watermark(file_name) for file_name in file_names]
+    return None if None in marks else min(marks)
+
+def export(file_names, batch_size=500, full=False,
+           cursor_batch_size=CURSOR_BATCH_SIZE, workers=1, resume=False):
+    """
+    Writes the records of the invoices changed since the last run to
+    each of file_names, or of every invoice if full is true. With more
+    than one worker the invoices are split into _id ranges exported in
+    parallel, see export_parallel(). The watermarks only move once
+    every record has been committed.
+
+    Progress is kept in a checkpoint until the run finishes. resume
+    continues the last run from its checkpoint, with the same since,
+    full and serial or parallel mode, instead of starting a new one.
+    """
+    db.invoice.create_index('modified')
+    checkpoint = resume_checkpoint(file_names) if resume else None
+    if checkpoint is not None:
+        parallel = (checkpoint.get('workers', 1) > 1 or
+                    bool(checkpoint['ranges']))
+        if parallel != (workers > 1):
+            print("Resuming a {} export, as it was started".format(
+                'parallel' if parallel else 'serial'))
+        if parallel and workers < 2:
+            workers = max(checkpoint.get('workers', 1), 2)
+    else:
+        parallel = workers > 1
+    if parallel:
+        return export_parallel(file_names, batch_size, full,
+                               cursor_batch_size, workers, checkpoint)
+    if checkpoint is None:
+        checkpoint = new_checkpoint(file_names,
+                                    since_watermark(file_names, full), full)
+        save_checkpoint(checkpoint)
+        checksums = {file_name: checksum_store(file_name, full)
+                     for file_name in file_names}
+    else:
+        for file_name, id in checkpoint['last_id'].items():
+            print("{}: resuming after batch {}, invoice {}".format(
+                file_name, checkpoint['batches'][file_name], id))
+        checksums = {file_name: checksum_store(file_name)
+                     for file_name in file_names}
+    since = checkpoint['since']
+    last_ids = [checkpoint['last_id'].get(file_name)
+                for file_name in file_names]
+    after = None if None in last_ids else min(last_ids)
+    try:
+        stats, watermark = write_invoices(file_names,
+                                          invoice_query(since, after=after),
+                                          checksums, batch_size,
+                                          cursor_batch_size, checkpoint)
+    finally:
+        for store in checksums.values():
+            store.save()
+    watermark = settled_watermark(checkpoint,
+                                  newer(checkpoint['watermark'], watermark))
+    for file_name in file_names:
+        save_watermark(file_name, watermark)
+        report(file_name, stats[file_name])
+    clear_checkpoint()
+
+def partitions(query, count):
+    """
+    Splits the _id space of the invoices matching query into at most
+    count ranges [low, high) of equal width
+    """
+    first = db.invoice.find_one(query, {'_id': 1}, sort=[('_id', ASCENDING)])
+    if first is None:
+        return []
+    last = db.invoice.find_one(query, {'_id': 1}, sort=[('_id', DESCENDING)])
+    low, high = first['_id'], last['_id']
+    if not (isinstance(low, int) and isinstance(high, int)):
+        print("Invoice _ids {!r} to {!r} are not integers".format(low, high))
+        raise Exception("Cannot partition invoices")
+    high += 1
+    width = max(1, math.ceil((high - low) / count))
+    return [(n, min(n + width, high)) for n in range(low, high, width)]
+
+def range_checksums(file_names, checksums, query):
+    """
+    Returns, per file, the part of its checksums for the records of the
+    invoices matching query, so a worker only holds the checksums of
+    its own partition. Only the record ids are fetched from Mongo, and
+    only for files whose ids are not the invoice _ids.
+    """
+    slices = {file_name: {} for file_name in file_names}
+    nested = [file_name for file_name in file_names
+              if ID_KEYS[file_name] != '_id']
+    if len(nested) < len(file_names):
+        low, high = query['_id']['$gte'], query['_id']['$lt']
+        for file_name in file_names:
+            if ID_KEYS[file_name] == '_id':
+                slices[file_name] = {
+                    id: checksum
+                    for id, checksum in checksums[file_name].items()
+                    if id.isdigit() and low <= int(id) < high}
+    if not nested:
+        return slices
+    fields = {ID_KEYS[file_name]: 1 for file_name in nested}
+    invoices = db.invoice.find(query, fields)
+    for invoice in invoices.batch_size(CURSOR_BATCH_SIZE):
+        for file_name in nested:
+            key = ID_KEYS[file_name].split('.', 1)[1]
+            store, part = checksums[file_name], slices[file_name]
+            for item in invoice.get('detail', []):
+                id = str(item.get(key))
+                if id in store:
+                    part[id] = store[id]
+    return slices
+
+def _init_worker():
+    mongo_connect()
+    qm_connect()
+
+@contextmanager
+def worker_pool(workers, task='Export'):
+    """
+    A pool of worker processes for the with block, each with its own
+    Mongo client and QM session. The pool is closed and joined when the
+    block ends; if it raises, the workers are stopped and the error is
+    reported as task failing.
+    """
+    # Workers are spawned, not forked, so none inherits the parent's
+    # Mongo client or QM session
+    pool = multiprocessing.get_context('spawn').Pool(workers, _init_worker)
+    try:
+        yield pool
+        pool.close()
+    except Exception as e:
+        pool.terminate()
+        print("{} failed: {}".format(task, e))
+        raise
+    finally:
+        pool.join()
+
+def _export_partition(args):
+    """
+    Exports one _id range in a worker, given the checksums of the
+    records of that range. Returns the range, the statistics of each
+    file, the checksums that changed and the newest modified time seen.
+
+    Progress within the range is kept in its partition_checkpoint(), so
+    a partition that dies repeats at most one batch per file when the
+    export is resumed.
+    """
+    (file_names, since, id_range, checksums, batch_size,
+     cursor_batch_size) = args
+    path = partition_checkpoint(id_range)
+    checkpoint = (load_checkpoint(path) or
+                  new_checkpoint(file_names, since, False))
+    last_ids = [checkpoint['last_id'].get(file_name)
+                for file_name in file_names]
+    after = None if None in last_ids else min(last_ids)
+    before = {file_name: dict(part) for file_name, part in checksums.items()}
+    try:
+        stats, watermark = write_invoices(
+            file_names, invoice_query(since, id_range, after), checksums,
+            batch_size, cursor_batch_size, checkpoint,
+            functools.partial(save_checkpoint, path=path))
+    except Exception as e:
+        raise Exception("Partition {}-{} failed: {}".format(
+            id_range[0], id_range[1] - 1, e))
+    changed = {}
+    for file_name, store in checksums.items():
+        old = before[file_name]
+        changed[file_name] = {id: checksum for id, checksum in store.items()
+                              if old.get(id) != checksum}
+    return (id_range, stats, changed,
+            newer(checkpoint['watermark'], watermark))
+
+def export_parallel(file_names, batch_size=500, full=False,
+                    cursor_batch_size=CURSOR_BATCH_SIZE, workers=4,
+                    checkpoint=None):
+    """
+    Exports to file_names with a pool of worker processes, each with its
+    own Mongo client and QM session. The _id space of the changed
+    invoices is split into PARTITIONS_PER_WORKER ranges per worker and
+    progress is printed as each range finishes.
+
+    The checkpoint records the ranges and those finished. If any
+    partition fails the pool is stopped and the run fails; the
+    watermarks are not moved, and resuming from the checkpoint exports
+    the unfinished partitions.
+    """
+    started = time.perf_counter()
+    if checkpoint is None:
+        since = since_watermark(file_names, full)
+        checkpoint = new_checkpoint(file_names, since, full)
+        checkpoint['workers'] = workers
+        checkpoint['ranges'] = partitions(invoice_query(since),
+                                          workers * PARTITIONS_PER_WORKER)
+        save_checkpoint(checkpoint)
+        clear = full
+    else:
+        print("Resuming after {} of {} partitions".format(
+            len(checkpoint['done']), len(checkpoint['ranges'])))
+        clear = False
+    since = checkpoint['since']
+    ranges = [id_range for id_range in checkpoint['ranges']
+              if id_range not in checkpoint['done']]
+    checksums = {file_name: checksum_store(file_name, clear)
+                 for file_name in file_names}
+    totals = {file_name: {'records': 0, 'skipped': 0, 'batches': 0,
+                          'retries': 0} for file_name in file_names}
+    # The slices are all taken before the pool starts, as its task thread
+    # would otherwise read checksums while the loop below updates them
+    tasks = [(file_names, since, id_range,
+              range_checksums(file_names, checksums,
+                              invoice_query(since, id_range)),
+              batch_size, cursor_batch_size) for id_range in ranges]
+    try:
+        with worker_pool(workers) as pool:
+            results = pool.imap_unordered(_export_partition, tasks)
+            for done, (id_range, stats, changed, mark) in enumerate(results,
+                                                                    1):
+                for file_name in file_names:
+                    checksums[file_name].update(changed[file_name])
+                    for key in totals[file_name]:
+                        totals[file_name][key] += stats[file_name][key]
+                checkpoint['done'].append(id_range)
+                checkpoint['watermark'] = newer(checkpoint['watermark'], mark)
+                save_checkpoint(checkpoint)
+                clear_checkpoint(partition_checkpoint(id_range))
+                print("{}/{} partitions, {}".format(
+                    done, len(ranges), ', '.join(
+                        '{} {} records'.format(file_name,
+                                               totals[file_name]['records'])
+                        for file_name in file_names)))
+    finally:
+        for store in checksums.values():
+            store.save()
+    elapsed = time.perf_counter() - started
+    watermark = settled_watermark(checkpoint, checkpoint['watermark'])
+    for file_name in file_names:
+        stats = totals[file_name]
+        stats['seconds'] = elapsed
+        stats['rate'] = ((stats['records'] + stats['skipped']) / elapsed
+                         if elapsed else 0)
+        save_watermark(file_name, watermark)
+        report(file_name, stats)
+    clear_checkpoint()
+
+def report(file_name, stats):
+    print("{}: {} records in {} batches, {:.1f}s ({:.0f} records/s)".format(
+        file_name, stats['records'], stats['batches'], stats['seconds'],
+        stats['rate']))
+    if stats['skipped']:
+        print("{}: {} unchanged records not written".format(
+            file_name, stats['skipped']))
+    if stats['retries']:
+        print("{}: {} batch retries".format(file_name, stats['retries']))
+
+def export_invoice(batch_size=500, full=False, workers=1, resume=False):
     """
     1              D      1                         CLIENT         3R       S
     2              D      2                         OPEN DATE      5R       S
@@ -33,75 +517,103 @@ def export_invoice():
     8              D      8                         CHECK ID       10L      S
     9              D      9                         RATE           5R       S
     10             D      10                        TIMESHEETS     3R       M
+    11             D      11                        STATUS         6L       S
+    12             D      12                        CHECK NUMBER   10L      S
+    13             D      13                        PAID DATE      5R       S
+    14             D      14                        PERIOD         5R       S
     """
-    invoice_file = qm.Open('INVOICE')
-    
-    invoices = db.invoice.find().sort('date', ASCENDING)
-    for invoice in invoices:
-        invoice_rec = ''
-        invoice_date = qm.IConv(invoice['date'].strftime('%m/%d/%Y'),'D2MDY')
-        if invoice['close_date'] != "":
-            close_date = qm.IConv(invoice['close_date'].strftime('%m/%d/%Y'),'D2MDY')
-        else:
-            close_date = ''
-        amt = str(invoice['amount'])
-        if 'posted' not in invoice:
-            posted = 'Y'
-        else:
-            posted = str(invoice['posted'])
-        if 'check_id' not in invoice:
-            check_id = ''
-        else:
-            check_id = str(invoice['check_id'])
-        if 'rate' not in invoice:
-            rate = '5000'
-        else:
-            rate = qm.IConv(str(invoice['rate']),'MR2')
-        invoice_rec = qm.Replace(invoice_rec,1,0,0,str(invoice['client']))
-        invoice_rec = qm.Replace(invoice_rec,2,0,0,invoice_date)
-        invoice_rec = qm.Replace(invoice_rec,3,0,0,str(invoice['hours']))
-        invoice_rec = qm.Replace(invoice_rec,4,0,0,qm.IConv(amt,'MR2'))
-        invoice_rec = qm.Replace(invoice_rec,5,0,0,close_date)
-        invoice_rec = qm.Replace(invoice_rec,6,0,0,str(invoice['sent']))
-        invoice_rec = qm.Replace(invoice_rec,7,0,0,posted)
-        invoice_rec = qm.Replace(invoice_rec,8,0,0,check_id)
-        invoice_rec = qm.Replace(invoice_rec,9,0,0,rate)
-        for idx,val in enumerate(invoice['detail']):
-            invoice_rec = qm.Replace(invoice_rec,10,idx+1,0,str(val['_id']))
-        invoice_id = str(invoice['_id'])
-        qm.Write(invoice_file, invoice_id, invoice_rec)
-        
-def export_timesheet():
+    export(['INVOICE'], batch_size, full, workers=workers,
+           resume=resume)
+
+def invoice_records(invoice):
+    """
+    Yields the (id, record) pair of an invoice for the INVOICE file
+    """
+    yield str(invoice['_id']), schema.INVOICE.encode(invoice)
+
+
+def export_timesheet(batch_size=500, full=False, workers=1, resume=False):
     """
     1              D      1                         DATE           5L       S
     2              D      2                         WORK DONE      100L     S
     3              D      3                         HOURS          10L      S
     4              D      4                         INVOICE        5R       S
     """
-    timesheet_file = qm.Open("TIMESHEET")
-    invoices = db.invoice.find().sort('date', ASCENDING)
-    for invoice in invoices:
-        if 'detail' not in invoice:
+    export(['TIMESHEET'], batch_size, full, workers=workers,
+           resume=resume)
+
+def timesheet_records(invoice):
+    """
+    Yields (id, record) pairs of an invoice's timesheets for the
+    TIMESHEET file
+    """
+    for timesheet in invoice.get('detail', []):
+        if 'date' not in timesheet or timesheet['date'] == '':
             continue
-        for timesheet in invoice['detail']:
-            timesheet_rec = ''
-            if 'date' not in timesheet or timesheet['date'] == '':
-                continue
-            ts_date = qm.IConv(timesheet['date'].strftime('%m/%d/%Y'),'D2MDY')
-            ts_desc = timesheet['description']
-            ts_hours = str(timesheet['hours'])
-            ts_id = str(timesheet['_id'])
-            ts_invoice_id = str(invoice['_id'])
-            timesheet_rec = qm.Replace(timesheet_rec,1,0,0,ts_date)
-            timesheet_rec = qm.Replace(timesheet_rec,2,0,0,ts_desc)
-            timesheet_rec = qm.Replace(timesheet_rec,3,0,0,ts_hours)
-            timesheet_rec = qm.Replace(timesheet_rec,4,0,0,ts_invoice_id)
-            qm.Write(timesheet_file, ts_id, timesheet_rec)
+        timesheet = dict(timesheet, invoice=invoice['_id'])
+        yield str(timesheet['_id']), schema.TIMESHEET.encode(timesheet)
+
+def export_all(batch_size=500, full=False, workers=1, resume=False):
+    """
+    Writes both the INVOICE and TIMESHEET files from one pass over the
+    invoices
+    """
+    export(['INVOICE', 'TIMESHEET'], batch_size, full, workers=workers,
+           resume=resume)
+
+def projection(layout, prefix='', exclude=()):
+    """
+    Returns the Mongo projection of the document keys a schema encodes
+    """
+    fields = {}
+    for attr in layout.attrs:
+        if attr.key in exclude:
+            continue
+        key = attr.key if attr.subkey is None else attr.key + '.' + attr.subkey
+        fields[prefix + key] = 1
+    return fields
+
+# Invoice key holding the ids of the records of each file
+ID_KEYS = {'INVOICE': '_id', 'TIMESHEET': 'detail._id'}
+
+def create_indices():
+    """
+    Makes the alternate key indices the schemas name that the server
+    does not hold yet; the QM backend and the importer rely on them
+    """
+    for layout in schema.FILES.values():
+        for index, item in layout.index_items():
+            if qms.create_index(layout.file_name, index, item):
+                print("Built {} index {}".format(layout.file_name, index))
+
+
+# File name -> (projection of the invoice keys used, function of an
+# invoice yielding its records). The invoice key of a timesheet is the
+# _id of the invoice holding it.
+TARGETS = {
+    'INVOICE': (projection(schema.INVOICE), invoice_records),
+    'TIMESHEET': (dict(projection(schema.TIMESHEET, 'detail.', ['invoice']),
+                       **{'detail._id': 1}),
+                  timesheet_records),
+}
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export invoices to QM')
+    parser.add_argument('--full', action='store_true',
+                        help='export every invoice, not only those changed '
+                             'since the last run')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='export in parallel with this many processes')
+    parser.add_argument('--resume', action='store_true',
+                        help='continue the last export from its checkpoint')
+    parser.add_argument('--create-indices', action='store_true',
+                        help='first build the QM indices the schemas name '
+                             'that do not exist yet')
+    args = parser.parse_args()
     qm_connect()
     mongo_connect()
-    #export_invoice()
-    export_timesheet()
+    if args.create_indices:
+        create_indices()
+    export_all(full=args.full, workers=args.workers, resume=args.resume)
     qm.Disconnect()    
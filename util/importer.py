@@ -0,0 +1,186 @@
+"""
+Imports the QM INVOICE and TIMESHEET files into the Mongo invoice
+collection, the reverse of export.py.
+
+Invoice ids are streamed from a select list on INVOICE and handed out
+in batches. Each invoice is decoded with schema.INVOICE, which gives
+the keys held in the record in Mongo's types, and its timesheets are
+read from TIMESHEET through the INVOICE index. The batch is upserted
+with an unordered bulk_write.
+
+Only the keys QM holds are set, so the keys kept only in Mongo
+(modified...) are left as they are. A key of the INVOICE schema whose
+field is empty in QM is unset, so a value cleared in QM is cleared in
+Mongo too. The detail array is merged with the
+one in Mongo: each timesheet keeps its Mongo-only keys, and timesheets
+with no date, which export.py never writes to QM, are kept. Dated
+timesheets that are no longer in QM are dropped.
+
+The import refuses to start if the TIMESHEET INVOICE index is missing,
+or is empty while TIMESHEET holds records, since every detail array
+would then be emptied.
+
+With more than one worker the batches are imported by a pool of
+processes, each with its own QM session and Mongo client.
+
+Use:
+    python importer.py --workers 4
+"""
+import argparse
+import collections
+import time
+import export
+import mvsupport as mvs
+import qmclient as qm
+import qmsupport as qms
+import schema
+from pymongo import UpdateOne
+
+# Select list of the timesheets of one invoice; list 1 holds the invoices
+TIMESHEET_LIST = 2
+
+def check_index():
+    """
+    Raises an exception unless the TIMESHEET index on invoice exists
+    and, if TIMESHEET holds any record, holds at least one key
+    """
+    fno = qms.open_file('TIMESHEET')
+    index = schema.TIMESHEET.index('invoice')
+    if index not in qm.Indices(fno, '').split(mvs.AM):
+        print("TIMESHEET has no {} index".format(index))
+        raise Exception("Cannot import invoices")
+    if next(qms.select_iter(fno), None) is None:
+        return
+    if next(qms.index_range(fno, index), None) is None:
+        print("TIMESHEET index {} is empty; rebuild it".format(index))
+        raise Exception("Cannot import invoices")
+
+def read_invoice(invoice_file, timesheet_file, id):
+    """
+    Returns the invoice document for INVOICE record id with its detail
+    array, None if the record has gone
+    """
+    rec, err = qm.Read(invoice_file, id)
+    if err != 0:
+        return None
+    invoice = schema.INVOICE.decode(rec, id)
+    detail = []
+    for ts_id, ts_rec in qms.select_iter(timesheet_file,
+                                         schema.TIMESHEET.index('invoice'),
+                                         id, records=True,
+                                         listno=TIMESHEET_LIST):
+        timesheet = schema.TIMESHEET.decode(ts_rec, ts_id)
+        timesheet.pop('invoice', None)
+        detail.append(timesheet)
+    invoice['detail'] = sorted(detail, key=lambda ts: ('date' not in ts,
+                                                       ts.get('date')))
+    return invoice
+
+def merged_detail(detail, current):
+    """
+    Returns the detail array read from QM merged with the current one
+    in Mongo: timesheets keep the keys QM does not hold, and those with
+    no date, never exported, follow the ones from QM
+    """
+    current = current or []
+    by_id = {ts.get('_id'): ts for ts in current}
+    merged = [dict(by_id.get(ts['_id'], {}), **ts) for ts in detail]
+    merged.extend(ts for ts in current if ts.get('date') in ('', None))
+    return merged
+
+def import_batch(ids):
+    """
+    Upserts the invoices with the given INVOICE ids. Returns the number
+    of invoices and timesheets read and of documents inserted and
+    updated.
+    """
+    invoice_file = qms.open_file('INVOICE')
+    timesheet_file = qms.open_file('TIMESHEET')
+    stats = {'invoices': 0, 'timesheets': 0, 'inserted': 0, 'updated': 0}
+    invoices = []
+    for id in ids:
+        invoice = read_invoice(invoice_file, timesheet_file, id)
+        if invoice is None:
+            continue
+        stats['invoices'] += 1
+        stats['timesheets'] += len(invoice['detail'])
+        invoices.append(invoice)
+    current = {doc['_id']: doc.get('detail') for doc in export.db.invoice.find(
+        {'_id': {'$in': [invoice['_id'] for invoice in invoices]}},
+        {'detail': 1})} if invoices else {}
+    requests = []
+    for invoice in invoices:
+        invoice_id = invoice.pop('_id')
+        invoice['detail'] = merged_detail(invoice['detail'],
+                                          current.get(invoice_id))
+        update = {'$set': invoice}
+        cleared = {attr.key: '' for attr in schema.INVOICE.attrs
+                   if attr.key not in invoice}
+        if cleared:
+            update['$unset'] = cleared
+        requests.append(UpdateOne({'_id': invoice_id}, update, upsert=True))
+    if requests:
+        result = export.db.invoice.bulk_write(requests, ordered=False)
+        stats['inserted'] = result.upserted_count
+        stats['updated'] = result.modified_count
+    return stats
+
+def batches(ids, batch_size):
+    batch = []
+    for id in ids:
+        batch.append(id)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def import_invoices(batch_size=500, workers=1):
+    """
+    Imports every INVOICE record and its timesheets. With more than
+    one worker, at most two batches per worker are in flight at a time.
+    If any batch fails the pool is stopped and the run fails; batches
+    already written stay written, and a rerun upserts them again.
+    """
+    check_index()
+    started = time.perf_counter()
+    totals = {'invoices': 0, 'timesheets': 0, 'inserted': 0, 'updated': 0}
+
+    def add(stats):
+        for key in totals:
+            totals[key] += stats[key]
+
+    ids = qms.select_iter(qms.open_file('INVOICE'))
+    if workers <= 1:
+        for batch in batches(ids, batch_size):
+            add(import_batch(batch))
+    else:
+        pending = collections.deque()
+        with export.worker_pool(workers, 'Import') as pool:
+            for batch in batches(ids, batch_size):
+                pending.append(pool.apply_async(import_batch, (batch,)))
+                if len(pending) >= workers * 2:
+                    add(pending.popleft().get())
+            while pending:
+                add(pending.popleft().get())
+    report(totals, time.perf_counter() - started)
+
+def report(totals, seconds):
+    rate = totals['invoices'] / seconds if seconds else 0
+    print("{} invoices, {} timesheets, {:.1f}s ({:.0f} invoices/s)".format(
+        totals['invoices'], totals['timesheets'], seconds, rate))
+    print("{} inserted, {} updated".format(totals['inserted'],
+                                           totals['updated']))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Import invoices from QM')
+    parser.add_argument('--batch-size', type=int, default=500,
+                        help='invoices upserted per bulk write')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='import in parallel with this many processes')
+    args = parser.parse_args()
+    export.qm_connect()
+    export.mongo_connect()
+    import_invoices(args.batch_size, args.workers)
+    qm.Disconnect()
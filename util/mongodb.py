@@ -0,0 +1,55 @@
+"""
+The DB backend keeping its documents in MongoDB.
+
+Every part of a query is handed to the server: the filter, the
+projection, the sort, skip and limit all go into the find(), and the
+cursor itself is returned, so documents are fetched in batches as they
+are iterated.
+"""
+from pymongo import MongoClient
+
+from db import DB, sort_order
+
+
+class MongoDB(DB):
+
+    def __init__(self, *args, client=None, host='localhost', port=27017,
+                 database='contractor', **kwargs):
+        """Uses client if given, or else connects to host and port"""
+        if client is None:
+            client = MongoClient(host, port)
+        self.client = client
+        self.db = client[database]
+
+    def query(self, file, filter=None, fields=None, sort=None, skip=0,
+              limit=0):
+        cursor = self.db[file].find(filter or {}, fields)
+        order = sort_order(sort)
+        if order:
+            cursor = cursor.sort(order)
+        return cursor.skip(skip).limit(limit)
+
+    def count(self, file, filter=None):
+        return self.db[file].count_documents(filter or {})
+
+    def totals(self, file, keys, filter=None):
+        group = {key: {'$sum': '$' + key} for key in keys}
+        group['_id'] = None
+        result = next(self.db[file].aggregate(
+            [{'$match': filter or {}}, {'$group': group}]), {})
+        return {key: result.get(key, 0) for key in keys}
+
+    def create(self, file, doc):
+        return self.db[file].insert_one(doc).inserted_id
+
+    def read(self, file, id, fields=None):
+        return self.db[file].find_one({'_id': id}, fields)
+
+    def update(self, file, id, doc, replace=False):
+        if replace:
+            self.db[file].replace_one({'_id': id}, doc)
+        else:
+            self.db[file].update_one({'_id': id}, {'$set': doc})
+
+    def delete(self, file, id):
+        self.db[file].delete_one({'_id': id})
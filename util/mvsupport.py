@@ -9,9 +9,19 @@ Defines constant multi-value data markers:
     VM     : char(252)
     SV/SVM : char(251)
     TM     : char(250)
+
+mv_split/mv_join, mv_raise/mv_lower and mv_dcount, with the *_all
+variants for lists of records, encode and decode dynamic arrays in
+Python.
+
+key_order and compound_key give the order and keys of alternate key
+indices.
+
+DynArray provides client side Extract/Replace/Ins/Del/Dcount/Locate
+on a dynamic array held in Python, without a QMClient round trip per
+operation.
 """
 import os
-import re
 import datetime
 
 FM = '\xfe'
@@ -24,10 +34,22 @@ SVM = '\xfc'
 
 def mv_readnext(list_name):
     """
-    Provides a 'readnext' function to simulate a pick-style readnext
+    Provides a 'readnext' function to simulate a pick-style readnext.
+    list_name is a field mark delimited list, as returned by
+    qmclient.ReadList, or a python list of ids.
     """
-    for attr in list_name:
-        yield list_name[row]
+    if not isinstance(list_name, str):
+        yield from list_name
+        return
+    if list_name == '':
+        return
+    start = 0
+    end = list_name.find(AM)
+    while end >= 0:
+        yield list_name[start:end]
+        start = end + 1
+        end = list_name.find(AM, start)
+    yield list_name[start:]
 
 def mv_to_list(dyn_array):
     """
@@ -35,6 +57,77 @@ def mv_to_list(dyn_array):
     """
     return dyn_array.split(sep=AM)
 
+def _nest(attribute):
+    """Decodes one attribute the way qmclient.DynArrayToList does"""
+    if attribute == '':
+        return []
+    if VM not in attribute:
+        return attribute
+    return [[] if value == '' else value if SVM not in value
+            else value.split(SVM) for value in attribute.split(VM)]
+
+
+def mv_iter_nested(source):
+    """
+    Streaming counterpart of qmclient.DynArrayToList.
+
+    source is a dynamic array or an iterable of string chunks of one,
+    for instance successive ReadBlk results. Decoded attributes are
+    yielded one at a time, so only the attribute being decoded is held
+    in memory besides the current chunk.
+    """
+    if isinstance(source, str):
+        source = (source,)
+    buf = []
+    empty = True
+    for chunk in source:
+        empty = empty and chunk == ''
+        start = 0
+        end = chunk.find(AM)
+        while end >= 0:
+            buf.append(chunk[start:end])
+            yield _nest(''.join(buf))
+            buf = []
+            start = end + 1
+            end = chunk.find(AM, start)
+        buf.append(chunk[start:])
+    if not empty:
+        yield _nest(''.join(buf))
+
+
+def mv_iter_joined(a_list):
+    """
+    Streaming counterpart of qmclient.ListToDynArray. Yields the encoded
+    attributes with their leading attribute marks, ready to be written
+    out or joined.
+    """
+    mark = ''
+    for attribute in a_list:
+        if not isinstance(attribute, str):
+            attribute = VM.join(value if isinstance(value, str)
+                                else SVM.join(value) for value in attribute)
+        yield mark + attribute
+        mark = AM
+
+
+def mv_split(dynarray):
+    """
+    Converts a dynamic array to nested lists, as
+    qmclient.DynArrayToList does.
+    """
+    if dynarray == '':
+        return []
+    return [_nest(attribute) for attribute in dynarray.split(AM)]
+
+
+def mv_join(a_list):
+    """
+    Converts nested lists to a dynamic array, as qmclient.ListToDynArray
+    does.
+    """
+    return ''.join(mv_iter_joined(a_list))
+
+
 def mv_raise(dynarray):
     """
     Provides multi-value raise functionality.
@@ -43,10 +136,7 @@ def mv_raise(dynarray):
     """
     if AM in dynarray:
         return dynarray
-    dynarray = re.sub(VM,AM,dynarray)
-    dynarray = re.sub(SVM,VM,dynarray)
-    dynarray = re.sub(TM,SVM,dynarray)
-    return dynarray
+    return dynarray.replace(VM, AM).replace(SVM, VM).replace(TM, SVM)
 
 def mv_lower(dynarray):
     """
@@ -56,8 +146,280 @@ def mv_lower(dynarray):
     """
     if TM in dynarray:
         return dynarray
-    dynarray = re.sub(SVM,TM,dynarray)
-    dynarray = re.sub(VM,SVM,dynarray)
-    dynarray = re.sub(AM,VM,dynarray)
-    return dynarray
+    return dynarray.replace(SVM, TM).replace(VM, SVM).replace(AM, VM)
+
+
+def mv_raise_all(records):
+    """mv_raise applied to every dynamic array in records, as a list"""
+    return [mv_raise(rec) for rec in records]
+
+
+def mv_lower_all(records):
+    """mv_lower applied to every dynamic array in records, as a list"""
+    return [mv_lower(rec) for rec in records]
+
+
+def mv_split_all(records):
+    """mv_split applied to every dynamic array in records, as a list"""
+    return [mv_split(rec) for rec in records]
+
+
+def mv_join_all(lists):
+    """mv_join applied to every list in lists, as a list"""
+    return [''.join(mv_iter_joined(a_list)) for a_list in lists]
+
+
+def mv_dcount(s, delim):
+    """
+    Counts delimited items in a string, as qmclient.Dcount does.
+    A null string has no items.
+    """
+    if s == '':
+        return 0
+    if delim == '':
+        return 1
+    return s.count(delim) + 1
+
+
+def mv_field(in_str, delim, occurrence, count=1):
+    """
+    Extracts one or more components of a delimited string, as
+    qmclient.Field does. Only the first character of delim is used.
+    """
+    delim = delim[:1]
+    if delim == '':
+        return in_str if occurrence <= 1 else ''
+    start = max(occurrence, 1) - 1
+    return delim.join(in_str.split(delim)[start:start + max(count, 1)])
+
+
+# ======================================================================
+# Alternate key index keys
+# ======================================================================
+# Width each part of a compound index key is right justified to
+KEY_WIDTH = 10
+
+
+def key_order(key):
+    """
+    Sort key putting index keys in the order the server keeps them:
+    keys that are all numbers in numeric order, before the others
+    """
+    try:
+        return (0, float(key), key)
+    except ValueError:
+        return (1, 0.0, key)
+
+
+def compound_key(parts):
+    """
+    The key of a compound index on the internal values in parts, as an
+    I-type of FMT(part,'R%10') joined with '*' builds it, so a prefix
+    of the parts selects a contiguous, ordered run of keys. A null part
+    gives a null key, which is not indexed.
+    """
+    if any(part == '' for part in parts):
+        return ''
+    return '*'.join(part.rjust(KEY_WIDTH, '0') for part in parts)
+
+
+MARKS = (AM, VM, SVM)
+
+
+def _is_null(node):
+    """True if a parsed node serializes to a null string"""
+    if isinstance(node, str):
+        return node == ''
+    return len(node) == 1 and _is_null(node[0])
+
+
+def _join(node, level):
+    """Serializes a node parsed to any depth below the given mark level"""
+    if isinstance(node, str):
+        return node
+    return MARKS[level].join(_join(n, level + 1) for n in node)
+
+
+def _split(items, pos, level):
+    """Parses items[pos] into its components at the given mark level"""
+    node = items[pos - 1]
+    if isinstance(node, str):
+        node = items[pos - 1] = node.split(MARKS[level])
+    return node
+
+
+def _pad(items, n):
+    if len(items) < n:
+        items.extend([''] * (n - len(items)))
+
+
+def _position(items, pos):
+    """
+    Resolves a replace/insert position. Zero means 1 and a negative
+    position appends a new element, taking over a null container.
+    """
+    if pos < 0:
+        return 1 if _is_null(items) else len(items) + 1
+    return max(pos, 1)
+
+
+def _compare(a, b, right):
+    """
+    Compares two elements for an ordered locate. Right aligned
+    comparisons are numeric when both elements are numbers.
+    """
+    if right:
+        try:
+            a, b = float(a), float(b)
+        except ValueError:
+            width = max(len(a), len(b))
+            a, b = a.rjust(width), b.rjust(width)
+    return (a > b) - (a < b)
+
+
+class DynArray(object):
+    """
+    A mutable dynamic array.
+
+    The record is split into fields once. A field is split into values,
+    and a value into subvalues, the first time that level is addressed.
+    Edits are made in place and the record is only rebuilt by str().
+
+    Positions follow the qmclient Extract/Replace/Ins/Del/Locate
+    conventions and the results are the same as those functions give.
+
+    Example:
+        rec = DynArray(data)
+        rec.replace(10, -1, 0, '1042')
+        rec.delete(8, 0, 0)
+        qm.Write(fno, id, str(rec))
+    """
+
+    def __init__(self, rec=''):
+        self.fields = rec.split(AM)
+
+    def __str__(self):
+        return _join(self.fields, 0)
+
+    def _walk(self, f, v, sv):
+        """
+        Returns the list holding the element addressed for a replace or
+        insert and its position, creating missing parents on the way.
+        """
+        path = (f,) if v == 0 else (f, v) if sv == 0 else (f, v, sv)
+        items = self.fields
+        for level, pos in enumerate(path):
+            pos = _position(items, pos)
+            if level == len(path) - 1:
+                return items, pos
+            _pad(items, pos)
+            items = _split(items, pos, level + 1)
+
+    def _find(self, f, v, sv):
+        """
+        Returns the list holding an existing element and its position,
+        or (None, 0) if the element does not exist.
+        """
+        path = (max(f, 1),) if v < 1 else (f, v) if sv < 1 else (f, v, sv)
+        items = self.fields
+        for level, pos in enumerate(path):
+            pos = max(pos, 1)
+            if pos > len(items):
+                return None, 0
+            if level == len(path) - 1:
+                return items, pos
+            items = _split(items, pos, level + 1)
+
+    def extract(self, f, v=0, sv=0):
+        """
+        Returns a field, value or subvalue, or a null string if it
+        does not exist. v or sv less than 1 extracts the whole field or
+        value.
+        """
+        items, pos = self._find(max(f, 1), v, sv)
+        if items is None:
+            return ''
+        level = 1 if v < 1 else 2 if sv < 1 else 3
+        return _join(items[pos - 1], level)
+
+    def replace(self, f, v, sv, new_data):
+        """
+        Replaces a field, value or subvalue. A zero v or sv replaces the
+        whole field or value, a negative position appends a new element.
+        """
+        items, pos = self._walk(f, v, sv)
+        _pad(items, pos)
+        items[pos - 1] = new_data
+        return self
+
+    def ins(self, f, v, sv, new_data):
+        """
+        Inserts a new field, value or subvalue before the addressed
+        position. A negative position appends a new element.
+        """
+        items, pos = self._walk(f, v, sv)
+        if _is_null(items):
+            del items[:]
+        _pad(items, pos - 1)
+        items.insert(pos - 1, new_data)
+        return self
+
+    def delete(self, f, v=0, sv=0):
+        """
+        Deletes a field, value or subvalue together with its mark.
+        Deleting an element that does not exist changes nothing.
+        """
+        items, pos = self._find(max(f, 1), v, sv)
+        if items is not None:
+            del items[pos - 1]
+            if not items:
+                items.append('')
+        return self
+
+    def dcount(self, f=0, v=0):
+        """
+        Counts the fields in the record, the values in field f or the
+        subvalues in value v of field f.
+        """
+        items = self.fields
+        if f >= 1:
+            items, pos = self._find(f, v, 0)
+            if items is None:
+                return 0
+            items = _split(items, pos, 1 if v < 1 else 2)
+        return 0 if _is_null(items) else len(items)
+
+    def locate(self, item, f=1, v=0, sv=0, order=''):
+        """
+        Searches for an element, as qmclient.Locate does. With v and sv
+        zero the fields are searched from field f, with sv zero the
+        values of field f from value v, otherwise the subvalues of
+        value v from subvalue sv.
+
+        order is '' for an unordered list or 'AL', 'AR', 'DL', 'DR' for
+        a list in ascending/descending, left/right aligned order.
+
+        Returns found (1 or 0) and the position at which the item was
+        found or should be inserted.
+        """
+        if v < 1:
+            items, start, level = self.fields, f, 1
+        else:
+            parent, pos = self._find(f, 0 if sv < 1 else v, 0)
+            level = 2 if sv < 1 else 3
+            items = [''] if parent is None else _split(parent, pos, level - 1)
+            start = v if sv < 1 else sv
+        if _is_null(items):
+            items = []
+        descending = order[:1].upper() == 'D'
+        right = order[1:2].upper() == 'R'
+        for pos in range(max(start, 1), len(items) + 1):
+            elem = _join(items[pos - 1], level)
+            if elem == item:
+                return 1, pos
+            if order:
+                cmp = _compare(elem, item, right)
+                if (cmp < 0) if descending else (cmp > 0):
+                    return 0, pos
+        return 0, len(items) + 1
 
@@ -1,40 +1,413 @@
-from db import DB
-from datetime import datetime as dt
+"""
+The DB backend keeping its documents in the QM files laid out by the
+schema module; file 'invoice' is the INVOICE file, and so on.
+
+A query is answered from the cheapest source its filter allows: the
+records named by an _id condition, a walk of a compound index over the
+records equal in its leading keys, the select list of an alternate key
+index holding an equal value, a walk of an index over a range, or else
+a select of the whole file. Records are read and decoded one at a time
+as the iterator is consumed, and the whole filter is checked on each
+decoded document. If the source is not already in the order asked for,
+the matching documents are sorted in memory.
+
+An index holds no entry for a record whose value is null. A sort by an
+indexed key with no filter on it walks the index only when the index
+holds every record of the file, which is checked by counting ids on
+both; otherwise the file is selected and sorted in memory, so no record
+is left out. The answer is kept for COMPLETE_TTL seconds, or until the
+store next writes to the file, so a page view does not count the whole
+file twice over.
+
+An index the schema names but the server does not have is not used;
+the indices of each file are read once with Indices and a query that
+would have used a missing one selects the file instead, so a missing
+index costs time but never leaves records out. The definitions are
+made by export.py --create-indices.
+
+Keys not in a file's schema are not stored, and a filter on one raises
+an exception rather than matching nothing. The detail timesheets of
+an invoice are kept in TIMESHEET and joined back in when the detail is
+wanted.
+"""
+import itertools
+import time
+from contextlib import contextmanager, nullcontext
+from datetime import datetime as dt, timedelta
 import qmclient as qm
+import qmsupport as qms
 import mvsupport as mvs
+import conv
+import schema
+from db import DB, ASCENDING, DESCENDING, conditions, matches, project, \
+    sort_docs, sort_order
 
 connection = None
 
+# Seconds an index is taken to be complete, or not, before it is
+# counted again; writes by other processes are seen after this long
+COMPLETE_TTL = 60
+
+# File -> (key of the list of sub-documents, file holding them, key of
+# the sub-document holding the parent _id)
+JOINS = {'INVOICE': ('detail', 'TIMESHEET', 'invoice')}
+
 class QM(DB):
 
-    def __init__(self, *args, account='QMUSERS',**kwargs):
+    def __init__(self, *args, account='QMUSERS', pool=None, **kwargs):
+        """
+        Uses the module wide local connection, or sessions checked out
+        of pool (a qmsupport.SessionPool) when running threaded.
+        """
         global connection
-        if connection is None:
+        self.pool = pool
+        # File name -> names of the indices the server holds for it
+        self.indices = {}
+        # (file name, index) -> whether the index was complete, and when
+        self.completeness = {}
+        if pool is None and connection is None:
             connection = qm.ConnectLocal(account)
             if connection != 1:
                 print("Cannot connect to server {}".format(qm.Error()))
                 raise Exception
-            
-    def query(self, *args, **kwargs):
-        super().query(*args, **kwargs)
-        file_name = kwargs['file']
-        start_date = '1'
-        end_date = self.today()
-        if 'start_date' in kwargs:
-            start_date = qm.IConv(kwargs['start_date'],'D')
-        if 'end_date' in kwargs:
-            end_date = qm.IConv(dt.strftime(
-                kwargs['end_date'],'%m/%d/%Y'),'D')
-            
+
+    def session(self):
+        if self.pool is None:
+            return nullcontext()
+        return self.pool.session()
+
+    def layout(self, file):
+        """Returns the schema of the QM file for file"""
+        file_name = file.upper()
+        if file_name not in schema.FILES:
+            raise Exception("No QM file for {}".format(file))
+        return schema.FILES[file_name]
+
+    def query(self, file, filter=None, fields=None, sort=None, skip=0,
+              limit=0, **kwargs):
+        """
+        See DB.query(). The keyword arguments of the index walks,
+        key, value, start_date, end_date and descending, are also
+        taken; see index_filter().
+        """
+        if kwargs:
+            filter, sort = self.index_filter(filter, kwargs)
+        layout = self.layout(file)
+        self.check_filter(layout, filter)
+        with self.session():
+            fno = qms.open_file(layout.file_name)
+            found, ordered = self.source(fno, layout, filter or {},
+                                         sort_order(sort))
+            docs = (layout.decode(rec, id) for id, rec in found)
+            docs = (doc for doc in docs if matches(doc, filter))
+            if sort and not ordered:
+                docs = iter(sort_docs(docs, sort))
+            stop = skip + limit if limit else None
+            for doc in itertools.islice(docs, skip, stop):
+                yield self.joined(layout, project(doc, fields), fields)
+
+    def index_filter(self, filter, kwargs):
+        """
+        Returns the filter and sort for the keyword arguments of an
+        index walk:
+
+        key         the document key whose index is walked, default 'date'
+        value       only records holding this value, or else
+        start_date  the first and last dates of the range, by default
+        end_date    the beginning of the index and today
+        descending  walk the range from end_date back to start_date
+        """
+        filter = dict(filter or {})
+        key = kwargs.get('key', 'date')
+        if 'value' in kwargs:
+            filter[key] = kwargs['value']
+        else:
+            end_date = self.today()
+            test = {}
+            if 'start_date' in kwargs:
+                test['$gte'] = self.date(conv.iconv(kwargs['start_date'],'D'))
+            if 'end_date' in kwargs:
+                end_date = conv.iconv(kwargs['end_date'],'D')
+            test['$lte'] = self.date(end_date)
+            filter[key] = test
+        direction = DESCENDING if kwargs.get('descending') else ASCENDING
+        return filter, [(key, direction)]
+
+    def check_filter(self, layout, filter):
+        """Raises an exception if filter tests a key the file does not hold"""
+        for key, op, operand in conditions(filter):
+            if key == layout.id_key:
+                continue
+            try:
+                layout.attr(key)
+            except KeyError:
+                raise Exception("{} holds no {}".format(layout.file_name,
+                                                        key))
+
+    def complete(self, fno, layout, index):
+        """
+        True if index holds an entry for every record of the file. The
+        answer is reused for COMPLETE_TTL seconds unless the file is
+        written in the meantime; see changed().
+        """
+        now = time.monotonic()
+        found, when = self.completeness.get((layout.file_name, index),
+                                            (None, 0))
+        if found is None or now - when > COMPLETE_TTL:
+            found = (sum(1 for id in qms.index_range(fno, index)) ==
+                     sum(1 for id in qms.select_iter(fno)))
+            self.completeness[layout.file_name, index] = found, now
+        return found
+
+    def changed(self, file_name):
+        """Forgets whether the indices of file_name were complete"""
+        for key in [key for key in self.completeness if key[0] == file_name]:
+            del self.completeness[key]
+
+    def has_index(self, fno, layout, index):
+        """True if the server holds alternate key index on the file"""
+        names = self.indices.get(layout.file_name)
+        if names is None:
+            names = set(qm.Indices(fno, '').split(mvs.AM)) - {''}
+            for name in layout.index_names():
+                if name not in names:
+                    print("{} has no {} index; selecting the file instead"
+                          .format(layout.file_name, name))
+            self.indices[layout.file_name] = names
+        return index in names
+
+    def indexed(self, fno, layout, key):
+        """
+        True if key is held in the file and has an alternate key index
+        on the server
+        """
+        try:
+            index = layout.attr(key).index
+        except KeyError:
+            return False
+        return (key != layout.id_key and index is not None and
+                self.has_index(fno, layout, index))
+
+    def internal(self, layout, key, value):
+        """The value of key as it is held in the record and its index"""
+        attr = layout.attr(key)
+        if attr.conv:
+            return str(conv.iconv(value, attr.conv))
+        return str(value)
+
+    def source(self, fno, layout, filter, sort):
+        """
+        Returns an iterator over the (id, record) pairs that may match
+        filter, and whether they come in sort order
+        """
+        tests = list(conditions(filter))
+        for key, op, operand in tests:
+            if key == layout.id_key and op in ('$eq', '$in'):
+                ids = operand if op == '$in' else [operand]
+                return self.read_ids(fno, ids), False
+        sort_key, direction = sort[0] if len(sort) == 1 else (None, None)
+        for index in layout.compound:
+            if not self.has_index(fno, layout, index.name):
+                continue
+            found = self.compound_range(fno, layout, index, tests,
+                                        sort_key == index.keys[-1]
+                                        and direction == DESCENDING)
+            if found is not None:
+                return found, sort_key == index.keys[-1]
+        indexed = [(key, op, operand) for key, op, operand in tests
+                   if self.indexed(fno, layout, key)]
+        for key, op, operand in indexed:
+            if op in ('$eq', '$in'):
+                values = operand if op == '$in' else [operand]
+                index = layout.index(key)
+                found = itertools.chain.from_iterable(
+                    qms.select_iter(fno, index,
+                                    self.internal(layout, key, value),
+                                    records=True)
+                    for value in values)
+                return found, False
+        for key in [key for key, op, operand in indexed
+                    if op in ('$gt', '$gte', '$lt', '$lte')]:
+            low = high = None
+            for _, op, operand in [test for test in indexed
+                                   if test[0] == key]:
+                if op in ('$gt', '$gte'):
+                    low = self.internal(layout, key, operand)
+                elif op in ('$lt', '$lte'):
+                    high = self.internal(layout, key, operand)
+            ordered = key == sort_key
+            return qms.index_range(fno, layout.index(key), low, high,
+                                   ordered and direction == DESCENDING,
+                                   records=True), ordered
+        if (sort_key is not None and self.indexed(fno, layout, sort_key) and
+                self.complete(fno, layout, layout.index(sort_key))):
+            return qms.index_range(fno, layout.index(sort_key), None, None,
+                                   direction == DESCENDING,
+                                   records=True), True
+        return qms.select_iter(fno, records=True), False
+
+    def compound_range(self, fno, layout, index, tests, descending):
+        """
+        Returns the (id, record) pairs of a walk of compound index over
+        the records equal to tests in all its keys but the last, within
+        any range on the last, or None if tests do not fix those keys
+        """
+        *leading, last = index.keys
+        equal = {key: operand for key, op, operand in tests if op == '$eq'}
+        if not all(key in equal for key in leading):
+            return None
+        parts = [self.internal(layout, key, equal[key]) for key in leading]
+        low = high = None
+        for key, op, operand in tests:
+            if key != last:
+                continue
+            if op in ('$eq', '$gt', '$gte'):
+                low = self.internal(layout, key, operand)
+            if op in ('$eq', '$lt', '$lte'):
+                high = self.internal(layout, key, operand)
+        low = mvs.compound_key(parts + [low or '0'])
+        high = mvs.compound_key(parts + [high or '9' * mvs.KEY_WIDTH])
+        return qms.index_range(fno, index.name, low, high, descending,
+                               records=True)
+
+    def read_ids(self, fno, ids):
+        for id in ids:
+            rec, err = qm.Read(fno, str(id))
+            if err == 0:
+                yield str(id), rec
+
+    def joined(self, layout, doc, fields):
+        """
+        Returns doc with its list of sub-documents read in, if the file
+        has one and fields asks for it
+        """
+        if layout.file_name not in JOINS:
+            return doc
+        key, file_name, parent_key = JOINS[layout.file_name]
+        if key not in doc or (fields is not None and key + '._id' in fields
+                              and key not in fields):
+            return doc
+        child = schema.FILES[file_name]
+        fno = qms.open_file(file_name)
+        items = []
+        for item in doc[key]:
+            rec, err = qm.Read(fno, str(item['_id']))
+            if err == 0:
+                item = child.decode(rec, item['_id'])
+                item.pop(parent_key, None)
+            items.append(item)
+        doc[key] = items
+        return doc
+
+    def count(self, file, filter=None):
+        layout = self.layout(file)
+        self.check_filter(layout, filter)
+        tests = list(conditions(filter))
+        with self.session():
+            fno = qms.open_file(layout.file_name)
+            if not tests:
+                return sum(1 for id in qms.select_iter(fno))
+            if len(tests) == 1:
+                key, op, operand = tests[0]
+                if op == '$eq' and self.indexed(fno, layout, key):
+                    return sum(1 for id in qms.select_iter(
+                        fno, layout.index(key),
+                        self.internal(layout, key, operand)))
+        return sum(1 for doc in self.query(file, filter,
+                                           fields=[layout.id_key]))
+
+    def totals(self, file, keys, filter=None):
+        sums = dict.fromkeys(keys, 0)
+        for doc in self.query(file, filter, fields=keys):
+            for key in keys:
+                sums[key] += doc.get(key) or 0
+        return sums
+
+    def read(self, file, id, fields=None):
+        layout = self.layout(file)
+        with self.session():
+            rec, err = qm.Read(qms.open_file(layout.file_name), str(id))
+            if err != 0:
+                return None
+            doc = project(layout.decode(rec, id), fields)
+            return self.joined(layout, doc, fields)
+
+    @contextmanager
+    def transaction(self):
+        qm.Txn(qms.TXN_START)
+        try:
+            yield
+            qm.Txn(qms.TXN_COMMIT)
+        except Exception:
+            qm.Txn(qms.TXN_ABORT)
+            raise
+        if qm.Status() != 0:
+            raise Exception("Commit failed: {}".format(qm.Error()))
+
+    def write(self, layout, id, doc):
+        """
+        Writes doc as record id, and its sub-documents to their file;
+        those no longer in the list are deleted. With doc None the
+        record and all its sub-documents are deleted.
+        """
+        fno = qms.open_file(layout.file_name)
+        self.changed(layout.file_name)
+        if layout.file_name in JOINS:
+            key, file_name, parent_key = JOINS[layout.file_name]
+            self.changed(file_name)
+            child = schema.FILES[file_name]
+            child_fno = qms.open_file(file_name)
+            rec, err = qm.Read(fno, str(id))
+            old = layout.decode(rec).get(key, []) if err == 0 else []
+            new = (doc or {}).get(key) or []
+            keep = {str(item['_id']) for item in new}
+            for item in old:
+                if str(item['_id']) not in keep:
+                    qm.Delete(child_fno, str(item['_id']))
+            for item in new:
+                qm.Write(child_fno, str(item['_id']),
+                         child.encode(dict(item, **{parent_key: id})))
+        if doc is None:
+            qm.Delete(fno, str(id))
+        else:
+            qm.Write(fno, str(id), layout.encode(doc))
+
+    def create(self, file, doc):
+        layout = self.layout(file)
+        id = doc[layout.id_key]
+        with self.session(), self.transaction():
+            self.write(layout, id, doc)
+        return id
+
+    def update(self, file, id, doc, replace=False):
+        layout = self.layout(file)
+        with self.session():
+            if not replace:
+                doc = dict(self.read(file, id) or {}, **doc)
+            with self.transaction():
+                self.write(layout, id, doc)
+
+    def delete(self, file, id):
+        layout = self.layout(file)
+        with self.session(), self.transaction():
+            self.write(layout, id, None)
+
     def invoice_list(self,*args, **kwargs):
-        if 'start_date' in kwargs:
-            start_date = qm.IConv(kwargs['start_date'],'D')
-        if 'end_date' in kwargs:
-            end_date = qm.IConv(dt.strftime(
-                kwargs['end_date'],'%m/%d/%Y'),'D')
-        
-            
-        
+        """
+        Streams the invoices dated between start_date and end_date,
+        newest first, as the invoice list page shows them. With client
+        only that client's invoices in the range are read, in order,
+        through the CLIENT.DATE index.
+        """
+        filter, sort = self.index_filter(None, dict(kwargs, key='date',
+                                                    descending=True))
+        if 'client' in kwargs:
+            filter['client'] = kwargs['client']
+        yield from self.query('invoice', filter, sort=sort)
+
+    def date(self, internal):
+        """The datetime of an internal date"""
+        return conv.EPOCH + timedelta(days=int(internal))
+
     def today(self):
-        return qm.IConv(dt.strftime(dt.now(),'%m/%d/%Y'),'D')
-    
\ No newline at end of file
+        return conv.iconv(dt.now(),'D')
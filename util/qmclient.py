@@ -35,8 +35,12 @@ Use:
 import os
 import platform
 import ctypes as ct
+import collections
 import copy
+import itertools
 import sys
+import threading
+import time
 from ctypes.util import find_library
 
 # __qm_lib is needed by all functions defined here and must persist.
@@ -44,26 +48,457 @@ from ctypes.util import find_library
 __qm_lib = None
 
 
+# ======================================================================
+# Library prototypes
+# ======================================================================
+# Argument and result types of every library entry point used by this
+# module. They are applied once, when the library is loaded, and the
+# configured function objects are kept in __qm_func so that the wrappers
+# below can call straight into the library.
+
+__ARGS20 = [ct.c_wchar_p] * 20
+
+__qm_protos = {
+    'QMFree': ([ct.c_void_p], None),
+    'QMCallxW': ([ct.c_wchar_p, ct.c_short] + __ARGS20, ct.c_int),
+    'QMChangeW': ([ct.c_wchar_p, ct.c_wchar_p, ct.c_wchar_p, ct.c_int,
+                   ct.c_int], ct.c_void_p),
+    'QMChecksumW': ([ct.c_wchar_p], ct.c_int),
+    'QMClearFile': ([ct.c_int], ct.c_int),
+    'QMClearSelect': ([ct.c_int], ct.c_int),
+    'QMClose': ([ct.c_int], ct.c_int),
+    'QMConnectW': ([ct.c_wchar_p, ct.c_int, ct.c_wchar_p, ct.c_wchar_p,
+                    ct.c_wchar_p], ct.c_int),
+    'QMConnected': ([], ct.c_int),
+    'QMConnectionType': ([ct.c_int], ct.c_int),
+    'QMConnectLocalW': ([ct.c_wchar_p], ct.c_int),
+    'QMConnectPoolW': ([ct.c_wchar_p, ct.c_int, ct.c_wchar_p, ct.c_wchar_p,
+                        ct.c_wchar_p, ct.c_wchar_p], ct.c_int),
+    'QMCreateObjectW': ([ct.c_wchar_p, ct.c_short] + __ARGS20, ct.c_int),
+    'QMDcountW': ([ct.c_wchar_p, ct.c_wchar_p], ct.c_int),
+    'QMDelW': ([ct.c_wchar_p, ct.c_int, ct.c_int, ct.c_int], ct.c_void_p),
+    'QMDeleteW': ([ct.c_int, ct.c_wchar_p], ct.c_int),
+    'QMDeleteuW': ([ct.c_int, ct.c_wchar_p], ct.c_int),
+    'QMDestroyObject': ([ct.c_int], ct.c_int),
+    'QMDisconnect': ([], ct.c_int),
+    'QMDisconnectAll': ([], ct.c_int),
+    'QMEndCommand': ([], ct.c_int),
+    'QMEnterPackageW': ([ct.c_wchar_p], ct.c_int),
+    'QMErrorW': ([], ct.c_void_p),
+    'QMEvalConvW': ([ct.c_int, ct.c_wchar_p, ct.c_wchar_p, ct.c_wchar_p],
+                    ct.c_void_p),
+    'QMEvaluateW': ([ct.c_int, ct.c_wchar_p, ct.c_wchar_p, ct.c_wchar_p],
+                    ct.c_void_p),
+    'QMExecuteW': ([ct.c_wchar_p, ct.c_void_p], ct.c_void_p),
+    'QMExitPackageW': ([ct.c_wchar_p], ct.c_int),
+    'QMExtractW': ([ct.c_wchar_p, ct.c_int, ct.c_int, ct.c_int],
+                   ct.c_void_p),
+    'QMFieldW': ([ct.c_wchar_p, ct.c_wchar_p, ct.c_int, ct.c_int],
+                 ct.c_void_p),
+    'QMGetW': ([ct.c_short, ct.c_wchar_p, ct.c_short] + __ARGS20,
+               ct.c_void_p),
+    'QMGetArgW': ([ct.c_short], ct.c_void_p),
+    'QMGetSession': ([], ct.c_int),
+    'QMGetVarW': ([ct.c_wchar_p], ct.c_void_p),
+    'QMIConvW': ([ct.c_wchar_p, ct.c_wchar_p], ct.c_void_p),
+    'QMIConvsW': ([ct.c_wchar_p, ct.c_wchar_p], ct.c_void_p),
+    'QMIndicesW': ([ct.c_int, ct.c_wchar_p], ct.c_void_p),
+    'QMInsW': ([ct.c_wchar_p, ct.c_int, ct.c_int, ct.c_int, ct.c_wchar_p],
+               ct.c_void_p),
+    'QMIsECS': ([], ct.c_int),
+    'QMLocateW': ([ct.c_wchar_p, ct.c_wchar_p, ct.c_int, ct.c_int, ct.c_int,
+                   ct.c_void_p, ct.c_wchar_p], ct.c_int),
+    'QMLogtoW': ([ct.c_wchar_p], ct.c_int),
+    'QMMarkMapping': ([ct.c_int, ct.c_int], ct.c_int),
+    'QMMatchW': ([ct.c_wchar_p, ct.c_wchar_p], ct.c_int),
+    'QMMatchfieldW': ([ct.c_wchar_p, ct.c_wchar_p, ct.c_int], ct.c_void_p),
+    'QMNextPartialW': ([ct.c_int], ct.c_void_p),
+    'QMOConvW': ([ct.c_wchar_p, ct.c_wchar_p], ct.c_void_p),
+    'QMOConvsW': ([ct.c_wchar_p, ct.c_wchar_p], ct.c_void_p),
+    'QMOpenW': ([ct.c_wchar_p], ct.c_int),
+    'QMOpenSeqW': ([ct.c_wchar_p, ct.c_wchar_p, ct.c_int], ct.c_int),
+    'QMPoolIdle': ([], ct.c_int),
+    'QMReadW': ([ct.c_int, ct.c_wchar_p, ct.c_void_p], ct.c_void_p),
+    'QMReadBlkW': ([ct.c_int, ct.c_int, ct.c_void_p], ct.c_void_p),
+    'QMReadlW': ([ct.c_int, ct.c_wchar_p, ct.c_int, ct.c_void_p],
+                 ct.c_void_p),
+    'QMReadListW': ([ct.c_int], ct.c_void_p),
+    'QMReadNextW': ([ct.c_int], ct.c_void_p),
+    'QMReadSeqW': ([ct.c_int, ct.c_void_p], ct.c_void_p),
+    'QMReaduW': ([ct.c_int, ct.c_wchar_p, ct.c_int, ct.c_void_p],
+                 ct.c_void_p),
+    'QMRecordlockW': ([ct.c_int, ct.c_wchar_p, ct.c_int, ct.c_int],
+                      ct.c_int),
+    'QMRecordlockedW': ([ct.c_int, ct.c_wchar_p], ct.c_int),
+    'QMReleaseW': ([ct.c_int, ct.c_wchar_p], ct.c_int),
+    'QMReplaceW': ([ct.c_wchar_p, ct.c_int, ct.c_int, ct.c_int,
+                    ct.c_wchar_p], ct.c_void_p),
+    'QMRespondW': ([ct.c_wchar_p, ct.c_void_p], ct.c_void_p),
+    'QMRevisionW': ([], ct.c_void_p),
+    'QMRTransW': ([ct.c_wchar_p, ct.c_wchar_p, ct.c_wchar_p, ct.c_wchar_p],
+                  ct.c_void_p),
+    'QMSeek': ([ct.c_int, ct.c_int, ct.c_int], ct.c_int),
+    'QMSelect': ([ct.c_int, ct.c_int], ct.c_int),
+    'QMSelectIndexW': ([ct.c_int, ct.c_wchar_p, ct.c_wchar_p, ct.c_int],
+                       ct.c_int),
+    'QMSelectLeftW': ([ct.c_int, ct.c_wchar_p, ct.c_int], ct.c_void_p),
+    'QMSelectPartialW': ([ct.c_int, ct.c_int], ct.c_void_p),
+    'QMSelectRightW': ([ct.c_int, ct.c_wchar_p, ct.c_int], ct.c_void_p),
+    'QMSetW': ([ct.c_short, ct.c_wchar_p, ct.c_short] + __ARGS20, ct.c_int),
+    'QMSetLeftW': ([ct.c_int, ct.c_wchar_p], ct.c_int),
+    'QMSetRightW': ([ct.c_int, ct.c_wchar_p], ct.c_int),
+    'QMSetSession': ([ct.c_int], ct.c_int),
+    'QMStatus': ([], ct.c_int),
+    'QMSystemW': ([ct.c_int], ct.c_void_p),
+    'QMTransW': ([ct.c_wchar_p, ct.c_wchar_p, ct.c_wchar_p, ct.c_wchar_p],
+                 ct.c_void_p),
+    'QMTrapCallAbort': ([ct.c_int], ct.c_int),
+    'QMTxn': ([ct.c_int], ct.c_int),
+    'QMWeofSeq': ([ct.c_int], ct.c_int),
+    'QMWriteW': ([ct.c_int, ct.c_wchar_p, ct.c_wchar_p], ct.c_int),
+    'QMWriteBlk': ([ct.c_int, ct.c_wchar_p, ct.c_int], ct.c_int),
+    'QMWriteSeq': ([ct.c_int, ct.c_wchar_p], ct.c_int),
+    'QMWriteSeqKey': ([ct.c_int, ct.c_wchar_p], ct.c_void_p),
+    'QMWriteuW': ([ct.c_int, ct.c_wchar_p, ct.c_wchar_p], ct.c_int),
+}
+
+
+def __Unbound(name):
+    """
+    Placeholder for a library function that has not been bound yet.
+    The first call loads the library, binds every prototype and then
+    forwards to the real function.
+    """
+
+    def call(*args):
+        __LoadQMCliLib()
+        func = __qm_func[name]
+        if func is call:
+            func = getattr(__qm_lib, name)
+        return func(*args)
+
+    return call
+
+
+__qm_func = {name: __Unbound(name) for name in __qm_protos}
+
+
+# ======================================================================
+# Thread bound sessions
+# ======================================================================
+# The library keeps a single selected session for the whole process.
+# Once ThreadSessions() has been called every library call is made
+# under __qm_lock, after selecting the session bound to the calling
+# thread, so threads using different sessions cannot interleave.
+
+__qm_lock = threading.RLock()
+__qm_thread = threading.local()
+__qm_threaded = False
+__qm_selected = None
+
+# Calls that select a new session or end the selected one
+__qm_session_start = ('QMConnectW', 'QMConnectLocalW', 'QMConnectPoolW',
+                      'QMSetSession')
+__qm_session_end = ('QMDisconnect', 'QMDisconnectAll', 'QMPoolIdle')
+
+
+def __Threaded(name, func):
+    """
+    Wraps a library function so that it runs under the library lock
+    with the calling thread's session selected.
+    """
+
+    def call(*args):
+        global __qm_selected
+        with __qm_lock:
+            session = getattr(__qm_thread, 'session', None)
+            if session is not None and session != __qm_selected:
+                __qm_lib.QMSetSession(session)
+                __qm_selected = session
+            result = func(*args)
+            if name in __qm_session_start:
+                __qm_selected = __qm_lib.QMGetSession()
+                __qm_thread.session = __qm_selected
+            elif name in __qm_session_end:
+                __qm_selected = None
+                __qm_thread.session = None
+            return result
+
+    return call
+
+
+# ======================================================================
+# Call statistics
+# ======================================================================
+# Once Instrument() has been called every library call records its
+# latency and the number of characters sent and received, by function
+# and, for functions taking one, by file number. The wrappers are only
+# installed while statistics are on; otherwise the function table is
+# left as it is and calls cost nothing extra.
+
+__qm_stats = None
+__qm_stats_lock = threading.Lock()
+
+# Latencies kept per function or file for the percentiles
+__qm_samples = 1000
+
+# Functions whose first argument is a file number
+__qm_fno_funcs = frozenset([
+    'QMClearFile', 'QMClose', 'QMDeleteW', 'QMDeleteuW', 'QMEvalConvW',
+    'QMEvaluateW', 'QMIndicesW', 'QMMarkMapping', 'QMReadW', 'QMReadBlkW',
+    'QMReadlW', 'QMReadSeqW', 'QMReaduW', 'QMRecordlockW',
+    'QMRecordlockedW', 'QMReleaseW', 'QMSeek', 'QMSelect', 'QMSelectIndexW',
+    'QMSelectLeftW', 'QMSelectPartialW', 'QMSelectRightW', 'QMSetLeftW',
+    'QMSetRightW', 'QMWeofSeq', 'QMWriteW', 'QMWriteBlk', 'QMWriteSeq',
+    'QMWriteSeqKey', 'QMWriteuW'])
+
+
+def __Record(table, key, elapsed, sent, received):
+    entry = table.get(key)
+    if entry is None:
+        entry = table[key] = [0, 0.0, 0, 0,
+                              collections.deque(maxlen=__qm_samples)]
+    entry[0] += 1
+    entry[1] += elapsed
+    entry[2] += sent
+    entry[3] += received
+    entry[4].append(elapsed)
+
+
+def __Timed(name, func):
+    """
+    Wraps a library function so that every call is recorded in
+    __qm_stats under the name of the wrapper, e.g. QMReadW as Read.
+    """
+
+    label = name[2:-1] if name.endswith('W') else name[2:]
+    by_fno = name in __qm_fno_funcs
+    returns_str = __qm_protos[name][1] is ct.c_void_p
+    clock = time.perf_counter
+
+    def call(*args):
+        started = clock()
+        result = func(*args)
+        elapsed = clock() - started
+        stats = __qm_stats
+        if stats is None:
+            return result
+        sent = sum(len(arg) for arg in args if isinstance(arg, str))
+        received = len(ct.wstring_at(result)) if returns_str and result else 0
+        with __qm_stats_lock:
+            __Record(stats['functions'], label, elapsed, sent, received)
+            if by_fno:
+                __Record(stats['files'], args[0], elapsed, sent, received)
+            elif name == 'QMOpenW' and result:
+                stats['names'][result] = args[0]
+        return result
+
+    return call
+
+
+def __Bind(name, func):
+    """
+    Returns the configured library function func wrapped as the
+    current ThreadSessions() and Instrument() settings require.
+    """
+
+    if __qm_stats is not None and name != 'QMFree':
+        func = __Timed(name, func)
+    if __qm_threaded:
+        func = __Threaded(name, func)
+    return func
+
+
+def __Rebind():
+    """Rebuilds the function table after a change of settings"""
+
+    if __qm_lib is None:
+        return
+    for name in __qm_protos:
+        try:
+            func = getattr(__qm_lib, name)
+        except AttributeError:
+            continue
+        __qm_func[name] = __Bind(name, func)
+
+
+# ======================================================================
+# Session accounts
+# ======================================================================
+# The account each session is logged in to, with a serial number that
+# changes whenever the session connects or logs to another account, so
+# that anything caching file numbers can tell when they became invalid.
+# Kept by the Connect functions, Logto() and the disconnect functions.
+
+__qm_accounts = {}
+__qm_serial = itertools.count(1)
+
+
+def __SetAccount(account):
+    with __qm_lock:
+        session = __qm_func['QMGetSession']()
+        if account is None:
+            __qm_accounts.pop(session, None)
+            __qm_txn.pop(session, None)
+        else:
+            __qm_accounts[session] = (account, next(__qm_serial))
+        for key in [key for key in __qm_file_names if key[0] == session]:
+            del __qm_file_names[key]
+
+
+# ======================================================================
+# Record cache
+# ======================================================================
+# Once CacheRecords() has been called Read() keeps the records it reads,
+# keyed by account, file name and id, and answers repeated reads from
+# memory until the entry is ttl seconds old. Write(), Writeu(), Delete(),
+# Deleteu() and ClearFile() drop the entries they make stale once the
+# server has made the change, and each drop moves the generation of the
+# record (of the file, for ClearFile) on. A read notes the generations
+# before it goes to the server and only caches the record if neither
+# has moved by the time it comes back, so a read that raced a change in
+# this process cannot put the old record back. The ttl bounds how long
+# a change made by another process can go unseen.
+#
+# While a session has a transaction open its reads neither use nor fill
+# the cache, and the entries its changes touched are dropped again when
+# the transaction commits or aborts.
+
+__qm_cache = None
+__qm_cache_lock = threading.Lock()
+__qm_cache_size = 1000
+__qm_cache_ttl = 30.0
+__qm_cache_stats = {}
+
+# (session, fno) -> file name, for files opened while caching
+__qm_file_names = {}
+
+# session -> [(fno, id)] changed in the transaction the session has open
+__qm_txn = {}
+
+# Generations of records and files, by hash of their cache key. Keys
+# sharing a slot only cost each other the odd skipped put.
+__qm_cache_gens = [0] * 4096
+
+
+def __CacheKey(fno, id):
+    """Returns the cache key of a record, None if it is not cacheable"""
+    session = __qm_func['QMGetSession']()
+    name = __qm_file_names.get((session, fno))
+    account = __qm_accounts.get(session)
+    if name is None or account is None:
+        return None
+    return account[0], name, id
+
+
+def __CacheReadKey(fno, id):
+    """The cache key for a read, None if the read must go to the server"""
+    if __qm_func['QMGetSession']() in __qm_txn:
+        return None
+    return __CacheKey(fno, id)
+
+
+def __CacheGen(key):
+    """The generations of a record and its file, to be passed to __CachePut"""
+    slots = len(__qm_cache_gens)
+    return (__qm_cache_gens[hash(key) % slots],
+            __qm_cache_gens[hash(key[:2]) % slots])
+
+
+def __CacheGet(key):
+    with __qm_cache_lock:
+        entry = __qm_cache.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            __qm_cache.move_to_end(key)
+            __qm_cache_stats['hits'] += 1
+            return entry[1]
+        __qm_cache_stats['misses'] += 1
+        return None
+
+
+def __CachePut(key, rec, gen):
+    """Caches a record read, unless it was dropped since gen was taken"""
+    with __qm_cache_lock:
+        if __qm_cache is None or __CacheGen(key) != gen:
+            return
+        __qm_cache[key] = (time.monotonic() + __qm_cache_ttl, rec)
+        __qm_cache.move_to_end(key)
+        while len(__qm_cache) > __qm_cache_size:
+            __qm_cache.popitem(last=False)
+            __qm_cache_stats['evictions'] += 1
+
+
+def __CacheDrop(fno, id=None):
+    """Drops a record, or with id None every record of the file"""
+    key = __CacheKey(fno, id)
+    if key is None:
+        return
+    changed = __qm_txn.get(__qm_func['QMGetSession']())
+    if changed is not None:
+        changed.append((fno, id))
+    with __qm_cache_lock:
+        slot = hash(key[:2] if id is None else key) % len(__qm_cache_gens)
+        __qm_cache_gens[slot] += 1
+        if __qm_cache is None:
+            return
+        if id is None:
+            keys = [k for k in __qm_cache if k[:2] == key[:2]]
+        else:
+            keys = [key] if key in __qm_cache else []
+        for k in keys:
+            del __qm_cache[k]
+        __qm_cache_stats['invalidations'] += len(keys)
+
+
+def __CacheTxnEnd():
+    """Drops the entries changed by the session's transaction"""
+    changed = __qm_txn.pop(__qm_func['QMGetSession'](), [])
+    if __qm_cache is not None:
+        for fno, id in changed:
+            __CacheDrop(fno, id)
+
+
 # ======================================================================
 # __LoadQMCliLib() - Internal function to load QMClient library
 # ======================================================================
 def __LoadQMCliLib():
     """
-    Called from all functions that might be the first use of QMClient.
+    Called on the first use of any QMClient library function.
+
+    Loads the library and binds every prototype in __qm_protos into
+    __qm_func. Entry points missing from the installed library are left
+    unbound and raise AttributeError when called.
 
     On Linux, the QMSYSCLI or QMSYS environment variable must be set to point
     to the QMSYS account directory.
+
+    If the QMFAKE environment variable is set the in-process fake in the
+    qmfake module is used instead of the library.
     """
 
     global __qm_lib
 
-    if __qm_lib is None:
-        if platform.system() == 'Linux':
+    with __qm_lock:
+        if __qm_lib is not None:
+            return
+        if os.getenv("QMFAKE"):
+            import qmfake as lib
+        elif platform.system() == 'Linux':
             qmsys = os.getenv("QMSYS")
             libpath = qmsys + "/bin/qmclilib.so"
-            __qm_lib = ct.cdll.LoadLibrary(libpath)
+            lib = ct.cdll.LoadLibrary(libpath)
         else:
-            __qm_lib = ct.cdll.LoadLibrary(find_library("qmclilib"))
+            lib = ct.cdll.LoadLibrary(find_library("qmclilib"))
+
+        for name, (argtypes, restype) in __qm_protos.items():
+            try:
+                func = getattr(lib, name)
+            except AttributeError:
+                continue
+            func.argtypes = argtypes
+            func.restype = restype
+            __qm_func[name] = __Bind(name, func)
+        __qm_lib = lib
 
 
 # ======================================================================
@@ -74,8 +509,35 @@ def __QMFree(s):
     This function releases memory returned by other functions.
     """
 
-    __LoadQMCliLib()
-    __qm_lib.QMFree(ct.c_void_p(s))
+    __qm_func['QMFree'](s)
+
+
+# ======================================================================
+# Account()
+# ======================================================================
+def Account():
+    """
+    The Account() function returns (account, serial) for the current
+    session, or None if it is not connected. account is the account the
+    session is logged in to; serial changes every time the session is
+    connected or logs to another account.
+
+    This is kept by this module; it does not call the server.
+    """
+
+    return __qm_accounts.get(__qm_func['QMGetSession']())
+
+
+# ======================================================================
+# BoundSession()
+# ======================================================================
+def BoundSession():
+    """
+    The BoundSession() function returns the session bound to the
+    calling thread under ThreadSessions(), or None if there is none.
+    """
+
+    return getattr(__qm_thread, 'session', None)
 
 
 # ======================================================================
@@ -113,18 +575,68 @@ def Call(subr, argct, arg1=None, arg2=None, arg3=None, arg4=None,
         GetArg(n)
     """
 
-    func = __qm_lib.QMCallxW
-    func.argtypes = [ct.c_wchar_p, ct.c_short,
-                     ct.c_wchar_p, ct.c_wchar_p, ct.c_wchar_p, ct.c_wchar_p,
-                     ct.c_wchar_p, ct.c_wchar_p, ct.c_wchar_p, ct.c_wchar_p,
-                     ct.c_wchar_p, ct.c_wchar_p, ct.c_wchar_p, ct.c_wchar_p,
-                     ct.c_wchar_p, ct.c_wchar_p, ct.c_wchar_p, ct.c_wchar_p,
-                     ct.c_wchar_p, ct.c_wchar_p, ct.c_wchar_p, ct.c_wchar_p]
+    func = __qm_func['QMCallxW']
     func(subr, argct, arg1, arg2, arg3, arg4, arg5, arg6, arg7, arg8, arg9,
          arg10, arg11, arg12, arg13, arg14, arg15, arg16, arg17, arg18, arg19,
          arg20)
 
 
+# ======================================================================
+# CacheRecords()
+# ======================================================================
+def CacheRecords(enabled=True, size=1000, ttl=30.0):
+    """
+    The CacheRecords() function turns the record cache on or off.
+
+    While it is on, Read() answers repeated reads of a record from
+    memory for up to ttl seconds, keeping the size most recently used
+    records. Write(), Writeu(), Delete(), Deleteu() and ClearFile() in
+    this process drop the records they change; changes made elsewhere
+    are seen once the cached copy expires.
+
+    Readu() and Readl() always go to the server, as the lock they take
+    is the reason for calling them, and refresh the cached copy.
+
+    Only files opened after the cache is turned on are cached. Turning
+    it on again empties it.
+
+    This is not part of the QMClient library.
+
+    See also: CacheStats()
+    """
+
+    global __qm_cache, __qm_cache_size, __qm_cache_ttl
+
+    with __qm_cache_lock:
+        __qm_cache_size = size
+        __qm_cache_ttl = ttl
+        __qm_cache_stats.update(hits=0, misses=0, evictions=0,
+                                invalidations=0)
+        __qm_cache = collections.OrderedDict() if enabled else None
+        if not enabled:
+            __qm_file_names.clear()
+
+
+# ======================================================================
+# CacheStats()
+# ======================================================================
+def CacheStats():
+    """
+    The CacheStats() function returns the record cache statistics as a
+    dict of hits, misses, evictions, invalidations, records (the number
+    cached now) and hit_rate.
+
+    This is not part of the QMClient library.
+    """
+
+    with __qm_cache_lock:
+        stats = dict(__qm_cache_stats)
+        stats['records'] = len(__qm_cache) if __qm_cache is not None else 0
+    reads = stats.get('hits', 0) + stats.get('misses', 0)
+    stats['hit_rate'] = stats.get('hits', 0) / reads if reads else 0.0
+    return stats
+
+
 # ======================================================================
 # QMChange()
 # ======================================================================
@@ -153,10 +665,7 @@ def Change(in_str, old, new, occ=0, start=1):
         X = qm.Change("ABRACADABRA", "A", "a", 3, 2)
     """
 
-    __LoadQMCliLib()
-    func = __qm_lib.QMChangeW
-    func.argtypes = [ct.c_wchar_p, ct.c_wchar_p, ct.c_wchar_p, ct.c_int, ct.c_int]
-    func.restype = ct.c_void_p
+    func = __qm_func['QMChangeW']
     s = func(in_str, old, new, occ, start)
     out_str = ct.wstring_at(s)
     __QMFree(s)
@@ -175,9 +684,7 @@ def Checksum(in_str):
     does not require a server connection to be open.
     """
 
-    __LoadQMCliLib()
-    func = __qm_lib.QMChecksumW
-    func.argtypes = [ct.c_wchar_p]
+    func = __qm_func['QMChecksumW']
     return func(in_str)
 
 
@@ -192,9 +699,10 @@ def ClearFile(fno):
     fno is the file number returned by a previous qm.Open call.
     """
 
-    func = __qm_lib.QMClearFile
-    func.argtypes = [ct.c_int]
+    func = __qm_func['QMClearFile']
     func(fno)
+    if __qm_cache is not None:
+        __CacheDrop(fno)
 
 
 # ======================================================================
@@ -210,8 +718,7 @@ def ClearSelect(listno):
     clear it to avoid unwanted effects on later server processing.
     """
 
-    func = __qm_lib.QMClearSelect
-    func.argtypes = [ct.c_int]
+    func = __qm_func['QMClearSelect']
     func(listno)
 
 
@@ -229,8 +736,9 @@ def Close(fno):
       qm.Close(fno)
     """
 
-    func = __qm_lib.QMClose
-    func.argtypes = [ct.c_int]
+    if __qm_cache is not None:
+        __qm_file_names.pop((__qm_func['QMGetSession'](), fno), None)
+    func = __qm_func['QMClose']
     func(fno)
 
 
@@ -253,10 +761,11 @@ def Connect(host, port, username, password, account):
         connect_result = 1 Connection successful
     """
 
-    __LoadQMCliLib()
-    func = __qm_lib.QMConnectW
-    func.argtypes = [ct.c_wchar_p, ct.c_int, ct.c_wchar_p, ct.c_wchar_p, ct.c_wchar_p]
-    return func(host, port, username, password, account)
+    func = __qm_func['QMConnectW']
+    result = func(host, port, username, password, account)
+    if result == 1:
+        __SetAccount(account)
+    return result
 
 
 # ======================================================================
@@ -271,8 +780,7 @@ def Connected():
         connected_result = 1 client session is open.
     """
 
-    __LoadQMCliLib()
-    return __qm_lib.QMConnected()
+    return __qm_func['QMConnected']()
 
 
 # ======================================================================
@@ -285,9 +793,7 @@ def ConnectionType(n):
     options to be enabled.
     """
 
-    __LoadQMCliLib()
-    func = __qm_lib.QMConnectionType
-    func.argtypes = [ct.c_int]
+    func = __qm_func['QMConnectionType']
     func(n)
 
 
@@ -300,10 +806,11 @@ def ConnectLocal(account):
     local system. The return value is 1 for success, 0 for failure.
     """
 
-    __LoadQMCliLib()
-    func = __qm_lib.QMConnectLocalW
-    func.argtypes = [ct.c_wchar_p]
-    return func(account)
+    func = __qm_func['QMConnectLocalW']
+    result = func(account)
+    if result == 1:
+        __SetAccount(account)
+    return result
 
 
 # ======================================================================
@@ -315,10 +822,11 @@ def ConnectPool(host, port, username, password, account, pool):
     that the QM process becomes part of a connection pool.
     """
 
-    __LoadQMCliLib()
-    func = __qm_lib.QMConnectPoolW
-    func.argtypes = [ct.c_wchar_p, ct.c_int, ct.c_wchar_p, ct.c_wchar_p, ct.c_wchar_p, ct.c_wchar_p]
-    return func(host, port, username, password, account, pool)
+    func = __qm_func['QMConnectPoolW']
+    result = func(host, port, username, password, account, pool)
+    if result == 1:
+        __SetAccount(account)
+    return result
 
 
 # ======================================================================
@@ -336,13 +844,7 @@ def CreateObject(subr, argct, arg1=None, arg2=None, arg3=None, arg4=None,
     the optional CREATE.OBJECT subroutine.
     """
 
-    func = __qm_lib.QMCreateObjectW
-    func.argtypes = [ct.c_wchar_p, ct.c_short,
-                     ct.c_wchar_p, ct.c_wchar_p, ct.c_wchar_p, ct.c_wchar_p,
-                     ct.c_wchar_p, ct.c_wchar_p, ct.c_wchar_p, ct.c_wchar_p,
-                     ct.c_wchar_p, ct.c_wchar_p, ct.c_wchar_p, ct.c_wchar_p,
-                     ct.c_wchar_p, ct.c_wchar_p, ct.c_wchar_p, ct.c_wchar_p,
-                     ct.c_wchar_p, ct.c_wchar_p, ct.c_wchar_p, ct.c_wchar_p]
+    func = __qm_func['QMCreateObjectW']
     objno = func(subr, argct, arg1, arg2, arg3, arg4, arg5, arg6, arg7, arg8, arg9,
                  arg10, arg11, arg12, arg13, arg14, arg15, arg16, arg17,
                  arg18, arg19, arg20)
@@ -370,9 +872,7 @@ def Dcount(s, delim):
     not require a server connection to be open.
     """
 
-    __LoadQMCliLib()
-    func = __qm_lib.QMDcountW
-    func.argtypes = [ct.c_wchar_p, ct.c_wchar_p]
+    func = __qm_func['QMDcountW']
     return func(s, delim)
 
 
@@ -406,10 +906,7 @@ def Del(in_str, f, v, sv):
         rec = qm.Del(rec, 2, 1, 0)
     """
 
-    __LoadQMCliLib()
-    func = __qm_lib.QMDelW
-    func.argtypes = [ct.c_wchar_p, ct.c_int, ct.c_int, ct.c_int]
-    func.restype = ct.c_void_p
+    func = __qm_func['QMDelW']
     s = func(in_str, f, v, sv)
     out_str = ct.wstring_at(s)
     __QMFree(s)
@@ -432,9 +929,10 @@ def Delete(fno, id):
     record before deleting it. The lock is released by this function.
     """
 
-    func = __qm_lib.QMDeleteW
-    func.argtypes = [ct.c_int, ct.c_wchar_p]
+    func = __qm_func['QMDeleteW']
     func(fno, id)
+    if __qm_cache is not None:
+        __CacheDrop(fno, id)
 
 
 # ======================================================================
@@ -453,9 +951,10 @@ def Deleteu(fno, id):
     before deleting it. The lock is not released by this function.
     """
 
-    func = __qm_lib.QMDeleteuW
-    func.argtypes = [ct.c_int, ct.c_wchar_p]
+    func = __qm_func['QMDeleteuW']
     func(fno, id)
+    if __qm_cache is not None:
+        __CacheDrop(fno, id)
 
 
 # ======================================================================
@@ -467,8 +966,7 @@ def DestroyObject(objno):
     instatiated with qm.CreateObject()
     """
 
-    func = __qm_lib.QMDestroyObject
-    func.argtypes = [ct.c_int]
+    func = __qm_func['QMDestroyObject']
     func(objno)
 
 
@@ -480,8 +978,8 @@ def Disconnect():
     The Disconnect() function disconnects the current QMClient session.
     """
 
-    __LoadQMCliLib()
-    __qm_lib.QMDisconnect()
+    __SetAccount(None)
+    __qm_func['QMDisconnect']()
 
 
 # ======================================================================
@@ -492,8 +990,8 @@ def DisconnectAll():
     The DisconnectAll() function disconnects all QMClient sessions.
     """
 
-    __LoadQMCliLib()
-    __qm_lib.QMDisconnectAll()
+    __qm_accounts.clear()
+    __qm_func['QMDisconnectAll']()
 
 
 # ======================================================================
@@ -503,41 +1001,62 @@ def DynArrayToList(dyn):
     """
     Converts attributes, multi-values, and sub-values
     to a Python list.
+
+    An attribute or multi-value holding a single item becomes a string,
+    anything else (including a null one) a list. The dynamic array is
+    split once on the client, so the cost is linear in its length.
+
+    See also: ListToDynArray()
     """
 
-    a_list = []
     AM = chr(254)
     VM = chr(253)
     SVM = chr(252)
 
-    nbr_attributes = Dcount(dyn, AM)
+    if dyn == '':
+        return []
 
-    for attr_count in range(1, nbr_attributes + 1):
-        attribute = Extract(dyn, attr_count, 0, 0)
-        nbr_multi_values = Dcount(attribute, VM)
-
-        if nbr_multi_values == 1:
+    a_list = []
+    for attribute in dyn.split(AM):
+        if attribute == '':
+            a_list.append([])
+        elif VM not in attribute:
             a_list.append(attribute)
         else:
             b_list = []
-            for mv_count in range(1, nbr_multi_values + 1):
-                multi_value = Extract(dyn, attr_count, mv_count, 0)
-                nbr_sub_values = Dcount(multi_value, SVM)
-
-                if nbr_sub_values == 1:
+            for multi_value in attribute.split(VM):
+                if multi_value == '':
+                    b_list.append([])
+                elif SVM not in multi_value:
                     b_list.append(multi_value)
                 else:
-                    c_list = []
-                    for sub_value_count in range(1, nbr_sub_values + 1):
-                        sub_value = Extract(dyn, attr_count, mv_count, sub_value_count)
-                        c_list.append(sub_value)
-                    b_list.append(c_list)
-
+                    b_list.append(multi_value.split(SVM))
             a_list.append(b_list)
 
     return a_list
 
 
+# ======================================================================
+# ListToDynArray()
+# ======================================================================
+def ListToDynArray(a_list):
+    """
+    Converts a Python list, as returned by DynArrayToList(), back into
+    a dynamic array. Nested lists become multi-values and sub-values.
+    """
+
+    AM = chr(254)
+    VM = chr(253)
+    SVM = chr(252)
+
+    return AM.join(
+        attribute if isinstance(attribute, str) else VM.join(
+            multi_value if isinstance(multi_value, str)
+            else SVM.join(multi_value)
+            for multi_value in attribute)
+        for attribute in a_list)
+
+
 # ======================================================================
 # QMEndCommand()
 # ======================================================================
@@ -548,7 +1067,7 @@ def EndCommand():
     is asking for data input.
     """
 
-    __qm_lib.QMEndCommand
+    __qm_func['QMEndCommand']()
 
 
 # ======================================================================
@@ -560,8 +1079,7 @@ def EnterPackage(name):
     software package.
     """
 
-    func = __qm_lib.QMEnterPackageW
-    func.argtypes = [ct.c_wchar_p]
+    func = __qm_func['QMEnterPackageW']
     return func(name)
 
 
@@ -577,8 +1095,7 @@ def Error():
     The qm.Error function can be used to retrieve this text.
     """
 
-    func = __qm_lib.QMErrorW
-    func.restype = ct.c_void_p
+    func = __qm_func['QMErrorW']
     s = func()
     return ct.wstring_at(s)
 
@@ -601,9 +1118,7 @@ def EvalConv(fno, name, data, id):
     id    is the record id to be used in evaluating the item.
     """
 
-    func = __qm_lib.QMEvalConvW
-    func.argtypes = [ct.c_int, ct.c_wchar_p, ct.c_wchar_p, ct.c_wchar_p]
-    func.restype = ct.c_void_p
+    func = __qm_func['QMEvalConvW']
     s = func(fno, name, data, id)
     out_str = ct.wstring_at(s)
     __QMFree(s)
@@ -628,9 +1143,7 @@ def Evaluate(fno, name, data, id):
     id    is the record id to be used in evaluating the item.
     """
 
-    func = __qm_lib.QMEvaluateW
-    func.argtypes = [ct.c_int, ct.c_wchar_p, ct.c_wchar_p, ct.c_wchar_p]
-    func.restype = ct.c_void_p
+    func = __qm_func['QMEvaluateW']
     s = func(fno, name, data, id)
     out_str = ct.wstring_at(s)
     __QMFree(s)
@@ -655,9 +1168,7 @@ def Execute(command):
                 SV_PROMPT (5)  if the command is waiting for data input
     """
 
-    func = __qm_lib.QMExecuteW
-    func.argtypes = [ct.c_wchar_p, ct.c_void_p]
-    func.restype = ct.c_void_p
+    func = __qm_func['QMExecuteW']
     err = ct.c_int()
     s = func(command, ct.byref(err))
     out_str = ct.wstring_at(s)
@@ -673,8 +1184,7 @@ def ExitPackage(name):
     The ExitPackage() function exits from a licensed software package.
     """
 
-    func = __qm_lib.QMExitPackageW
-    func.argtypes = [ct.c_wchar_p]
+    func = __qm_func['QMExitPackageW']
     func(name)
 
 
@@ -704,10 +1214,7 @@ def Extract(in_str, f, v, sv):
            If less than 1, the entire value is extracted.
     """
 
-    __LoadQMCliLib()
-    func = __qm_lib.QMExtractW
-    func.argtypes = [ct.c_wchar_p, ct.c_int, ct.c_int, ct.c_int]
-    func.restype = ct.c_void_p
+    func = __qm_func['QMExtractW']
     s = func(in_str, f, v, sv)
     out_str = ct.wstring_at(s)
     __QMFree(s)
@@ -744,10 +1251,7 @@ def Field(in_str, delim, occurrence, count):
         to variable S.
     """
 
-    __LoadQMCliLib()
-    func = __qm_lib.QMFieldW
-    func.argtypes = [ct.c_wchar_p, ct.c_wchar_p, ct.c_int, ct.c_int]
-    func.restype = ct.c_void_p
+    func = __qm_func['QMFieldW']
     s = func(in_str, delim, occurrence, count)
     out_str = ct.wstring_at(s)
     __QMFree(s)
@@ -772,14 +1276,7 @@ def Get(objno, name, argct, arg1=None, arg2=None, arg3=None, arg4=None,
     argct  is the count of arguments (max 20).
     """
 
-    func = __qm_lib.QMGetW
-    func.argtypes = [ct.c_short, ct.c_wchar_p, ct.c_short,
-                     ct.c_wchar_p, ct.c_wchar_p, ct.c_wchar_p, ct.c_wchar_p,
-                     ct.c_wchar_p, ct.c_wchar_p, ct.c_wchar_p, ct.c_wchar_p,
-                     ct.c_wchar_p, ct.c_wchar_p, ct.c_wchar_p, ct.c_wchar_p,
-                     ct.c_wchar_p, ct.c_wchar_p, ct.c_wchar_p, ct.c_wchar_p,
-                     ct.c_wchar_p, ct.c_wchar_p, ct.c_wchar_p, ct.c_wchar_p]
-    func.restype = ct.c_void_p
+    func = __qm_func['QMGetW']
     s = func(objno, name, argct, arg1, arg2, arg3, arg4, arg5, arg6, arg7,
              arg8, arg9, arg10, arg11, arg12, arg13, arg14, arg15, arg16,
              arg17, arg18, arg19, arg20)
@@ -805,9 +1302,7 @@ def GetArg(n):
     any of the functions named above.
     """
 
-    func = __qm_lib.QMGetArgW
-    func.argtypes = [ct.c_short]
-    func.restype = ct.c_void_p
+    func = __qm_func['QMGetArgW']
     s = func(n)
     if s is None: return ""
     out_str = ct.wstring_at(s)
@@ -826,8 +1321,7 @@ def GetSession():
     See also: SetSession()
     """
 
-    __LoadQMCliLib
-    func = __qm_lib.QMGetSession
+    func = __qm_func['QMGetSession']
     return func()
 
 
@@ -843,9 +1337,7 @@ def GetVar(name):
         SelectedCount = QMGetVar('@SELECTED')
     """
 
-    func = __qm_lib.QMGetVarW
-    func.argtypes = [ct.c_wchar_p]
-    func.restype = ct.c_void_p
+    func = __qm_func['QMGetVarW']
     s = func(name)
     out_str = ct.wstring_at(s)
     __QMFree(s)
@@ -865,9 +1357,7 @@ def IConv(in_str, code):
     on the server system.
     """
 
-    func = __qm_lib.QMIConvW
-    func.argtypes = [ct.c_wchar_p, ct.c_wchar_p]
-    func.restype = ct.c_void_p
+    func = __qm_func['QMIConvW']
     s = func(in_str, code)
     out_str = ct.wstring_at(s)
     __QMFree(s)
@@ -888,9 +1378,7 @@ def IConvs(in_str, code):
     on the server system.
     """
 
-    func = __qm_lib.QMIConvsW
-    func.argtypes = [ct.c_wchar_p, ct.c_wchar_p]
-    func.restype = ct.c_void_p
+    func = __qm_func['QMIConvsW']
     s = func(in_str, code)
     out_str = ct.wstring_at(s)
     __QMFree(s)
@@ -913,9 +1401,7 @@ def Indices(fno, name):
     details of that index are returned.
     """
 
-    func = __qm_lib.QMIndicesW
-    func.argtypes = [ct.c_int, ct.c_wchar_p]
-    func.restype = ct.c_void_p
+    func = __qm_func['QMIndicesW']
     s = func(fno, name)
     out_str = ct.wstring_at(s)
     __QMFree(s)
@@ -931,16 +1417,42 @@ def Ins(in_str, f, v, sv, new_data):
     the modified dynamic array as its result.
     """
 
-    __LoadQMCliLib()
-    func = __qm_lib.QMInsW
-    func.argtypes = [ct.c_wchar_p, ct.c_int, ct.c_int, ct.c_int, ct.c_wchar_p]
-    func.restype = ct.c_void_p
+    func = __qm_func['QMInsW']
     s = func(in_str, f, v, sv, new_data)
     out_str = ct.wstring_at(s)
     __QMFree(s)
     return out_str
 
 
+# ======================================================================
+# Instrument()
+# ======================================================================
+def Instrument(enabled=True, samples=1000):
+    """
+    The Instrument() function turns call statistics on or off. While
+    they are on, every library call records its latency and the number
+    of characters sent and received, both by function and by file
+    number. samples is the number of recent latencies kept for the
+    percentiles of each function and file.
+
+    Turning statistics on again starts them from zero.
+
+    This is not part of the QMClient library.
+
+    See also: Stats()
+    """
+
+    global __qm_stats, __qm_samples
+
+    with __qm_lock:
+        __qm_samples = samples
+        if enabled:
+            __qm_stats = {'functions': {}, 'files': {}, 'names': {}}
+        else:
+            __qm_stats = None
+        __Rebind()
+
+
 # ======================================================================
 # QMIsECS()
 # ======================================================================
@@ -950,7 +1462,7 @@ def IsECS():
     mode, 0 if it is not.
     """
 
-    func = __qm_lib.QMIsECS
+    func = __qm_func['QMIsECS']
     return func()
 
 
@@ -970,11 +1482,7 @@ def Locate(item, dyn, f, v, sv, order):
     found, pos = qm.Locate(item, dyn, f, v, s, "")
     """
 
-    __LoadQMCliLib()
-    func = __qm_lib.QMLocateW
-    func.argtypes = [ct.c_wchar_p, ct.c_wchar_p, ct.c_int, ct.c_int, ct.c_int,
-                     ct.c_void_p, ct.c_wchar_p]
-    func.restype = ct.c_int
+    func = __qm_func['QMLocateW']
     pos = ct.c_int()
     found = func(item, dyn, f, v, sv, ct.byref(pos), order)
     return found, pos.value
@@ -991,10 +1499,11 @@ def Logto(account):
     The function returns 1 if successful, 0 otherwise.
     """
 
-    func = __qm_lib.QMLogtoW
-    func.argtypes = [ct.c_wchar_p]
-    func.restype = ct.c_int
-    return func(account)
+    func = __qm_func['QMLogtoW']
+    result = func(account)
+    if result == 1:
+        __SetAccount(account)
+    return result
 
 
 # ======================================================================
@@ -1007,8 +1516,7 @@ def MarkMapping(fno, state):
     marks (or the inverse translation on write).
     """
 
-    func = __qm_lib.QMMarkMapping
-    func.argtypes = [ct.c_int, ct.c_int]
+    func = __qm_func['QMMarkMapping']
     func(fno, state)
 
 
@@ -1020,9 +1528,7 @@ def Match(in_str, pattern):
     The Match() function matches a string against a pattern, returning 1
     if it matches, 0 if it does not.
     """
-    __LoadQMCliLib()
-    func = __qm_lib.QMMatchW
-    func.argtypes = [ct.c_wchar_p, ct.c_wchar_p]
+    func = __qm_func['QMMatchW']
     return func(in_str, pattern)
 
 
@@ -1035,10 +1541,7 @@ def Matchfield(in_str, pattern, component):
     the portion of the string that matches a specified pattern element.
     """
 
-    __LoadQMCliLib()
-    func = __qm_lib.QMMatchfieldW
-    func.argtypes = [ct.c_wchar_p, ct.c_wchar_p, ct.c_int]
-    func.restype = ct.c_void_p
+    func = __qm_func['QMMatchfieldW']
     s = func(in_str, pattern, component)
     out_str = ct.wstring_at(s)
     __QMFree(s)
@@ -1054,9 +1557,7 @@ def NextPartial(listno):
     created using SelectPartial().
     """
 
-    func = __qm_lib.QMNextPartialW
-    func.argtypes = [ct.c_wchar_p]
-    func.restype = ct.c_void_p
+    func = __qm_func['QMNextPartialW']
     s = func(listno)
     out_str = ct.wstring_at(s)
     __QMFree(s)
@@ -1076,9 +1577,7 @@ def OConv(in_str, code):
     on the server system.
     """
 
-    func = __qm_lib.QMOConvW
-    func.argtypes = [ct.c_wchar_p, ct.c_wchar_p]
-    func.restype = ct.c_void_p
+    func = __qm_func['QMOConvW']
     s = func(in_str, code)
     out_str = ct.wstring_at(s)
     __QMFree(s)
@@ -1099,9 +1598,7 @@ def OConvs(in_str, code):
     on the server system.
     """
 
-    func = __qm_lib.QMOConvsW
-    func.argtypes = [ct.c_wchar_p, ct.c_wchar_p]
-    func.restype = ct.c_void_p
+    func = __qm_func['QMOConvsW']
     s = func(in_str, code)
     out_str = ct.wstring_at(s)
     __QMFree(s)
@@ -1122,9 +1619,11 @@ def Open(filename):
         file_number = qm.Open(file_name)
     """
 
-    func = __qm_lib.QMOpenW
-    func.argtypes = [ct.c_wchar_p]
-    return func(filename)
+    func = __qm_func['QMOpenW']
+    fno = func(filename)
+    if __qm_cache is not None and fno:
+        __qm_file_names[__qm_func['QMGetSession'](), fno] = filename
+    return fno
 
 
 # ======================================================================
@@ -1139,8 +1638,7 @@ def OpenSeq(filename, id, modes):
     file operations.
     """
 
-    func = __qm_lib.QMOpenSeqW
-    func.argtypes = [ct.c_wchar_p, ct.c_wchar_p, ct.c_int]
+    func = __qm_func['QMOpenSeqW']
     return func(filename, id, modes)
 
 
@@ -1154,7 +1652,8 @@ def PoolIdle():
     ConnectPool() with the same details will re-awaken the process.
     """
 
-    __qm_lib.QMPoolIdle()
+    __SetAccount(None)
+    __qm_func['QMPoolIdle']()
 
 
 # ======================================================================
@@ -1176,13 +1675,22 @@ def Read(fno, id):
             be used to find further details of the error.
     """
 
-    func = __qm_lib.QMReadW
-    func.argtypes = [ct.c_int, ct.c_wchar_p, ct.c_void_p]
-    func.restype = ct.c_void_p
+    key = None
+    if __qm_cache is not None:
+        key = __CacheReadKey(fno, id)
+        if key is not None:
+            rec = __CacheGet(key)
+            if rec is not None:
+                return rec, 0
+            gen = __CacheGen(key)
+
+    func = __qm_func['QMReadW']
     err = ct.c_int()
     s = func(fno, id, ct.byref(err))
     rec = ct.wstring_at(s)
     __QMFree(s)
+    if key is not None and err.value == 0:
+        __CachePut(key, rec, gen)
     return rec, err.value
 
 
@@ -1202,9 +1710,7 @@ def ReadBlk(fno, len):
             be used to find further details of the error.
     """
 
-    func = __qm_lib.QMReadBlkW
-    func.argtypes = [ct.c_int, ct.c_int]
-    func.restype = ct.c_void_p
+    func = __qm_func['QMReadBlkW']
     err = ct.c_int()
     s = func(fno, len, ct.byref(err))
     rec = ct.wstring_at(s)
@@ -1231,14 +1737,20 @@ def Readl(fno, id, wait):
             be used to find further details of the error.
     """
 
-    func = __qm_lib.QMReadlW
-    func.argtypes = [ct.c_int, ct.c_wchar_p, ct.c_int, ct.c_void_p]
-    func.restype = ct.c_void_p
+    key = None
+    if __qm_cache is not None:
+        key = __CacheReadKey(fno, id)
+        if key is not None:
+            gen = __CacheGen(key)
+
+    func = __qm_func['QMReadlW']
     err = ct.c_int()
     s = func(fno, id, wait, ct.byref(err))
     rec = ct.wstring_at(s)
     __QMFree(s)
-    return rec, err
+    if key is not None and err.value == 0:
+        __CachePut(key, rec, gen)
+    return rec, err.value
 
 
 # ======================================================================
@@ -1255,9 +1767,7 @@ def ReadList(listno):
     list is empty.
     """
 
-    func = __qm_lib.QMReadListW
-    func.argtypes = [ct.c_int]
-    func.restype = ct.c_void_p
+    func = __qm_func['QMReadListW']
     s = func(listno)
     if s is None: return ""
     rec = ct.wstring_at(s)
@@ -1275,9 +1785,7 @@ def ReadNext(listno):
     string is returned when the list is exhausted.
     """
 
-    func = __qm_lib.QMReadNextW
-    func.argtypes = [ct.c_int]
-    func.restype = ct.c_void_p
+    func = __qm_func['QMReadNextW']
     s = func(listno)
     if s is None: return ""
     rec = ct.wstring_at(s)
@@ -1301,9 +1809,7 @@ def ReadSeq(fno):
             be used to find further details of the error.
     """
 
-    func = __qm_lib.QMReadSeqW
-    func.argtypes = [ct.c_int, ct.c_void_p]
-    func.restype = ct.c_void_p
+    func = __qm_func['QMReadSeqW']
     err = ct.c_int()
     s = func(fno, ct.byref(err))
     rec = ct.wstring_at(s)
@@ -1330,13 +1836,19 @@ def Readu(fno, id, wait):
             be used to find further details of the error.
     """
 
-    func = __qm_lib.QMReaduW
-    func.argtypes = [ct.c_int, ct.c_wchar_p, ct.c_int, ct.c_void_p]
-    func.restype = ct.c_void_p
+    key = None
+    if __qm_cache is not None:
+        key = __CacheReadKey(fno, id)
+        if key is not None:
+            gen = __CacheGen(key)
+
+    func = __qm_func['QMReaduW']
     err = ct.c_int()
     s = func(fno, id, wait, ct.byref(err))
     rec = ct.wstring_at(s)
     __QMFree(s)
+    if key is not None and err.value == 0:
+        __CachePut(key, rec, gen)
     return rec, err.value
 
 # ======================================================================
@@ -1362,8 +1874,7 @@ def Recordlock(fno, id, update, wait):
                0 i.e False  Return an error code of SV_LOCKED
     """
 
-    func = __qm_lib.QMRecordlockW
-    func.argtypes = [ct.c_int, ct.c_wchar_p, ct.c_int, ct.c_int]
+    func = __qm_func['QMRecordlockW']
     func(fno, id, update, wait)
 
 
@@ -1389,8 +1900,7 @@ def Recordlocked(fno, id):
          3     This user holds a file lock
     """
 
-    func = __qm_lib.QMRecordlockedW
-    func.argtypes = [ct.c_int, ct.c_wchar_p]
+    func = __qm_func['QMRecordlockedW']
     return func(fno, id)
 
 
@@ -1410,8 +1920,7 @@ def Release(fno, id):
          by fno are released.
     """
 
-    func = __qm_lib.QMReleaseW
-    func.argtypes = [ct.c_int, ct.c_wchar_p]
+    func = __qm_func['QMReleaseW']
     func(fno, id)
 
 
@@ -1460,10 +1969,7 @@ def Replace(in_str, f, v, sv, new_data):
         data = qm.Replace(data, 5, 0, 0, state)
     """
 
-    __LoadQMCliLib()
-    func = __qm_lib.QMReplaceW
-    func.argtypes = [ct.c_wchar_p, ct.c_int, ct.c_int, ct.c_int, ct.c_wchar_p]
-    func.restype = ct.c_void_p
+    func = __qm_func['QMReplaceW']
     s = func(in_str, f, v, sv, new_data)
     out_str = ct.wstring_at(s)
     __QMFree(s)
@@ -1489,9 +1995,7 @@ def Respond(response):
                                data input
     """
 
-    func = __qm_lib.QMRespondW
-    func.argtypes = [ct.c_wchar_p]
-    func.restype = ct.c_void_p
+    func = __qm_func['QMRespondW']
     err = ct.c_int()
     s = func(response, ct.byref(err))
     out_str = ct.wstring_at(s)
@@ -1512,8 +2016,7 @@ def Revision():
     and the second field is the server revision.
     """
 
-    func = __qm_lib.QMRevisionW
-    func.restype = ct.c_void_p
+    func = __qm_func['QMRevisionW']
     s = func()
     out_str = ct.wstring_at(s)
     __QMFree(s)
@@ -1529,9 +2032,7 @@ def RTrans(listno):
     fetching data from a specified file.
     """
 
-    func = __qm_lib.QMRTransW
-    func.argtypes = [ct.c_wchar_p, ct.c_wchar_p, ct.c_wchar_p, ct.c_wchar_p]
-    func.restype = ct.c_void_p
+    func = __qm_func['QMRTransW']
     s = func(listno)
     if s is None: return ""
     rec = ct.wstring_at(s)
@@ -1557,8 +2058,7 @@ def Seek(fno, offset, relto):
             2 = end of file
     """
 
-    func = __qm_lib.QMSeek
-    func.argtypes = [ct.c_int, ct.c_int, ct.c_int]
+    func = __qm_func['QMSeek']
     func(fno, offset, relto)
 
 
@@ -1572,8 +2072,7 @@ def Select(fno, listno):
     QMBasic SELECT statement.
     """
 
-    func = __qm_lib.QMSelect
-    func.argtypes = [ct.c_int, ct.c_int]
+    func = __qm_func['QMSelect']
     func(fno, listno)
 
 
@@ -1587,8 +2086,7 @@ def SelectIndex(fno, index, value, listno):
     SELECTINDEX statement.
     """
 
-    func = __qm_lib.QMSelectIndexW
-    func.argtypes = [ct.c_int, ct.c_wchar_p, ct.c_wchar_p, ct.c_int]
+    func = __qm_func['QMSelectIndexW']
     func(fno, index, value, listno)
 
 
@@ -1602,8 +2100,7 @@ def SelectLeft(fno, index, listno):
     indexed value and returns the indexed value as its result.
     """
 
-    func = __qm_lib.QMSelectLeftW
-    func.argtypes = [ct.c_int, ct.c_wchar_p, ct.c_int]
+    func = __qm_func['QMSelectLeftW']
     s = func(fno, index, listno)
     out_str = ct.wstring_at(s)
     __QMFree(s)
@@ -1621,8 +2118,7 @@ def SelectPartial(fno, listno):
     of record keys.
     """
 
-    func = __qm_lib.QMSelectPartialW
-    func.argtypes = [ct.c_int, ct.c_int]
+    func = __qm_func['QMSelectPartialW']
     s = func(fno, listno)
     out_str = ct.wstring_at(s)
     __QMFree(s)
@@ -1639,8 +2135,7 @@ def SelectRight(fno, index, listno):
     indexed value and returns the indexed value as its result.
     """
 
-    func = __qm_lib.QMSelectRightW
-    func.argtypes = [ct.c_int, ct.c_wchar_p, ct.c_int]
+    func = __qm_func['QMSelectRightW']
     s = func(fno, index, listno)
     out_str = ct.wstring_at(s)
     __QMFree(s)
@@ -1665,13 +2160,7 @@ def Set(objno, name, argct, arg1=None, arg2=None, arg3=None, arg4=None,
     argct  is the count of arguments (max 20).
     """
 
-    func = __qm_lib.QMSetW
-    func.argtypes = [ct.c_short, ct.c_wchar_p, ct.c_short,
-                     ct.c_wchar_p, ct.c_wchar_p, ct.c_wchar_p, ct.c_wchar_p,
-                     ct.c_wchar_p, ct.c_wchar_p, ct.c_wchar_p, ct.c_wchar_p,
-                     ct.c_wchar_p, ct.c_wchar_p, ct.c_wchar_p, ct.c_wchar_p,
-                     ct.c_wchar_p, ct.c_wchar_p, ct.c_wchar_p, ct.c_wchar_p,
-                     ct.c_wchar_p, ct.c_wchar_p, ct.c_wchar_p, ct.c_wchar_p]
+    func = __qm_func['QMSetW']
     func(objno, name, argct, arg1, arg2, arg3, arg4, arg5, arg6, arg7,
          arg8, arg9, arg10, arg11, arg12, arg13, arg14, arg15, arg16,
          arg17, arg18, arg19, arg20)
@@ -1686,8 +2175,7 @@ def SetLeft(fno, index):
     key index to be at the leftmost record.
     """
 
-    func = __qm_lib.QMSetLeftW
-    func.argtypes = [ct.c_int, ct.c_wchar_p]
+    func = __qm_func['QMSetLeftW']
     func(fno, index)
 
 
@@ -1700,8 +2188,7 @@ def SetRight(fno, index):
     key index to be after the rightmost record.
     """
 
-    func = __qm_lib.QMSetRightW
-    func.argtypes = [ct.c_int, ct.c_wchar_p]
+    func = __qm_func['QMSetRightW']
     func(fno, index)
 
 
@@ -1716,12 +2203,58 @@ def SetSession(session):
     See also: qm.GetSession()
     """
 
-    __LoadQMCliLib
-    func = __qm_lib.QMSetSession
-    func.argtypes = [ct.c_int]
+    func = __qm_func['QMSetSession']
     return func(session)
 
 
+# ======================================================================
+# Stats()
+# ======================================================================
+def Stats(reset=False):
+    """
+    The Stats() function returns the call statistics collected since
+    Instrument() was called, or since the last reset, as a dict:
+
+        {'functions': {'Read': {...}, 'Write': {...}, ...},
+         'files': {fno: {..., 'name': 'INVOICE'}, ...}}
+
+    Each entry holds count, seconds (the total), mean, p50, p95, p99
+    and max latency in seconds, and sent and received, the characters
+    passed to and returned from the library. Files are named if they
+    were opened while statistics were on.
+
+    If reset is true the statistics start again from zero.
+
+    This is not part of the QMClient library.
+    """
+
+    def summary(entry):
+        count, seconds, sent, received, samples = entry
+        samples = sorted(samples)
+
+        def percentile(p):
+            return samples[min(len(samples) - 1, int(p * len(samples)))]
+
+        return {'count': count, 'seconds': seconds, 'mean': seconds / count,
+                'p50': percentile(0.50), 'p95': percentile(0.95),
+                'p99': percentile(0.99), 'max': samples[-1],
+                'sent': sent, 'received': received}
+
+    stats = __qm_stats
+    if stats is None:
+        return {'functions': {}, 'files': {}}
+    with __qm_stats_lock:
+        functions = {name: summary(entry)
+                     for name, entry in stats['functions'].items()}
+        files = {fno: summary(entry) for fno, entry in stats['files'].items()}
+        for fno, entry in files.items():
+            entry['name'] = stats['names'].get(fno, '')
+        if reset:
+            stats['functions'].clear()
+            stats['files'].clear()
+    return {'functions': functions, 'files': files}
+
+
 # ======================================================================
 # QMStatus()
 # ======================================================================
@@ -1731,7 +2264,7 @@ def Status():
     function for the last server function executed.
     """
 
-    return __qm_lib.QMStatus()
+    return __qm_func['QMStatus']()
 
 
 # ======================================================================
@@ -1744,9 +2277,7 @@ def System(key):
     to the QMBasic SYSTEM() function.
     """
 
-    func = __qm_lib.QMSystemW
-    func.argtypes = [ct.c_int]
-    func.restype = ct.c_void_p
+    func = __qm_func['QMSystemW']
     s = func(key)
     if s is None: return ""
     rec = ct.wstring_at(s)
@@ -1754,6 +2285,32 @@ def System(key):
     return rec
 
 
+# ======================================================================
+# ThreadSessions()
+# ======================================================================
+def ThreadSessions():
+    """
+    The ThreadSessions() function makes the current session a property
+    of each thread rather than of the process.
+
+    After it has been called, SetSession() and the Connect functions
+    bind the session to the calling thread and GetSession() returns
+    the calling thread's session. Library calls are serialized and each
+    one runs with the calling thread's session selected, so threads may
+    share the module safely as long as each uses its own session.
+
+    See also: UnbindSession()
+    """
+
+    global __qm_threaded
+
+    with __qm_lock:
+        if __qm_threaded:
+            return
+        __qm_threaded = True
+        __Rebind()
+
+
 # ======================================================================
 # QMTrans()
 # ======================================================================
@@ -1763,9 +2320,7 @@ def Trans(listno):
     fetching data from a specified file.
     """
 
-    func = __qm_lib.QMTransW
-    func.argtypes = [ct.c_wchar_p, ct.c_wchar_p, ct.c_wchar_p, ct.c_wchar_p]
-    func.restype = ct.c_void_p
+    func = __qm_func['QMTransW']
     s = func(listno)
     if s is None: return ""
     rec = ct.wstring_at(s)
@@ -1782,9 +2337,7 @@ def TrapCallAbort(mode):
     trapping of aborts in actions performed on the server.
     """
 
-    __LoadQMCliLib
-    func = __qm_lib.QMTrapCallAbort
-    func.argtypes = [ct.c_int]
+    func = __qm_func['QMTrapCallAbort']
     func(mode)
 
 
@@ -1799,11 +2352,28 @@ def Txn(mode):
       2   Commit a durable transaction
       3   Abort a transaction
       4   Commit a non-durable transaction
+
+    Reads made while a transaction is open bypass the record cache.
     """
 
-    func = __qm_lib.QMTxn
-    func.argtypes = [ct.c_int]
+    func = __qm_func['QMTxn']
     func(mode)
+    if mode == 1:
+        __qm_txn.setdefault(__qm_func['QMGetSession'](), [])
+    elif mode in (2, 3, 4):
+        __CacheTxnEnd()
+
+
+# ======================================================================
+# UnbindSession()
+# ======================================================================
+def UnbindSession():
+    """
+    The UnbindSession() function releases the calling thread's session
+    binding made under ThreadSessions(). The session stays open.
+    """
+
+    __qm_thread.session = None
 
 
 # ======================================================================
@@ -1815,8 +2385,7 @@ def WeofSeq(fno):
     current position.
     """
 
-    func = __qm_lib.QMWeofSeq
-    func.argtypes = [ct.c_int]
+    func = __qm_func['QMWeofSeq']
     func(fno)
 
 
@@ -1857,9 +2426,10 @@ def Write(fno, id, data):
         qm.Write(file_number, id, data)
     """
 
-    func = __qm_lib.QMWriteW
-    func.argtypes = [ct.c_int, ct.c_wchar_p, ct.c_wchar_p]
+    func = __qm_func['QMWriteW']
     func(fno, id, data)
+    if __qm_cache is not None:
+        __CacheDrop(fno, id)
 
 
 # ======================================================================
@@ -1871,8 +2441,7 @@ def WriteBlk(fno, data, len):
     opened for sequential processing.
     """
 
-    func = __qm_lib.QMWriteBlk
-    func.argtypes = [ct.c_int, ct.c_wchar_p, ct.c_int]
+    func = __qm_func['QMWriteBlk']
     func(fno, data, len)
 
 
@@ -1885,8 +2454,7 @@ def WriteSeq(fno, data):
     for sequential processing.
     """
 
-    func = __qm_lib.QMWriteSeq
-    func.argtypes = [ct.c_int, ct.c_wchar_p]
+    func = __qm_func['QMWriteSeq']
     func(fno, data)
 
 
@@ -1909,8 +2477,7 @@ def WriteSeqKey(fno, data):
     The function returns the record id generated for this write.
     """
 
-    func = __qm_lib.QMWriteSeqKey
-    func.argtypes = [ct.c_int, ct.c_wchar_p]
+    func = __qm_func['QMWriteSeqKey']
     s = func(fno, data)
     out_str = ct.wstring_at(s)
     __QMFree(s)
@@ -1954,9 +2521,10 @@ def Writeu(fno, id, data):
         qm.Writeu(file_number, id, data)
     """
 
-    func = __qm_lib.QMWriteuW
-    func.argtypes = [ct.c_int, ct.c_wchar_p, ct.c_wchar_p]
+    func = __qm_func['QMWriteuW']
     func(fno, id, data)
+    if __qm_cache is not None:
+        __CacheDrop(fno, id)
 
 
 if __name__ == '__main__':
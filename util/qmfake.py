@@ -0,0 +1,513 @@
+"""
+In-process fake of the QMClient library.
+
+When the QMFAKE environment variable is set, qmclient loads this module
+in place of qmclilib, so anything built on qmclient runs without a QM
+installation. The entry points have the names and arguments of the
+library functions; strings are returned as allocated wide character
+buffers that QMFree releases, as the library does.
+
+The fake server holds its files in memory, one dict of id -> record per
+file, shared by every session in the process. Opening a file that does
+not exist creates it empty. Nothing is kept when the process ends, and
+worker processes (e.g. aqm with processes=True) each have their own
+files.
+
+Each call that would go to the server sleeps for $QMFAKE_LATENCY
+microseconds (default 0), to stand in for the network round trip.
+
+Supported: connecting and sessions, Logto, Open/Close/ClearFile,
+Read/Readu/Readl, Write/Writeu, Delete/Deleteu, Release, Select,
+SelectPartial/NextPartial, ReadNext/ReadList/ClearSelect, alternate
+key indices made with create_index() (Indices, SelectIndex, SetLeft,
+SetRight, SelectLeft, SelectRight), Txn, Status,
+Error, IConv/OConv for the codes evaluated by the conv module, Checksum
+and the client side dynamic array functions. Locks are granted but not
+enforced.
+
+Example:
+    QMFAKE=1 QMFAKE_LATENCY=500 python export.py
+"""
+import bisect
+import collections
+import ctypes as ct
+import math
+import os
+import time
+import zlib
+
+import conv
+import mvsupport as mvs
+
+# Ids returned by each SelectPartial/NextPartial call
+PARTIAL_SIZE = 500
+
+latency = int(os.getenv('QMFAKE_LATENCY', '0')) / 1e6
+
+# account -> file name -> {id: record}
+accounts = {}
+
+# account -> file name -> {index name: attribute number}
+indices = {}
+
+# Buffers handed out and not yet released by QMFree, by address
+_buffers = {}
+_no_error = ct.create_unicode_buffer('')
+
+_sessions = []
+_current = None
+
+
+class Session(object):
+    """The server side state of one connection"""
+
+    def __init__(self, account):
+        self.account = account
+        self.files = {}
+        self.lists = {}
+        self.partial = {}
+        self.scans = {}
+        self.txn = None
+        self.status = 0
+        self.error = ct.create_unicode_buffer('')
+
+    def set_error(self, status, text=''):
+        self.status = status
+        self.error = ct.create_unicode_buffer(text)
+
+
+def _string(s):
+    """Returns s as a buffer address for the caller to QMFree"""
+    buf = ct.create_unicode_buffer(s)
+    addr = ct.addressof(buf)
+    _buffers[addr] = buf
+    return addr
+
+
+def _round_trip():
+    if latency:
+        time.sleep(latency)
+    if _current is None:
+        raise Exception("Not connected to server")
+    return _current
+
+
+def _file(session, fno):
+    return session.files[fno][1]
+
+
+def _records(session, fno):
+    """Records of file fno as the session sees them, pending writes too"""
+    records = _file(session, fno)
+    if not session.txn:
+        return records
+    view = dict(records)
+    for (txn_fno, id), rec in session.txn.items():
+        if txn_fno == fno:
+            if rec is None:
+                view.pop(id, None)
+            else:
+                view[id] = rec
+    return view
+
+
+def _lookup(session, fno, id):
+    if session.txn and (fno, id) in session.txn:
+        return session.txn[fno, id]
+    return _file(session, fno).get(id)
+
+
+def QMFree(addr):
+    _buffers.pop(addr, None)
+
+
+def create_index(file_name, index_name, attr, account='QMUSERS'):
+    """
+    Defines an alternate key index on attribute attr of a file. Each
+    value of the attribute is indexed; null values are not. Keys that
+    are all numbers sort in numeric order.
+
+    With attr a list of attribute numbers the index is compound, keyed
+    on mvsupport.compound_key of their first values.
+    """
+    files = indices.setdefault(account, {})
+    files.setdefault(file_name, {})[index_name] = attr
+
+
+# ======================================================================
+# Sessions
+# ======================================================================
+def _connect(account):
+    global _current
+    if latency:
+        time.sleep(latency)
+    accounts.setdefault(account, {})
+    _current = Session(account)
+    _sessions.append(_current)
+    return 1
+
+
+def QMConnectW(host, port, username, password, account):
+    return _connect(account)
+
+
+def QMConnectLocalW(account):
+    return _connect(account)
+
+
+def QMConnectPoolW(host, port, username, password, account, pool):
+    return _connect(account)
+
+
+def QMConnected():
+    return int(_current is not None)
+
+
+def QMGetSession():
+    return _sessions.index(_current) if _current in _sessions else -1
+
+
+def QMSetSession(idx):
+    global _current
+    if idx < 0 or idx >= len(_sessions) or _sessions[idx] is None:
+        return 0
+    _current = _sessions[idx]
+    return 1
+
+
+def QMDisconnect():
+    global _current
+    if _current in _sessions:
+        _sessions[_sessions.index(_current)] = None
+    _current = None
+
+
+def QMDisconnectAll():
+    global _current
+    _sessions[:] = [None] * len(_sessions)
+    _current = None
+
+
+def QMPoolIdle():
+    QMDisconnect()
+
+
+def QMLogtoW(account):
+    session = _round_trip()
+    accounts.setdefault(account, {})
+    session.account = account
+    session.files = {}
+    return 1
+
+
+# ======================================================================
+# Files
+# ======================================================================
+def QMOpenW(filename):
+    session = _round_trip()
+    records = accounts[session.account].setdefault(filename, {})
+    fno = max(session.files, default=0) + 1
+    session.files[fno] = (filename, records)
+    session.set_error(0)
+    return fno
+
+
+def QMClose(fno):
+    session = _round_trip()
+    session.files.pop(fno, None)
+
+
+def QMClearFile(fno):
+    _file(_round_trip(), fno).clear()
+
+
+def _read(fno, id, err):
+    session = _round_trip()
+    rec = _lookup(session, fno, id)
+    if rec is None:
+        session.set_error(2, 'Record {} not found'.format(id))
+        err._obj.value = 2
+        return _string('')
+    session.set_error(0)
+    err._obj.value = 0
+    return _string(rec)
+
+
+def QMReadW(fno, id, err):
+    return _read(fno, id, err)
+
+
+def QMReadlW(fno, id, wait, err):
+    return _read(fno, id, err)
+
+
+def QMReaduW(fno, id, wait, err):
+    return _read(fno, id, err)
+
+
+def _write(fno, id, data):
+    session = _round_trip()
+    if session.txn is not None:
+        session.txn[fno, id] = data
+    elif data is None:
+        _file(session, fno).pop(id, None)
+    else:
+        _file(session, fno)[id] = data
+    session.set_error(0)
+
+
+def QMWriteW(fno, id, data):
+    _write(fno, id, data)
+
+
+def QMWriteuW(fno, id, data):
+    _write(fno, id, data)
+
+
+def QMDeleteW(fno, id):
+    _write(fno, id, None)
+
+
+def QMDeleteuW(fno, id):
+    _write(fno, id, None)
+
+
+def QMReleaseW(fno, id):
+    _round_trip()
+
+
+def QMRecordlockW(fno, id, update, wait):
+    _round_trip()
+
+
+def QMTxn(mode):
+    session = _round_trip()
+    if mode == 1:
+        session.txn = {}
+    elif mode in (2, 4):
+        for (fno, id), rec in (session.txn or {}).items():
+            if rec is None:
+                _file(session, fno).pop(id, None)
+            else:
+                _file(session, fno)[id] = rec
+        session.txn = None
+    elif mode == 3:
+        session.txn = None
+    session.set_error(0)
+
+
+def QMStatus():
+    return _current.status if _current else 0
+
+
+def QMErrorW():
+    return ct.addressof(_current.error if _current else _no_error)
+
+
+# ======================================================================
+# Select lists
+# ======================================================================
+def QMSelect(fno, listno):
+    session = _round_trip()
+    session.lists[listno] = collections.deque(_records(session, fno))
+
+
+def _next_partial(session, listno):
+    ids = session.partial.get(listno, [])
+    batch, session.partial[listno] = ids[:PARTIAL_SIZE], ids[PARTIAL_SIZE:]
+    return _string(mvs.AM.join(batch))
+
+
+def QMSelectPartialW(fno, listno):
+    session = _round_trip()
+    session.partial[listno] = list(_records(session, fno))
+    return _next_partial(session, listno)
+
+
+def QMNextPartialW(listno):
+    return _next_partial(_round_trip(), listno)
+
+
+def QMReadNextW(listno):
+    session = _round_trip()
+    ids = session.lists.get(listno)
+    if not ids:
+        session.set_error(2)
+        return _string('')
+    session.set_error(0)
+    return _string(ids.popleft())
+
+
+def QMReadListW(listno):
+    session = _round_trip()
+    ids = session.lists.pop(listno, [])
+    return _string(mvs.AM.join(ids))
+
+
+def QMClearSelect(listno):
+    session = _round_trip()
+    session.lists.pop(listno, None)
+    session.partial.pop(listno, None)
+
+
+# ======================================================================
+# Alternate key indices
+# ======================================================================
+def _file_indices(session, fno):
+    name = session.files[fno][0]
+    return indices.get(session.account, {}).get(name, {})
+
+
+def _scan(session, fno, index):
+    """
+    Builds the index as it stands now: the sorted keys and the ids
+    holding each one. The scan position is a key number; a position
+    between two keys is a half.
+    """
+    attr = _file_indices(session, fno)[index]
+    attrs = [attr] if isinstance(attr, int) else attr
+    entries = collections.defaultdict(list)
+    for id, rec in _records(session, fno).items():
+        fields = rec.split(mvs.AM) + [''] * max(attrs)
+        if isinstance(attr, int):
+            values = set(fields[attr - 1].split(mvs.VM))
+        else:
+            values = {mvs.compound_key([fields[n - 1].split(mvs.VM)[0]
+                                        for n in attr])}
+        for value in values:
+            if value != '':
+                entries[value].append(id)
+    keys = sorted(entries, key=mvs.key_order)
+    scan = session.scans[fno, index] = [keys, entries, -1]
+    return scan
+
+
+def QMIndicesW(fno, name):
+    session = _round_trip()
+    names = _file_indices(session, fno)
+    if name == '':
+        return _string(mvs.AM.join(names))
+    if name not in names:
+        return _string('')
+    attr = names[name]
+    if isinstance(attr, int):
+        return _string('D' + mvs.AM + str(attr))
+    return _string('I' + mvs.AM + mvs.VM.join(str(n) for n in attr))
+
+
+def QMSelectIndexW(fno, index, value, listno):
+    session = _round_trip()
+    keys, entries, _ = scan = _scan(session, fno, index)
+    orders = [mvs.key_order(key) for key in keys]
+    pos = bisect.bisect_left(orders, mvs.key_order(value))
+    scan[2] = pos if value in entries else pos - 0.5
+    session.lists[listno] = collections.deque(entries.get(value, []))
+    session.set_error(0)
+
+
+def QMSetLeftW(fno, index):
+    session = _round_trip()
+    _scan(session, fno, index)[2] = -1
+
+
+def QMSetRightW(fno, index):
+    session = _round_trip()
+    scan = _scan(session, fno, index)
+    scan[2] = len(scan[0])
+
+
+def _select_step(fno, index, listno, step):
+    session = _round_trip()
+    keys, entries, pos = scan = session.scans[fno, index]
+    pos = math.floor(pos) + 1 if step > 0 else math.ceil(pos) - 1
+    scan[2] = min(max(pos, -1), len(keys))
+    if 0 <= pos < len(keys):
+        key = keys[pos]
+        session.lists[listno] = collections.deque(entries[key])
+        session.set_error(0)
+        return _string(key)
+    session.lists[listno] = collections.deque()
+    session.set_error(2)
+    return _string('')
+
+
+def QMSelectLeftW(fno, index, listno):
+    return _select_step(fno, index, listno, -1)
+
+
+def QMSelectRightW(fno, index, listno):
+    return _select_step(fno, index, listno, 1)
+
+
+# ======================================================================
+# Conversions
+# ======================================================================
+def _conv(s, code, which):
+    session = _round_trip()
+    converters = conv.converters(code)
+    if converters is None:
+        session.set_error(2, 'Conversion {} not supported'.format(code))
+        return _string('')
+    session.set_error(0)
+    return _string(converters[which](s))
+
+
+def QMIConvW(s, code):
+    return _conv(s, code, 0)
+
+
+def QMOConvW(s, code):
+    return _conv(s, code, 1)
+
+
+def QMIConvsW(s, code):
+    _round_trip()
+    return _string(conv.iconvs(s, code))
+
+
+def QMOConvsW(s, code):
+    _round_trip()
+    return _string(conv.oconvs(s, code))
+
+
+# ======================================================================
+# Client side functions
+# ======================================================================
+def QMChecksumW(s):
+    # Not the server's algorithm; only equality of checksums matters
+    return zlib.crc32(s.encode('utf-8')) & 0x7fffffff
+
+
+def QMDcountW(s, delim):
+    return mvs.mv_dcount(s, delim)
+
+
+def QMFieldW(s, delim, occurrence, count):
+    return _string(mvs.mv_field(s, delim, occurrence, count))
+
+
+def QMExtractW(s, f, v, sv):
+    return _string(mvs.DynArray(s).extract(f, v, sv))
+
+
+def QMReplaceW(s, f, v, sv, new_data):
+    dyn = mvs.DynArray(s)
+    dyn.replace(f, v, sv, new_data)
+    return _string(str(dyn))
+
+
+def QMInsW(s, f, v, sv, new_data):
+    dyn = mvs.DynArray(s)
+    dyn.ins(f, v, sv, new_data)
+    return _string(str(dyn))
+
+
+def QMDelW(s, f, v, sv):
+    dyn = mvs.DynArray(s)
+    dyn.delete(f, v, sv)
+    return _string(str(dyn))
+
+
+def QMLocateW(item, s, f, v, sv, pos, order):
+    found, pos._obj.value = mvs.DynArray(s).locate(item, f, v, sv, order)
+    return found
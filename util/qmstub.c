@@ -0,0 +1,188 @@
+/*
+ * Stub QMClient library for benchmarking the Python wrapper.
+ *
+ * Exposes a handful of qmclilib entry points with the same C signatures
+ * as the real library. QMExtractW and QMDcountW behave like the real
+ * functions; the other string functions return a freshly allocated copy
+ * of their input so the cost of the wide string round trip is realistic.
+ * Nothing here talks to a QM server.
+ *
+ * QMReadW, QMIConvW and QMOConvW sleep for $QMSTUB_LATENCY microseconds
+ * (default 0) to stand in for the network round trip to the server.
+ *
+ * Built on demand by bench.py:
+ *   cc -shared -fPIC -O2 -o $QMSYS/bin/qmclilib.so qmstub.c
+ */
+
+#include <stdlib.h>
+#include <string.h>
+#include <unistd.h>
+#include <wchar.h>
+
+#define AM 0xFE
+#define VM 0xFD
+#define SVM 0xFC
+
+static wchar_t *dup_wstrn(const wchar_t *s, size_t n)
+{
+    wchar_t *out = malloc((n + 1) * sizeof(wchar_t));
+    if (n)
+        memcpy(out, s, n * sizeof(wchar_t));
+    out[n] = L'\0';
+    return out;
+}
+
+static wchar_t *dup_wstr(const wchar_t *s)
+{
+    return dup_wstrn(s, s ? wcslen(s) : 0);
+}
+
+/* Finds element n of the len characters at s, delimited by mark */
+static const wchar_t *element(const wchar_t *s, size_t *len, wchar_t mark,
+                              int n)
+{
+    const wchar_t *end = s + *len;
+    const wchar_t *p;
+
+    while (--n > 0) {
+        p = wmemchr(s, mark, end - s);
+        if (!p)
+            return NULL;
+        s = p + 1;
+    }
+    p = wmemchr(s, mark, end - s);
+    *len = (p ? p : end) - s;
+    return s;
+}
+
+void QMFree(void *p)
+{
+    free(p);
+}
+
+static int session = 0;
+static int sessions = 0;
+/* $QMSTUB_LATENCY is read on every call so each benchmark sets its own */
+static void round_trip(void)
+{
+    const char *s = getenv("QMSTUB_LATENCY");
+    long latency = s ? atol(s) : 0;
+
+    if (latency > 0)
+        usleep(latency);
+}
+
+int QMConnectLocalW(const wchar_t *account)
+{
+    session = sessions++;
+    return 1;
+}
+
+int QMConnectPoolW(const wchar_t *host, int port, const wchar_t *username,
+                   const wchar_t *password, const wchar_t *account,
+                   const wchar_t *pool)
+{
+    session = sessions++;
+    return 1;
+}
+
+int QMGetSession(void)
+{
+    return session;
+}
+
+int QMSetSession(int idx)
+{
+    if (idx < 0 || idx >= sessions)
+        return 0;
+    session = idx;
+    return 1;
+}
+
+void QMPoolIdle(void)
+{
+}
+
+void QMDisconnect(void)
+{
+}
+
+int QMLogtoW(const wchar_t *account)
+{
+    return 1;
+}
+
+int QMOpenW(const wchar_t *filename)
+{
+    static int fno = 0;
+    return ++fno;
+}
+
+void QMClose(int fno)
+{
+}
+
+wchar_t *QMIConvW(const wchar_t *s, const wchar_t *code)
+{
+    round_trip();
+    return dup_wstr(s);
+}
+
+wchar_t *QMOConvW(const wchar_t *s, const wchar_t *code)
+{
+    round_trip();
+    return dup_wstr(s);
+}
+
+wchar_t *QMExtractW(const wchar_t *s, int f, int v, int sv)
+{
+    size_t len = wcslen(s);
+
+    s = element(s, &len, AM, f < 1 ? 1 : f);
+    if (s && v > 0)
+        s = element(s, &len, VM, v);
+    if (s && v > 0 && sv > 0)
+        s = element(s, &len, SVM, sv);
+    return s ? dup_wstrn(s, len) : dup_wstr(L"");
+}
+
+wchar_t *QMReplaceW(const wchar_t *s, int f, int v, int sv,
+                    const wchar_t *new_data)
+{
+    return dup_wstr(s);
+}
+
+int QMDcountW(const wchar_t *s, const wchar_t *delim)
+{
+    int n = 1;
+    size_t dl = wcslen(delim);
+    if (!*s)
+        return 0;
+    if (!dl)
+        return 1;
+    while ((s = wcsstr(s, delim)) != NULL) {
+        n++;
+        s += dl;
+    }
+    return n;
+}
+
+wchar_t *QMReadW(int fno, const wchar_t *id, int *err)
+{
+    round_trip();
+    *err = 0;
+    return dup_wstr(id);
+}
+
+void QMWriteW(int fno, const wchar_t *id, const wchar_t *data)
+{
+}
+
+void QMTxn(int mode)
+{
+}
+
+int QMStatus(void)
+{
+    return 0;
+}
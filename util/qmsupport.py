@@ -0,0 +1,539 @@
+"""
+File level helpers built on the qmclient module.
+
+qmclient mirrors the QMClient library one call at a time. The functions
+here combine those calls into the larger operations the exporters and
+the QM database backend need.
+"""
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import mvsupport as mvs
+import qmclient as qm
+
+# qm.Txn() modes
+TXN_START = 1
+TXN_COMMIT = 2
+TXN_ABORT = 3
+TXN_COMMIT_NONDURABLE = 4
+
+# Files kept open per session by open_file()
+MAX_OPEN_FILES = 32
+
+# Session number -> (qm.Account(), OrderedDict of file name -> fno)
+_open_files = {}
+_open_files_lock = threading.Lock()
+
+
+def _session_files():
+    """
+    Returns the open file table of the current session, starting a new
+    one if the session has reconnected or logged to another account
+    since the table was made.
+    """
+    account = qm.Account()
+    if account is None:
+        raise Exception("Not connected to server")
+    session = qm.GetSession()
+    with _open_files_lock:
+        entry = _open_files.get(session)
+        if entry is None or entry[0] != account:
+            entry = _open_files[session] = (account, OrderedDict())
+    return entry[1]
+
+
+def open_file(file_name):
+    """
+    Returns a file number for file_name in the account of the current
+    session, opening the file only the first time it is asked for.
+
+    Up to MAX_OPEN_FILES files are kept open in each session; opening
+    one more closes the least recently used. The file numbers of a
+    session are forgotten when it reconnects or logs to another account
+    (see qm.Account), as the server has closed those files.
+
+    Example:
+        rec, err = qm.Read(open_file('INVOICE'), id)
+    """
+    files = _session_files()
+    fno = files.get(file_name)
+    if fno is not None:
+        files.move_to_end(file_name)
+        return fno
+    fno = qm.Open(file_name)
+    if fno == 0:
+        raise Exception("Cannot open {}: {}".format(file_name, qm.Error()))
+    files[file_name] = fno
+    while len(files) > MAX_OPEN_FILES:
+        qm.Close(files.popitem(last=False)[1])
+    return fno
+
+
+def close_files():
+    """Closes the files opened by open_file() in the current session"""
+    files = _session_files()
+    while files:
+        qm.Close(files.popitem()[1])
+
+
+def create_index(file_name, index, item):
+    """
+    Makes alternate key index on file_name, unless the file has it:
+    item is written to the file dictionary as record index, then the
+    index is created and built on it. Returns True if it was made.
+
+    Building reads the whole file, and the server needs the file to
+    itself while it does.
+
+    Example:
+        create_index('INVOICE', 'CLIENT', 'D' + AM + '1' + AM + ...)
+    """
+    fno = open_file(file_name)
+    if index in qm.Indices(fno, '').split(mvs.AM):
+        return False
+    qm.Write(open_file('DICT ' + file_name), index, item)
+    for command in ('CREATE.INDEX', 'BUILD.INDEX'):
+        out, err = qm.Execute('{} {} {}'.format(command, file_name, index))
+        if err != 0 or qm.Status() != 0:
+            print(out.replace(mvs.AM, '\n'))
+            raise Exception("{} {} {} failed".format(command, file_name,
+                                                     index))
+    return True
+
+
+def _write_batch(fno, batch, durable):
+    """
+    Writes one batch of (id, record) pairs inside a transaction and
+    commits it. The transaction is aborted if anything fails, including
+    a write the server reports through Status().
+    """
+    qm.Txn(TXN_START)
+    try:
+        for id, rec in batch:
+            qm.Write(fno, id, rec)
+            if qm.Status() != 0:
+                raise Exception("Write of {} failed: {}".format(id, qm.Error()))
+        qm.Txn(TXN_COMMIT if durable else TXN_COMMIT_NONDURABLE)
+    except Exception:
+        qm.Txn(TXN_ABORT)
+        raise
+    if qm.Status() != 0:
+        raise Exception("Commit failed: {}".format(qm.Error()))
+
+
+class ChecksumStore(dict):
+    """
+    The checksums (qm.Checksum) of the records last written to a file,
+    by id, kept in a JSON file between runs. bulk_write uses it to skip
+    records that have not changed.
+
+    Records changed on the server by anything else are not noticed;
+    start from an empty store (clear() or delete the file) to write
+    every record again.
+    """
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        if os.path.exists(path):
+            with open(path) as f:
+                self.update(json.load(f))
+
+    def save(self):
+        """Writes the store, replacing the previous file in one step"""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.path + '.tmp', 'w') as f:
+            json.dump(self, f)
+        os.replace(self.path + '.tmp', self.path)
+
+
+def _unchanged(fno, id, rec, checksums, compare):
+    """True if writing rec would leave the record on file as it is"""
+    if checksums is not None:
+        return checksums.get(id) == qm.Checksum(rec)
+    if compare:
+        old, err = qm.Read(fno, id)
+        return err == 0 and old == rec
+    return False
+
+
+class BulkWriter(object):
+    """
+    Writes (id, record) pairs to the file opened as fno as they are
+    added, committing a transaction every batch_size records. Several
+    writers can be fed from one pass over the source data, one per
+    file; each commits its own batches. The arguments are those of
+    bulk_write().
+
+    Example:
+        invoices = BulkWriter(invoice_fno)
+        timesheets = BulkWriter(timesheet_fno)
+        for doc in docs:
+            invoices.add(str(doc['_id']), INVOICE.encode(doc))
+            for ts in doc['detail']:
+                timesheets.add(str(ts['_id']), TIMESHEET.encode(ts))
+        stats = invoices.close(), timesheets.close()
+    """
+
+    def __init__(self, fno, batch_size=500, retries=2, retry_delay=1.0,
+                 durable=True, checksums=None, compare=False):
+        self.fno = fno
+        self.batch_size = batch_size
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.durable = durable
+        self.checksums = checksums
+        self.compare = compare
+        self.stats = {'records': 0, 'skipped': 0, 'batches': 0, 'retries': 0}
+        self.started = time.perf_counter()
+        self.batch = []
+
+    def add(self, id, rec):
+        """Queues one record, writing the batch once it is full"""
+        if _unchanged(self.fno, id, rec, self.checksums, self.compare):
+            self.stats['skipped'] += 1
+            return
+        self.batch.append((id, rec))
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Writes and commits the records queued so far"""
+        if not self.batch:
+            return
+        for attempt in range(self.retries + 1):
+            try:
+                _write_batch(self.fno, self.batch, self.durable)
+                break
+            except Exception:
+                if attempt == self.retries:
+                    raise
+                self.stats['retries'] += 1
+                time.sleep(self.retry_delay * (attempt + 1))
+        self.stats['records'] += len(self.batch)
+        self.stats['batches'] += 1
+        if self.checksums is not None:
+            for id, rec in self.batch:
+                self.checksums[id] = qm.Checksum(rec)
+        self.batch = []
+
+    def close(self):
+        """
+        Writes the last batch and returns the statistics described
+        under bulk_write(), timed from when the writer was created.
+        """
+        self.flush()
+        stats = self.stats
+        elapsed = time.perf_counter() - self.started
+        done = stats['records'] + stats['skipped']
+        stats['seconds'] = elapsed
+        stats['rate'] = done / elapsed if elapsed else 0
+        return stats
+
+
+def bulk_write(fno, records, batch_size=500, retries=2, retry_delay=1.0,
+               durable=True, checksums=None, compare=False):
+    """
+    Writes (id, record) pairs from any iterable to the file opened as
+    fno, committing a transaction every batch_size records.
+
+    A batch that fails is aborted and written again up to retries times,
+    waiting retry_delay seconds longer before each attempt. If it still
+    fails the exception is raised; earlier batches stay committed.
+
+    Unchanged records can be skipped. checksums is a dict of id ->
+    checksum of the record last written, such as a ChecksumStore;
+    records with the same checksum are not written, and the dict is
+    updated as batches commit. Without checksums, compare=True reads
+    each record first and skips it if it is the same, which saves the
+    write but not the round trip.
+
+    Returns a dict of statistics: records (written), skipped, batches,
+    retries, seconds and rate (records per second, written or skipped).
+
+    Example:
+        stats = bulk_write(fno, ((str(n), rec) for n, rec in rows))
+    """
+    writer = BulkWriter(fno, batch_size, retries, retry_delay, durable,
+                        checksums, compare)
+    for id, rec in records:
+        writer.add(id, rec)
+    return writer.close()
+
+
+def _list_chunks(listno):
+    """Yields the ids of select list listno as one batch"""
+    ids = qm.ReadList(listno)
+    if ids != '':
+        yield ids.split(mvs.AM)
+
+
+def _partial_chunks(fno, listno):
+    """Yields the id batches of a partial select of the whole file"""
+    ids = qm.SelectPartial(fno, listno)
+    while ids != '':
+        yield ids.split(mvs.AM)
+        ids = qm.NextPartial(listno)
+
+
+def select_iter(fno, index=None, value=None, records=False, listno=1):
+    """
+    Iterates over the ids of a file, or of the records holding value
+    in alternate key index, without building the whole select list on
+    the client.
+
+    A whole file select uses SelectPartial/NextPartial so the ids arrive
+    in batches sized by the server. The ids an index select finds are
+    taken with a single ReadList.
+
+    If records is true (id, record) pairs are yielded instead of ids.
+    Records deleted since the select was made are skipped.
+
+    listno is the select list used; it is cleared when iteration ends,
+    including when the caller stops early.
+
+    Example:
+        for id, rec in select_iter(fno, 'CLIENT', '12', records=True):
+            ...
+    """
+    if index is None:
+        chunks = _partial_chunks(fno, listno)
+    else:
+        qm.SelectIndex(fno, index, value, listno)
+        chunks = _list_chunks(listno)
+    try:
+        for ids in chunks:
+            if not records:
+                yield from ids
+                continue
+            for id in ids:
+                rec, err = qm.Read(fno, id)
+                if err == 0:
+                    yield id, rec
+    finally:
+        qm.ClearSelect(listno)
+
+
+def index_range(fno, index, low=None, high=None, descending=False,
+                records=False, listno=1):
+    """
+    Iterates over the ids of the records whose value in alternate key
+    index lies between low and high (inclusive, either may be None for
+    an open end), walking the index one key at a time, so the cost is
+    in proportion to the matches rather than to the size of the file.
+
+    The scan is positioned with SelectIndex at the first key of the
+    range, or with SetLeft/SetRight if that end is open, and moves with
+    SelectRight (SelectLeft if descending) until it leaves the range.
+    Each key costs one select and one ReadList; keys holding numbers,
+    such as internal dates, are compared as numbers.
+
+    If records is true (id, record) pairs are yielded instead of ids.
+    listno is the select list used; it is cleared when iteration ends.
+
+    Example:
+        for id, rec in index_range(fno, 'DATE', '18900', '18930',
+                                   records=True):
+            ...
+    """
+    start, stop = (high, low) if descending else (low, high)
+    step = qm.SelectLeft if descending else qm.SelectRight
+    if stop is not None:
+        stop = mvs.key_order(stop)
+
+    def beyond(key):
+        order = mvs.key_order(key)
+        return order < stop if descending else order > stop
+
+    def keys():
+        if start is None:
+            (qm.SetRight if descending else qm.SetLeft)(fno, index)
+        else:
+            qm.SelectIndex(fno, index, start, listno)
+            yield qm.ReadList(listno)
+        while True:
+            key = step(fno, index, listno)
+            ids = qm.ReadList(listno)
+            if key == '' and ids == '':
+                break
+            if stop is not None and beyond(key):
+                break
+            yield ids
+
+    try:
+        for ids in keys():
+            if ids == '':
+                continue
+            for id in ids.split(mvs.AM):
+                if not records:
+                    yield id
+                    continue
+                rec, err = qm.Read(fno, id)
+                if err == 0:
+                    yield id, rec
+    finally:
+        qm.ClearSelect(listno)
+
+
+def log_requests(app, logger=None):
+    """
+    Turns on qmclient call statistics (see qm.Instrument) and logs the
+    QM calls made by every request to the Flask application app: the
+    number of calls and milliseconds spent per function. logger defaults
+    to app.logger.
+
+    The statistics are process wide, so under a threaded server the
+    figures for a request include calls made by requests running at the
+    same time.
+    """
+    logger = logger or app.logger
+    local = threading.local()
+    qm.Instrument()
+
+    def totals():
+        return {name: (entry['count'], entry['seconds'])
+                for name, entry in qm.Stats()['functions'].items()}
+
+    @app.before_request
+    def start_request():
+        local.totals = totals()
+
+    @app.after_request
+    def log_request(response):
+        before = getattr(local, 'totals', {})
+        calls = []
+        for name, (count, seconds) in sorted(totals().items()):
+            count_before, seconds_before = before.get(name, (0, 0.0))
+            if count > count_before:
+                calls.append('{} {} {:.1f}ms'.format(
+                    name, count - count_before,
+                    (seconds - seconds_before) * 1000))
+        if calls:
+            logger.info('QM calls: %s', ', '.join(calls))
+        return response
+
+
+class SessionPool(object):
+    """
+    A bounded pool of QMClient sessions for threaded servers.
+
+    Sessions are opened with qm.ConnectPool as they are needed, up to
+    max_size. A thread checks a session out, which binds it to that
+    thread (see qm.ThreadSessions), and checks it back in when done.
+    Sessions left idle for more than idle_timeout seconds are handed
+    back to the server with qm.PoolIdle; ConnectPool reawakens those
+    server processes cheaply when the pool grows again.
+
+    Example:
+        pool = SessionPool('localhost', -1, 'user', 'pw', 'QMUSERS', 'web')
+        with pool.session():
+            rec, err = qm.Read(fno, id)
+    """
+
+    def __init__(self, host, port, username, password, account, pool='',
+                 max_size=4, idle_timeout=300):
+        self.connect_args = (host, port, username, password, account, pool)
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.size = 0
+        self.idle = []
+        self.cond = threading.Condition()
+        self.local = threading.local()
+        qm.ThreadSessions()
+
+    def _connect(self):
+        if qm.ConnectPool(*self.connect_args) != 1:
+            raise Exception("Cannot connect to server {}".format(qm.Error()))
+        return qm.GetSession()
+
+    def _reap(self):
+        """
+        Idles sessions unused for idle_timeout. Called holding cond.
+        The calling thread's own session binding is left as it was.
+        """
+        expired = time.monotonic() - self.idle_timeout
+        if not self.idle or self.idle[0][1] >= expired:
+            return
+        bound = qm.BoundSession()
+        while self.idle and self.idle[0][1] < expired:
+            session, _ = self.idle.pop(0)
+            qm.SetSession(session)
+            qm.PoolIdle()
+            self.size -= 1
+        if bound is None:
+            qm.UnbindSession()
+        else:
+            qm.SetSession(bound)
+
+    def checkout(self, timeout=None):
+        """
+        Returns a session bound to the calling thread, waiting up to
+        timeout seconds (forever if None) when all max_size sessions
+        are in use. A thread that already holds a session gets it back.
+        """
+        session = getattr(self.local, 'session', None)
+        if session is not None:
+            self.local.depth += 1
+            return session
+        with self.cond:
+            self._reap()
+            if not self.idle and self.size >= self.max_size:
+                if not self.cond.wait_for(
+                        lambda: self.idle or self.size < self.max_size,
+                        timeout):
+                    raise Exception("No QM session available")
+            if self.idle:
+                session = self.idle.pop()[0]
+            else:
+                self.size += 1
+        if session is None:
+            try:
+                session = self._connect()
+            except Exception:
+                with self.cond:
+                    self.size -= 1
+                    self.cond.notify()
+                raise
+        qm.SetSession(session)
+        self.local.session = session
+        self.local.depth = 1
+        return session
+
+    def checkin(self):
+        """Returns the calling thread's session to the pool"""
+        if getattr(self.local, 'session', None) is None:
+            raise Exception("No QM session checked out by this thread")
+        self.local.depth -= 1
+        if self.local.depth:
+            return
+        session = self.local.session
+        self.local.session = None
+        qm.UnbindSession()
+        with self.cond:
+            self.idle.append((session, time.monotonic()))
+            self._reap()
+            self.cond.notify()
+
+    @contextmanager
+    def session(self, timeout=None):
+        """Checks a session out for the duration of a with block"""
+        session = self.checkout(timeout)
+        try:
+            yield session
+        finally:
+            self.checkin()
+
+    def close(self):
+        """Disconnects the idle sessions"""
+        with self.cond:
+            for session, _ in self.idle:
+                qm.SetSession(session)
+                qm.Disconnect()
+                self.size -= 1
+            self.idle = []
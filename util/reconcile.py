@@ -0,0 +1,149 @@
+"""
+Compares the QM files with the Mongo invoices they are exported from.
+
+Each record is reduced to a digest on both sides: qm.Checksum of the
+record read from QM, and qm.Checksum of the record export.py would
+write for the Mongo document. The digests are folded into buckets of
+BUCKET_SIZE consecutive ids, so the first pass keeps one hash per
+bucket rather than one per record; ids that are not numbers share one
+bucket. Only the buckets whose hashes differ are compared id by id in
+a second pass, which reads just those ids from Mongo and just those
+records from QM.
+
+Ids in Mongo but not in QM are reported as missing, ids in QM but not
+in Mongo as extra, and ids on both sides with different records as
+divergent.
+
+Use:
+    python reconcile.py                 compare INVOICE and TIMESHEET
+    python reconcile.py TIMESHEET       compare the named files only
+"""
+import argparse
+import hashlib
+import export
+import qmclient as qm
+import qmsupport as qms
+
+# Ids per bucket
+BUCKET_SIZE = 1000
+
+def bucket_of(id, bucket_size):
+    """The bucket of an id, None for an id that is not a number"""
+    try:
+        return int(id) // bucket_size
+    except ValueError:
+        return None
+
+def digest(id, checksum):
+    """A 64 bit hash of one record, folded into its bucket with xor"""
+    key = '{}:{}'.format(id, checksum).encode('utf-8')
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), 'big')
+
+def bucket_hashes(records, bucket_size):
+    """Returns bucket -> (count, hash) for (id, checksum) pairs"""
+    buckets = {}
+    for id, checksum in records:
+        bucket = bucket_of(id, bucket_size)
+        count, hash = buckets.get(bucket, (0, 0))
+        buckets[bucket] = (count + 1, hash ^ digest(id, checksum))
+    return buckets
+
+def mongo_checksums(file_name, buckets=None, bucket_size=BUCKET_SIZE):
+    """
+    Yields (id, checksum) pairs of the records export.py writes to
+    file_name, only for the ids in buckets if given
+    """
+    fields, records = export.TARGETS[file_name]
+    if buckets is None:
+        queries = [{}]
+    else:
+        numbered = sorted(bucket for bucket in buckets if bucket is not None)
+        id_key = export.ID_KEYS[file_name]
+        queries = [{id_key: {'$gte': bucket * bucket_size,
+                             '$lt': (bucket + 1) * bucket_size}}
+                   for bucket in numbered]
+        if None in buckets:
+            queries.append({'$or': [{id_key: {'$type': 'string'}},
+                                    {id_key: {'$type': 'objectId'}}]})
+    for query in queries:
+        invoices = export.db.invoice.find(query, fields)
+        for invoice in invoices.batch_size(export.CURSOR_BATCH_SIZE):
+            for id, rec in records(invoice):
+                if buckets is None or bucket_of(id, bucket_size) in buckets:
+                    yield id, qm.Checksum(rec)
+
+def qm_checksums(file_name, buckets=None, bucket_size=BUCKET_SIZE):
+    """
+    Yields (id, checksum) pairs of the records of file_name, only for
+    the ids in buckets if given. Records are only read for those ids.
+    """
+    fno = qms.open_file(file_name)
+    if buckets is None:
+        for id, rec in qms.select_iter(fno, records=True):
+            yield id, qm.Checksum(rec)
+        return
+    for id in qms.select_iter(fno):
+        if bucket_of(id, bucket_size) in buckets:
+            rec, err = qm.Read(fno, id)
+            if err == 0:
+                yield id, qm.Checksum(rec)
+
+def _id_order(id):
+    return (0, int(id), id) if id.isdigit() else (1, 0, id)
+
+def reconcile(file_name, bucket_size=BUCKET_SIZE):
+    """
+    Compares file_name with the Mongo invoices. Returns a dict of the
+    number of buckets, the buckets that differ and the missing, extra
+    and divergent ids.
+    """
+    mongo = bucket_hashes(mongo_checksums(file_name, None, bucket_size),
+                          bucket_size)
+    qm_side = bucket_hashes(qm_checksums(file_name, None, bucket_size),
+                            bucket_size)
+    differ = {bucket for bucket in set(mongo) | set(qm_side)
+              if mongo.get(bucket) != qm_side.get(bucket)}
+    result = {'buckets': len(set(mongo) | set(qm_side)),
+              'differ': len(differ), 'missing': [], 'extra': [],
+              'divergent': []}
+    if not differ:
+        return result
+    expected = dict(mongo_checksums(file_name, differ, bucket_size))
+    actual = dict(qm_checksums(file_name, differ, bucket_size))
+    for id, checksum in expected.items():
+        if id not in actual:
+            result['missing'].append(id)
+        elif actual[id] != checksum:
+            result['divergent'].append(id)
+    result['extra'] = [id for id in actual if id not in expected]
+    for key in ('missing', 'extra', 'divergent'):
+        result[key].sort(key=_id_order)
+    return result
+
+def report(file_name, result):
+    print("{}: {} of {} buckets differ".format(file_name, result['differ'],
+                                               result['buckets']))
+    for key, text in (('missing', 'missing from QM'),
+                      ('extra', 'only in QM'),
+                      ('divergent', 'different')):
+        if result[key]:
+            print("{}: {} {}: {}".format(file_name, len(result[key]), text,
+                                         ' '.join(result[key])))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Compare the QM files with the Mongo invoices')
+    parser.add_argument('files', nargs='*', metavar='FILE',
+                        help='QM files to compare (default: all)')
+    parser.add_argument('--bucket-size', type=int, default=BUCKET_SIZE,
+                        help='ids per bucket')
+    args = parser.parse_args()
+    for file_name in args.files:
+        if file_name not in export.TARGETS:
+            parser.error('no export to {}'.format(file_name))
+    export.qm_connect()
+    export.mongo_connect()
+    for file_name in args.files or ['INVOICE', 'TIMESHEET']:
+        report(file_name, reconcile(file_name, args.bucket_size))
+    qm.Disconnect()
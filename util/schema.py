@@ -0,0 +1,269 @@
+"""
+Record layouts of the QM files that mirror the Mongo collections.
+
+A Schema lists the attributes of a file: attribute number, document
+key, conversion code and whether the attribute is multi-valued. It is
+compiled into an encoder that turns a Mongo document into a dynamic
+array and a decoder that turns a dynamic array back into a document,
+each in a single pass over the attributes.
+
+Records are written as the original export_invoice and
+export_timesheet wrote them. A missing key is written as the default
+of its attribute, normally an empty field, and a null or empty value
+as an empty field. An empty field decodes to no key at all, so a
+decoded document only holds what the record holds; an empty
+multi-valued attribute decodes to an empty list.
+
+Example:
+    rec = INVOICE.encode(invoice)
+    qm.Write(fno, str(invoice['_id']), rec)
+
+    rec, err = qm.Read(fno, '1042')
+    invoice = INVOICE.decode(rec, '1042')
+"""
+import datetime
+
+import conv
+import mvsupport as mvs
+from conv import EPOCH
+
+
+class Attr(object):
+    """
+    One attribute of a record layout.
+
+    number  the attribute number
+    key     the document key
+    conv    the conversion code applied on the way in and out, if any
+    type    converts the external value of the attribute when decoding;
+            a bool is written with str() and read back by TRUE
+    multi   the attribute holds a list, one value per element
+    subkey  for a list of sub-documents, the key stored from each one
+    default the internal value written when the key is missing
+    index   the name of the alternate key index on the attribute, if any
+    """
+
+    def __init__(self, number, key, conv='', type=str, multi=False,
+                 subkey=None, default='', index=None):
+        self.number = number
+        self.key = key
+        self.conv = conv
+        self.type = type
+        self.multi = multi
+        self.subkey = subkey
+        self.default = default
+        self.index = index
+
+
+class Compound(object):
+    """
+    A compound alternate key index on several attributes, keyed on
+    mvsupport.compound_key of their internal values; on the server it
+    is an I-type index such as FMT(CLIENT,'R%10'):'*':FMT(DATE,'R%10').
+    A filter on all but the last key and a range of the last walks the
+    index over just the matching records, in order of the last key.
+
+    name    the name of the index
+    keys    the document keys, most significant first
+    """
+
+    def __init__(self, name, keys):
+        self.name = name
+        self.keys = keys
+
+
+# Internal values read as true for a bool attribute. The exports write
+# str(value), True, and Y when the key is missing
+TRUE = ('True', 'Y', '1')
+
+
+def _to_internal(attr):
+    """Returns a function converting one external value to internal"""
+    code = attr.conv
+    if not code:
+        return str
+    converters = conv.converters(code)
+    if converters is None:
+        return lambda value: conv.iconv(value, code)
+    return converters[0]
+
+
+def _to_external(attr):
+    """Returns a function converting one internal value to external"""
+    code = attr.conv
+    type = attr.type
+    if type is bool:
+        return lambda value: value in TRUE
+    if not code:
+        return type
+    if code[0] == 'D':
+        return lambda value: EPOCH + datetime.timedelta(days=int(value))
+    converters = conv.converters(code)
+    if converters is None:
+        return lambda value: type(conv.oconv(value, code))
+    oconv = converters[1]
+    return lambda value: type(oconv(value))
+
+
+def _encoder(attr):
+    key = attr.key
+    default = attr.default
+    subkey = attr.subkey
+    convert = _to_internal(attr)
+
+    if attr.multi:
+        def encode(doc):
+            if key not in doc:
+                return default
+            values = doc[key]
+            if not values:
+                return ''
+            if subkey is not None:
+                values = [value[subkey] for value in values]
+            return mvs.VM.join(['' if value in ('', None) else convert(value)
+                                for value in values])
+    else:
+        def encode(doc):
+            if key not in doc:
+                return default
+            value = doc[key]
+            return '' if value in ('', None) else convert(value)
+    return encode
+
+
+def _decoder(attr):
+    subkey = attr.subkey
+    convert = _to_external(attr)
+
+    if attr.multi:
+        def decode(field):
+            if field == '':
+                return []
+            values = ['' if value == '' else convert(value)
+                      for value in field.split(mvs.VM)]
+            if subkey is not None:
+                values = [{subkey: value} for value in values]
+            return values
+    else:
+        decode = convert
+    return decode
+
+
+# Schemas by file name
+FILES = {}
+
+
+class Schema(object):
+    """
+    The record layout of a QM file. encode(doc) and decode(rec, id)
+    are compiled from the attribute list when the schema is created.
+    """
+
+    def __init__(self, file_name, attrs, id_key='_id', id_type=int,
+                 compound=()):
+        self.file_name = file_name
+        self.attrs = sorted(attrs, key=lambda attr: attr.number)
+        self.compound = list(compound)
+        self.id_key = id_key
+        self.id_type = id_type
+        self.encode = self._compile_encoder()
+        self.decode = self._compile_decoder()
+        FILES[file_name] = self
+
+    def attr(self, key):
+        """Returns the attribute stored under document key"""
+        for attr in self.attrs:
+            if attr.key == key:
+                return attr
+        raise KeyError(key)
+
+    def index(self, key):
+        """Returns the name of the alternate key index on document key"""
+        index = self.attr(key).index
+        if index is None:
+            raise Exception("{} has no index on {}".format(self.file_name,
+                                                          key))
+        return index
+
+    def index_names(self):
+        """Returns the names of the alternate key indices of the file"""
+        return ([attr.index for attr in self.attrs if attr.index] +
+                [index.name for index in self.compound])
+
+    def index_items(self):
+        """
+        Returns the dictionary items the alternate key indices of the
+        file are built on, as (name, record) pairs: a D-type item for
+        each indexed attribute and an I-type item building the
+        mvsupport.compound_key of each compound index.
+        """
+        items = []
+        for attr in self.attrs:
+            if attr.index:
+                items.append((attr.index, mvs.AM.join(
+                    ['D', str(attr.number), '', attr.index, '10R',
+                     'M' if attr.multi else 'S'])))
+        for index in self.compound:
+            expr = ":'*':".join("FMT({},'R%{}')".format(
+                self.attr(key).index, mvs.KEY_WIDTH) for key in index.keys)
+            items.append((index.name, mvs.AM.join(
+                ['I', expr, '', index.name, '21L', 'S'])))
+        return items
+
+    def _compile_encoder(self):
+        width = self.attrs[-1].number if self.attrs else 0
+        encoders = [lambda doc: ''] * width
+        for attr in self.attrs:
+            encoders[attr.number - 1] = _encoder(attr)
+        join = mvs.AM.join
+
+        def encode(doc):
+            """Returns the dynamic array for a document"""
+            return join([encode(doc) for encode in encoders]).rstrip(mvs.AM)
+        return encode
+
+    def _compile_decoder(self):
+        decoders = [(attr.number - 1, attr.key, attr.multi, _decoder(attr))
+                    for attr in self.attrs]
+        id_key = self.id_key
+        id_type = self.id_type
+
+        def decode(rec, id=None):
+            """Returns the document for a dynamic array"""
+            fields = rec.split(mvs.AM)
+            count = len(fields)
+            doc = {} if id is None else {id_key: id_type(id)}
+            for n, key, multi, decode in decoders:
+                field = fields[n] if n < count else ''
+                if field != '':
+                    doc[key] = decode(field)
+                elif multi:
+                    doc[key] = []
+            return doc
+        return decode
+
+
+INVOICE = Schema('INVOICE', [
+    Attr(1, 'client', type=int, index='CLIENT'),
+    Attr(2, 'date', conv='D2MDY', index='DATE'),
+    Attr(3, 'hours', type=float),
+    Attr(4, 'amount', conv='MR2', type=float),
+    Attr(5, 'close_date', conv='D2MDY', index='CLOSE.DATE'),
+    Attr(6, 'sent'),
+    Attr(7, 'posted', type=bool, default='Y'),
+    Attr(8, 'check_id'),
+    Attr(9, 'rate', conv='MR2', type=float, default='5000'),
+    Attr(10, 'detail', type=int, multi=True, subkey='_id'),
+    Attr(11, 'status'),
+    Attr(12, 'check_number'),
+    Attr(13, 'paid_date', conv='D2MDY', index='PAID.DATE'),
+    Attr(14, 'period', type=int),
+], compound=[Compound('CLIENT.DATE', ['client', 'date'])])
+
+# The invoice attribute is the _id of the invoice holding the timesheet
+TIMESHEET = Schema('TIMESHEET', [
+    Attr(1, 'date', conv='D2MDY', index='DATE'),
+    Attr(2, 'description'),
+    Attr(3, 'hours', type=float),
+    Attr(4, 'invoice', type=int, index='INVOICE'),
+])